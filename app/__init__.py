@@ -19,6 +19,7 @@ socketio = SocketIO()
 def create_app(config_name='default'):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    app.config['CONFIG_NAME'] = config_name
     config[config_name].init_app(app)
 
     # Initialize extensions
@@ -27,7 +28,6 @@ def create_app(config_name='default'):
     login_manager.init_app(app)
     bcrypt.init_app(app)
     mail.init_app(app)
-    socketio.init_app(app)
 
     # Register blueprints
     # I will create and register blueprints for different parts of the app
@@ -69,6 +69,23 @@ def create_app(config_name='default'):
     from app.messaging import messaging as messaging_blueprint
     app.register_blueprint(messaging_blueprint, url_prefix='/messaging')
 
+    from app.jobs import jobs as jobs_blueprint
+    app.register_blueprint(jobs_blueprint, url_prefix='/jobs')
+
+    # After the blueprints, so that Socket.IO handlers registered on import are
+    # attached to the server of every app, not only the first one created
+    from app.socketio_queue import socketio_options
+    socketio.init_app(app, **socketio_options(app))
+
+    from app.jobs.runner import job_queue
+    job_queue.init_app(app)
+
+    from app.mailer import mail_dispatcher
+    mail_dispatcher.init_app(app)
+
+    from app.audit import audit_writer
+    audit_writer.init_app(app)
+
     # Set default session filters for company and year
     @app.before_request
     def before_request_hook():
@@ -78,26 +95,20 @@ def create_app(config_name='default'):
             session['year'] = date.today().year
 
     # Load email settings from DB, overriding environment variables if they exist in the DB.
-    with app.app_context():
-        from .models import Setting
-        from sqlalchemy.exc import OperationalError
-        try:
-            # Set static Gmail config
-            app.config['MAIL_SERVER'] = 'smtp.googlemail.com'
-            app.config['MAIL_PORT'] = 587
-            app.config['MAIL_USE_TLS'] = True
-
-            # Load dynamic settings from DB
-            settings = {s.key: s.value for s in Setting.query.all()}
-            app.config['MAIL_USERNAME'] = settings.get('MAIL_USERNAME')
-            app.config['MAIL_PASSWORD'] = settings.get('MAIL_PASSWORD')
-            app.config['MAIL_SENDER_NAME'] = settings.get('MAIL_SENDER_NAME')
-            app.config['MAIL_DEFAULT_SENDER'] = settings.get('MAIL_USERNAME') # Sender email is the username
-
-        except OperationalError:
-            # This can happen if the db is not yet initialized.
-            # It's safe to ignore in that case.
-            pass
+    from sqlalchemy.exc import OperationalError
+    from app.settings import load_settings, all_settings
+
+    # Set static Gmail config
+    app.config['MAIL_SERVER'] = 'smtp.googlemail.com'
+    app.config['MAIL_PORT'] = 587
+    app.config['MAIL_USE_TLS'] = True
+    try:
+        # Settings are cached in memory from here on (see app/settings.py)
+        load_settings(app)
+    except OperationalError:
+        # This can happen if the db is not yet initialized.
+        # It's safe to ignore in that case.
+        pass
 
     # Error Handlers
     @app.errorhandler(403)
@@ -114,9 +125,8 @@ def create_app(config_name='default'):
 
     @app.context_processor
     def inject_branding():
-        from .models import Setting
         try:
-            settings = {s.key: s.value for s in Setting.query.all()}
+            settings = all_settings()
             return dict(
                 light_logo_url=settings.get('light_logo_url'),
                 dark_logo_url=settings.get('dark_logo_url'),
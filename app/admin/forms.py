@@ -46,9 +46,9 @@ class GenerateTempCodeForm(FlaskForm):
         self.permission.choices = [(p.id, p.name) for p in Permission.query.order_by('name')]
 
 class UploadForm(FlaskForm):
-    excel_file = FileField('Excel File', validators=[
+    excel_file = FileField('Excel or CSV File', validators=[
         FileRequired(),
-        FileAllowed(['xlsx'], 'Excel files only!')
+        FileAllowed(['xlsx', 'csv'], 'Excel or CSV files only!')
     ])
     submit = SubmitField('Upload and Process')
 
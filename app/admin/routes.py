@@ -1,17 +1,21 @@
 from flask import render_template, redirect, url_for, flash, request, session, current_app, jsonify
-from flask_login import login_required
+from flask_login import login_required, current_user
 from app import db
 from app.admin import admin
 import os
-import pandas as pd
 from werkzeug.utils import secure_filename
 from app.decorators import permission_required
-from app.models import Role, Permission, User, TemporaryAccessCode, AuditLog, Patient, Setting
+from app.models import Role, Permission, User, TemporaryAccessCode, AuditLog, Patient, Job
 from .forms import RoleForm, EditUserForm, ChangePasswordForm, GenerateTempCodeForm, UploadForm, BrandingForm, EmailSettingsForm
 import secrets
-from datetime import datetime, timedelta, UTC
+from datetime import date, datetime, timedelta, UTC
 from app.utils import log_audit
-from app.patient.routes import calculate_age
+from app.audit import audit_page
+from app.audit_archive import load_index
+from app.jobs.runner import job_queue
+from app import notifications
+from app.importer import enqueue_roster_import
+from app.settings import all_settings, save_settings
 
 @admin.route('/')
 @login_required
@@ -57,6 +61,7 @@ def edit_role(role_id):
         for perm_id in form.permissions.data:
             perm = Permission.query.get(perm_id)
             role.permissions.append(perm)
+        role.permissions_changed()
         db.session.commit()
         log_audit('EDIT_ROLE', f'Role edited: {role.name} (ID: {role.id})')
         flash('The role has been updated.', 'success')
@@ -75,6 +80,7 @@ def delete_role(role_id):
         flash('You cannot delete this protected role.', 'danger')
         return redirect(url_for('admin.list_roles'))
     log_audit('DELETE_ROLE', f'Role deleted: {role.name} (ID: {role.id})')
+    role.permissions_changed()
     db.session.delete(role)
     db.session.commit()
     flash('The role has been deleted.', 'success')
@@ -103,6 +109,7 @@ def edit_user(user_id):
         for role_id in form.roles.data:
             role = Role.query.get(role_id)
             user.roles.append(role)
+        user.permissions_changed()
 
         db.session.commit()
         log_audit('EDIT_USER', f'User edited: {user.phone_number} (ID: {user.id})')
@@ -170,99 +177,52 @@ def upload_data():
     if form.validate_on_submit():
         f = form.excel_file.data
         filename = secure_filename(f.filename)
-        filepath = os.path.join('uploads', filename)
-        f.save(filepath)
-
-        try:
-            df = pd.read_excel(filepath)
-
-            required_columns = ['staff_id', 'patient_id', 'first_name', 'last_name', 'department', 'gender', 'date_of_birth', 'contact_phone', 'email_address', 'race', 'nationality']
-            if not all(col in df.columns for col in required_columns):
-                flash('Excel file is missing one or more required columns.', 'danger')
-                return redirect(url_for('admin.upload_data'))
-
-            success_count = 0
-            error_rows = []
-
-            for index, row in df.iterrows():
-                # Basic validation
-                if pd.isna(row['staff_id']) or pd.isna(row['first_name']) or pd.isna(row['date_of_birth']):
-                    error_rows.append(index + 2) # +2 to account for 0-based index and header
-                    continue
-
-                # Check for duplicates before adding
-                exists = Patient.query.filter_by(
-                    staff_id=str(row['staff_id']),
-                    company=session.get('company', 'DCP'),
-                    screening_year=session.get('year', datetime.now(UTC).year)
-                ).first()
-
-                if exists:
-                    error_rows.append(index + 2)
-                    continue
-
-                age = calculate_age(row['date_of_birth'].to_pydatetime().date())
-
-                patient = Patient(
-                    staff_id=str(row['staff_id']),
-                    patient_id=str(row['patient_id']),
-                    first_name=row['first_name'],
-                    middle_name=row.get('middle_name', ''),
-                    last_name=row['last_name'],
-                    department=row['department'],
-                    gender=row['gender'],
-                    date_of_birth=row['date_of_birth'],
-                    age=age,
-                    contact_phone=str(row['contact_phone']),
-                    email_address=row['email_address'],
-                    race=row['race'],
-                    nationality=row['nationality'],
-                    company=session.get('company', 'DCP'),
-                    screening_year=session.get('year', datetime.now(UTC).year)
-                )
-                db.session.add(patient)
-                success_count += 1
-
-            db.session.commit()
-            log_audit('UPLOAD_PATIENTS', f'Successfully uploaded {success_count} patients from file: {filename}')
-            flash(f'Successfully imported {success_count} patient records.', 'success')
-            if error_rows:
-                flash(f'Skipped {len(error_rows)} rows due to missing data or duplicates: {", ".join(map(str, error_rows))}', 'warning')
-
-        except Exception as e:
-            db.session.rollback()
-            flash(f'An error occurred during processing: {e}', 'danger')
-        finally:
-            os.remove(filepath) # Clean up the uploaded file
-
-        return redirect(url_for('admin.upload_data'))
-
-    return render_template('admin/upload_data.html', title='Upload Patient Data', form=form, session=session)
+
+        # The request's stream closes when it ends, so it is spooled to disk for the job
+        job = enqueue_roster_import(
+            f.stream,
+            filename,
+            company=session.get('company', 'DCP'),
+            year=session.get('year', datetime.now(UTC).year),
+            user_id=current_user.id
+        )
+        flash(f'Import of {filename} has started. You can leave this page; progress is shown below.', 'info')
+        return redirect(url_for('admin.upload_data', job=job.id))
+
+    job_id = request.args.get('job', type=int)
+    job = Job.query.get(job_id) if job_id else None
+    return render_template('admin/upload_data.html', title='Upload Patient Data', form=form, session=session, job=job)
 
 @admin.route('/audit_trails')
 @login_required
 @permission_required('view_audit_log')
 def audit_trails():
-    page = request.args.get('page', 1, type=int)
-    logs = AuditLog.query.order_by(AuditLog.timestamp.desc()).paginate(page=page, per_page=50)
-    return render_template('admin/audit_trails.html', title='Audit Trails', logs=logs)
+    filters = {
+        'action': request.args.get('action', '').strip().upper() or None,
+        'user_id': request.args.get('user_id', type=int),
+        'start': request.args.get('start', type=date.fromisoformat),
+        'end': request.args.get('end', type=date.fromisoformat)
+    }
+    logs = audit_page(after=request.args.get('after'), before=request.args.get('before'), **filters)
+    # Query string for the pagination links, keeping the filters that are set
+    filter_args = {k: v.isoformat() if isinstance(v, date) else v for k, v in filters.items() if v is not None}
+    return render_template('admin/audit_trails.html', title='Audit Trails', logs=logs, filters=filter_args,
+                           archive=load_index(), retention_days=current_app.config['AUDIT_RETENTION_DAYS'])
+
+@admin.route('/audit_trails/archive', methods=['POST'])
+@login_required
+@permission_required('manage_settings')
+def archive_audit_trails():
+    job = job_queue.enqueue('audit_archive', user_id=current_user.id, max_attempts=1)
+    log_audit('ARCHIVE_AUDIT_LOG', f'Queued archival of old audit events (job #{job.id}).')
+    flash('Archiving old audit events. The live table size before and after is shown below when it finishes.', 'info')
+    return redirect(url_for('admin.audit_trails'))
 
 @admin.route('/api/notifications')
 @login_required
 @permission_required('manage_roles') # Only admins should see notifications
 def get_notifications():
-    notifiable_actions = ['GENERATE_TEMP_CODE', 'REVOKE_TEMP_CODE', 'USER_REGISTER']
-    notifications = AuditLog.query.filter(
-        AuditLog.action.in_(notifiable_actions),
-        AuditLog.notified == False
-    ).order_by(AuditLog.timestamp.desc()).limit(5).all()
-
-    return jsonify([{
-        'id': n.id,
-        'action': n.action,
-        'details': n.details,
-        'timestamp': n.timestamp.isoformat() + 'Z'
-    } for n in notifications])
+    return jsonify(notifications.unread_notifications())
 
 @admin.route('/api/notifications/mark_read', methods=['POST'])
 @login_required
@@ -272,6 +232,7 @@ def mark_notifications_read():
     if ids_to_mark:
         AuditLog.query.filter(AuditLog.id.in_(ids_to_mark)).update({'notified': True}, synchronize_session=False)
         db.session.commit()
+        notifications.publish_read(ids_to_mark)
     return jsonify({'status': 'success'})
 
 @admin.route('/branding', methods=['GET', 'POST'])
@@ -285,13 +246,7 @@ def branding():
             'hospital_name': form.hospital_name.data,
             'organization_name': form.organization_name.data
         }
-        for key, value in settings_to_update.items():
-            if value:
-                setting = Setting.query.filter_by(key=key).first()
-                if not setting:
-                    setting = Setting(key=key)
-                setting.value = value
-                db.session.add(setting)
+        settings_to_update = {key: value for key, value in settings_to_update.items() if value}
 
         # Handle file uploads
         logo_fields = {
@@ -309,26 +264,23 @@ def branding():
                 os.makedirs(os.path.dirname(filepath), exist_ok=True)
 
                 file_data.save(filepath)
+                settings_to_update[key] = f'/static/logos/{filename}'
 
-                setting = Setting.query.filter_by(key=key).first()
-                if not setting:
-                    setting = Setting(key=key)
-                setting.value = f'/static/logos/{filename}'
-                db.session.add(setting)
-
+        save_settings(settings_to_update)
         db.session.commit()
         log_audit('UPDATE_BRANDING', 'Updated site branding and logos.')
         flash('Branding settings have been updated.', 'success')
         return redirect(url_for('admin.branding'))
 
     # Pre-populate the form
-    form.hospital_name.data = Setting.query.filter_by(key='hospital_name').first().value if Setting.query.filter_by(key='hospital_name').first() else ''
-    form.organization_name.data = Setting.query.filter_by(key='organization_name').first().value if Setting.query.filter_by(key='organization_name').first() else ''
+    settings = all_settings()
+    form.hospital_name.data = settings.get('hospital_name', '')
+    form.organization_name.data = settings.get('organization_name', '')
 
     current_logos = {
-        'light': Setting.query.filter_by(key='light_logo_url').first(),
-        'dark': Setting.query.filter_by(key='dark_logo_url').first(),
-        'favicon': Setting.query.filter_by(key='favicon_url').first()
+        'light': settings.get('light_logo_url'),
+        'dark': settings.get('dark_logo_url'),
+        'favicon': settings.get('favicon_url')
     }
 
     return render_template('admin/branding.html', title='Branding and Logos', form=form, logos=current_logos)
@@ -343,29 +295,21 @@ def email_settings():
             'MAIL_USERNAME': form.mail_username.data,
             'MAIL_SENDER_NAME': form.mail_sender_name.data,
         }
-        for key, value in settings_to_update.items():
-            if value:
-                setting = Setting.query.filter_by(key=key).first()
-                if not setting:
-                    setting = Setting(key=key)
-                setting.value = value
-                db.session.add(setting)
-
-        # Update or create MAIL_PASSWORD, only if a new password is provided
+        settings_to_update = {key: value for key, value in settings_to_update.items() if value}
+
+        # Update MAIL_PASSWORD only if a new password is provided
         if form.mail_password.data:
-            password_setting = Setting.query.filter_by(key='MAIL_PASSWORD').first()
-            if not password_setting:
-                password_setting = Setting(key='MAIL_PASSWORD')
-            password_setting.value = form.mail_password.data
-            db.session.add(password_setting)
+            settings_to_update['MAIL_PASSWORD'] = form.mail_password.data
 
+        save_settings(settings_to_update)
         db.session.commit()
         log_audit('UPDATE_EMAIL_SETTINGS', 'Updated email configuration.')
-        flash('Email settings have been updated. The application may need to be restarted for changes to take effect.', 'info')
+        flash('Email settings have been updated.', 'info')
         return redirect(url_for('admin.email_settings'))
 
     # Pre-populate the form
-    form.mail_username.data = Setting.query.filter_by(key='MAIL_USERNAME').first().value if Setting.query.filter_by(key='MAIL_USERNAME').first() else ''
-    form.mail_sender_name.data = Setting.query.filter_by(key='MAIL_SENDER_NAME').first().value if Setting.query.filter_by(key='MAIL_SENDER_NAME').first() else ''
+    settings = all_settings()
+    form.mail_username.data = settings.get('MAIL_USERNAME', '')
+    form.mail_sender_name.data = settings.get('MAIL_SENDER_NAME', '')
 
     return render_template('admin/email_settings.html', title='Email Settings', form=form)
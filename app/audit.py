@@ -0,0 +1,194 @@
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta, UTC
+from sqlalchemy import insert, tuple_
+from app import db, socketio
+from app.models import AuditLog, User
+from app import notifications
+from app.audit_archive import search_archive
+from app.pagination import encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+
+class AuditWriter:
+    """
+    Buffers audit events in memory and writes them to the AuditLog table in
+    batched inserts on a connection of its own, so an audited request neither
+    waits for an extra transaction nor commits the caller's session.
+
+    A background task flushes the buffer every AUDIT_FLUSH_INTERVAL seconds,
+    or sooner once AUDIT_BATCH_SIZE events are waiting. Whatever is still
+    buffered when the process exits cleanly is written by an atexit hook.
+    With AUDIT_WRITE_INLINE set (used in tests) each event is written at once.
+    """
+    def __init__(self, app=None):
+        self._buffer = deque()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._started = False
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['audit_writer'] = self
+        self.app = app
+        if not app.config['AUDIT_WRITE_INLINE']:
+            atexit.register(self.flush, app)
+
+        # As with the job queue, the flusher starts on the first request so
+        # that CLI commands do not spawn it; their events are written at exit.
+        @app.before_request
+        def start_audit_writer():
+            if not self._started:
+                self.start(app)
+
+    def log(self, action, details=None, user_id=None):
+        """Buffers one event, timestamped now. Never touches the database in the calling thread."""
+        self._buffer.append({
+            'user_id': user_id,
+            'action': action,
+            'details': details,
+            'timestamp': datetime.now(UTC),
+            'notified': False
+        })
+        if self.app.config['AUDIT_WRITE_INLINE']:
+            self.flush(self.app)
+        elif len(self._buffer) >= self.app.config['AUDIT_BATCH_SIZE']:
+            self._wakeup.set()
+
+    def start(self, app):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if not app.config['AUDIT_WRITE_INLINE']:
+            socketio.start_background_task(self._worker, app)
+
+    def flush(self, app):
+        """Writes every buffered event. Events that fail to insert stay buffered for the next flush."""
+        with self._flush_lock:
+            rows = []
+            while self._buffer:
+                rows.append(self._buffer.popleft())
+            if not rows:
+                return
+            table = AuditLog.__table__
+            statement = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+            try:
+                with app.app_context(), db.engine.begin() as connection:
+                    batch_size = app.config['AUDIT_BATCH_SIZE']
+                    for start in range(0, len(rows), batch_size):
+                        batch = rows[start:start + batch_size]
+                        for row, log_id in zip(batch, connection.execute(statement, batch).scalars()):
+                            row['id'] = log_id
+            except Exception:
+                logger.exception('Could not write %s audit events; keeping them for the next flush', len(rows))
+                for row in rows:
+                    row.pop('id', None)
+                self._buffer.extendleft(reversed(rows))
+                return
+        notifications.publish(rows)
+
+    def _worker(self, app):
+        interval = app.config['AUDIT_FLUSH_INTERVAL']
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            self.flush(app)
+
+
+audit_writer = AuditWriter()
+
+
+class AuditPage:
+    """
+    One page of the audit trail, newest first. `next_cursor` leads to older
+    events and `prev_cursor` to newer ones; either is None at that end.
+    """
+    def __init__(self, items, next_cursor, prev_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def audit_page(after=None, before=None, action=None, user_id=None, start=None, end=None, per_page=50):
+    """
+    A page of audit events using keyset pagination on (timestamp, id): the
+    query seeks straight to the cursor through an index instead of counting
+    and skipping rows, so every page costs the same however deep it is.
+
+    `after` pages towards older events and `before` towards newer ones.
+    `action` and `user_id` filter exactly; `start` and `end` are dates, both
+    inclusive. Each filter is served by one of the (..., timestamp, id) indexes
+    on AuditLog. Rows moved to the archive (see app/audit_archive.py) are
+    searched too, once a page reaches past the oldest live row.
+    """
+    key = tuple_(AuditLog.timestamp, AuditLog.id)
+    query = AuditLog.query
+    if action:
+        query = query.filter(AuditLog.action == action)
+    if user_id is not None:
+        query = query.filter(AuditLog.user_id == user_id)
+    if start:
+        query = query.filter(AuditLog.timestamp >= datetime.combine(start, datetime.min.time()))
+    if end:
+        query = query.filter(AuditLog.timestamp < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+
+    after, before = decode_cursor(after), decode_cursor(before)
+    filters = {'action': action, 'user_id': user_id, 'start': start, 'end': end}
+    if before:
+        # Walk forwards from the cursor, then show the page newest first
+        rows = query.filter(key > before).order_by(AuditLog.timestamp, AuditLog.id).limit(per_page + 1).all()
+        rows = _merge_archive(rows, search_archive(low=before, limit=per_page + 1, newest_first=False, **filters),
+                              per_page + 1, newest_first=False)
+        more_newer = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        more_older = True
+    else:
+        if after:
+            query = query.filter(key < after)
+        rows = query.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(per_page + 1).all()
+        if len(rows) <= per_page:
+            # Archived rows are older than every live row, so they are only needed past the end of the table
+            rows = _merge_archive(rows, search_archive(high=after, limit=per_page + 1, **filters), per_page + 1)
+        more_older = len(rows) > per_page
+        rows = rows[:per_page]
+        more_newer = after is not None
+
+    return AuditPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1]) if rows and more_older else None,
+        prev_cursor=encode_cursor(rows[0]) if rows and more_newer else None
+    )
+
+
+def _merge_archive(live, archived, limit, newest_first=True):
+    """
+    Live and archived rows in one (timestamp, id) order, up to `limit`. A row
+    present in both (left behind by an interrupted archival run) appears once.
+    Rows are matched on (timestamp, id): SQLite reuses the ids of archived rows.
+    """
+    if not archived:
+        return live
+    live_keys = {(log.timestamp, log.id) for log in live}
+    rows = live + [log for log in archived if (log.timestamp, log.id) not in live_keys]
+    rows.sort(key=lambda log: (log.timestamp, log.id), reverse=newest_first)
+    rows = rows[:limit]
+
+    user_ids = {log.user_id for log in rows if getattr(log, 'archived', False) and log.user_id}
+    users = {user.id: user for user in User.query.filter(User.id.in_(user_ids))} if user_ids else {}
+    for log in rows:
+        if getattr(log, 'archived', False):
+            log.user = users.get(log.user_id)
+    return rows
@@ -0,0 +1,204 @@
+import fcntl
+import gzip
+import heapq
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta, UTC
+from flask import current_app
+from sqlalchemy import delete, func
+from app import db
+from app.jobs.runner import job_queue
+from app.models import AuditLog
+
+# Rows moved out of AuditLog per transaction during an archival run
+ARCHIVE_BATCH_SIZE = 1000
+# Archival runs remembered in the index, newest last
+MAX_RUNS_KEPT = 20
+
+FIELDS = ['id', 'user_id', 'action', 'details', 'timestamp', 'notified']
+
+
+def archive_dir():
+    return current_app.config['AUDIT_ARCHIVE_DIR'] or os.path.join(current_app.instance_path, 'audit_archive')
+
+
+def segment_name(timestamp):
+    return f'audit-{timestamp:%Y-%m}.ndjson.gz'
+
+
+def load_index():
+    """
+    The segment index: for each monthly segment its row count, size on disk and
+    the (timestamp, id) range it holds, plus a summary of recent archival runs.
+    """
+    try:
+        with open(os.path.join(archive_dir(), 'index.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'segments': {}, 'runs': []}
+
+
+def _save_index(index):
+    directory = archive_dir()
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, os.path.join(directory, 'index.json'))
+
+
+@contextmanager
+def _archive_lock():
+    """
+    Holds an exclusive flock on the archive directory's lock file, so only one
+    archival run, in any thread or worker process, writes segments at a time.
+    """
+    with open(os.path.join(archive_dir(), '.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _to_record(log):
+    record = {field: getattr(log, field) for field in FIELDS}
+    record['timestamp'] = log.timestamp.isoformat()
+    return record
+
+
+def _append(name, records):
+    """
+    Appends records to a segment as a new gzip member. Segments are only ever
+    appended to; gzip readers treat the concatenated members as one stream.
+    """
+    path = os.path.join(archive_dir(), name)
+    data = ''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records).encode('utf-8')
+    with open(path, 'ab') as f:
+        f.write(gzip.compress(data))
+        f.flush()
+        os.fsync(f.fileno())
+    return os.path.getsize(path)
+
+
+def live_row_count():
+    return db.session.query(func.count(AuditLog.id)).scalar()
+
+
+def archive_audit_logs(older_than_days=None, progress=None):
+    """
+    Moves AuditLog rows older than `older_than_days` (default
+    AUDIT_RETENTION_DAYS) into monthly gzip'd NDJSON segments, oldest first.
+    Each batch is written and fsynced before its rows are deleted, so a crash
+    can at worst leave a row both archived and live (reads skip the duplicate),
+    never lose it. Returns a summary of the run, which is also kept in the index.
+    """
+    days = current_app.config['AUDIT_RETENTION_DAYS'] if older_than_days is None else older_than_days
+    cutoff = datetime.now(UTC).replace(tzinfo=None) - timedelta(days=days)
+    os.makedirs(archive_dir(), exist_ok=True)
+
+    with _archive_lock():
+        index = load_index()
+        before = live_row_count()
+        archived = 0
+        while True:
+            logs = AuditLog.query.filter(AuditLog.timestamp < cutoff)\
+                                 .order_by(AuditLog.timestamp, AuditLog.id).limit(ARCHIVE_BATCH_SIZE).all()
+            if not logs:
+                break
+            by_segment = {}
+            for log in logs:
+                by_segment.setdefault(segment_name(log.timestamp), []).append(_to_record(log))
+            for name, records in by_segment.items():
+                segment = index['segments'].setdefault(name, {
+                    'rows': 0, 'first': records[0]['timestamp'], 'first_id': records[0]['id']
+                })
+                segment['bytes'] = _append(name, records)
+                segment['rows'] += len(records)
+                segment['last'], segment['last_id'] = records[-1]['timestamp'], records[-1]['id']
+            _save_index(index)
+
+            db.session.execute(delete(AuditLog).where(AuditLog.id.in_([log.id for log in logs])))
+            db.session.commit()
+            archived += len(logs)
+            if progress:
+                progress(archived)
+
+        run = {
+            'finished_at': datetime.now(UTC).replace(tzinfo=None).isoformat(timespec='seconds'),
+            'cutoff': cutoff.isoformat(timespec='seconds'),
+            'archived': archived,
+            'live_rows_before': before,
+            'live_rows_after': live_row_count(),
+            'archive_bytes': sum(s['bytes'] for s in index['segments'].values())
+        }
+        index['runs'] = (index['runs'] + [run])[-MAX_RUNS_KEPT:]
+        _save_index(index)
+        return run
+
+
+class ArchivedAuditLog:
+    """An archived audit row, with the attributes the audit trail reads from an AuditLog."""
+    def __init__(self, record):
+        self.id = record['id']
+        self.user_id = record['user_id']
+        self.action = record['action']
+        self.details = record['details']
+        self.timestamp = datetime.fromisoformat(record['timestamp'])
+        self.notified = record['notified']
+        self.user = None
+        self.archived = True
+
+
+def _segment_overlaps(segment, low, high):
+    """Whether a segment can hold rows with (timestamp, id) strictly between `low` and `high`."""
+    first = (datetime.fromisoformat(segment['first']), segment['first_id'])
+    last = (datetime.fromisoformat(segment['last']), segment['last_id'])
+    return (low is None or last > low) and (high is None or first < high)
+
+
+def search_archive(low=None, high=None, action=None, user_id=None, start=None, end=None, limit=50, newest_first=True):
+    """
+    Archived rows with (timestamp, id) strictly between `low` and `high` that
+    match the filters, up to `limit`, newest or oldest first. Only segments
+    whose range in the index overlaps the window are read. A row archived
+    twice (a run that crashed before deleting its batch) is returned once;
+    rows are told apart by (timestamp, id), as SQLite reuses archived ids.
+    """
+    segments = load_index()['segments']
+    if not segments:
+        return []
+    if start:
+        start_key = (datetime.combine(start, datetime.min.time()), 0)
+        low = max(low, start_key) if low else start_key
+    if end:
+        end_key = (datetime.combine(end + timedelta(days=1), datetime.min.time()), 0)
+        high = min(high, end_key) if high else end_key
+
+    found = {}
+    for name in sorted(segments, reverse=newest_first):
+        if not _segment_overlaps(segments[name], low, high):
+            continue
+        with gzip.open(os.path.join(archive_dir(), name), 'rt', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if action and record['action'] != action:
+                    continue
+                if user_id is not None and record['user_id'] != user_id:
+                    continue
+                key = (datetime.fromisoformat(record['timestamp']), record['id'])
+                if (low is None or key > low) and (high is None or key < high):
+                    found[key] = record
+        # Segments are whole months in order, so once enough rows are found the rest are further away
+        if len(found) >= limit:
+            break
+
+    pick = heapq.nlargest if newest_first else heapq.nsmallest
+    return [ArchivedAuditLog(found[key]) for key in pick(limit, found)]
+
+
+@job_queue.handler('audit_archive')
+def audit_archive_job(ctx, payload):
+    return archive_audit_logs(payload.get('older_than_days'),
+                              progress=lambda done: ctx.progress(done, message=f'{done} audit rows archived'))
@@ -30,6 +30,7 @@ def register():
         # The user object has the new ID after the commit
         if user.email_address:
             send_email(user.email_address, 'Welcome to Legit HealthCare Services', 'email/welcome', user=user)
+            db.session.commit()
         log_audit('USER_REGISTER', f'New user registered: {user.phone_number} (ID: {user.id})')
         flash('Congratulations, you are now a registered user!', 'success')
         return redirect(url_for('auth.login'))
@@ -98,12 +99,13 @@ def forgot_password():
             # Send email
             reset_url = url_for('auth.reset_password', token=token, _external=True)
             send_email(
-                recipient=form.email.data,
+                to=form.email.data,
                 subject='Password Reset Request',
                 template='email/password_reset',
                 user=email_user,
                 reset_url=reset_url
             )
+            db.session.commit()
 
             flash('A password reset link has been sent to your email.', 'info')
             return redirect(url_for('auth.login'))
@@ -0,0 +1,112 @@
+from sqlalchemy import case, exists, func, select
+from app import db
+from app.models import (Patient, Consultation, FullBloodCount, KidneyFunctionTest, LipidProfile, LiverFunctionTest,
+                        ECG, Spirometry, Audiometry, DirectorReview)
+
+WORKLIST_PAGE_SIZE = 50
+WORKLIST_MAX_PAGE_SIZE = 500
+
+# The records a patient's screening is complete with, in worklist column order:
+# (key, label, record model, endpoint that enters it for a patient_id).
+COMPLETION_RECORDS = [
+    ('full_blood_count', 'FBC', FullBloodCount, 'results.full_blood_count_form'),
+    ('kidney_function_test', 'KFT', KidneyFunctionTest, 'results.kidney_function_test_form'),
+    ('lipid_profile', 'Lipid', LipidProfile, 'results.lipid_profile_form'),
+    ('liver_function_test', 'LFT', LiverFunctionTest, 'results.liver_function_test_form'),
+    ('ecg', 'ECG', ECG, 'results.ecg_form'),
+    ('spirometry', 'Spirometry', Spirometry, 'results.spirometry_form'),
+    ('audiometry', 'Audiometry', Audiometry, 'results.audiometry_form'),
+    ('consultation', 'Consultation', Consultation, 'consultation.consultation_form'),
+    ('director_review', 'Director Review', DirectorReview, 'director.review'),
+]
+COMPLETION_KEYS = [key for key, _, _, _ in COMPLETION_RECORDS]
+
+
+def _has(model):
+    # Each record table has a unique index on patient_id, so this is one index probe per patient
+    return exists().where(model.patient_id == Patient.id)
+
+
+class WorklistPage:
+    """
+    One page of a company/year worklist in staff ID order. `next_cursor` and
+    `prev_cursor` are the staff IDs to continue after or before; either is
+    None at that end.
+    """
+    def __init__(self, items, next_cursor, prev_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def worklist_page(company, year, missing=None, after=None, before=None, per_page=WORKLIST_PAGE_SIZE):
+    """
+    A page of patients in a company/year with a completion flag for each of
+    COMPLETION_RECORDS, from a single query: the cohort is a range scan of
+    ix_patient_company_year_staff_id and each flag an EXISTS on its record
+    table, so no record is loaded.
+
+    `missing` limits the page to patients without that record (a key of
+    COMPLETION_RECORDS), which gives each lab bench its queue. Pages are keyed
+    on staff ID, unique within a company/year: `after` continues forwards and
+    `before` backwards. Each item is a dict of the patient's id, staff_id,
+    name, per-record `completed` flags and the keys still `missing`.
+    """
+    records = {key: model for key, _, model, _ in COMPLETION_RECORDS}
+    if missing is not None and missing not in records:
+        raise ValueError(f'Unknown record: {missing}')
+    per_page = min(per_page or WORKLIST_PAGE_SIZE, WORKLIST_MAX_PAGE_SIZE)
+
+    query = select(Patient.id, Patient.staff_id, Patient.first_name, Patient.last_name,
+                   *[_has(model).label(key) for key, model in records.items()])\
+        .where(Patient.company == company, Patient.screening_year == year)
+    if missing:
+        query = query.where(~_has(records[missing]))
+
+    if before:
+        # Walk backwards from the cursor, then show the page in staff ID order
+        rows = db.session.execute(query.where(Patient.staff_id < before)
+                                  .order_by(Patient.staff_id.desc()).limit(per_page + 1)).all()
+        more_before = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        more_after = True
+    else:
+        if after:
+            query = query.where(Patient.staff_id > after)
+        rows = db.session.execute(query.order_by(Patient.staff_id).limit(per_page + 1)).all()
+        more_after = len(rows) > per_page
+        rows = rows[:per_page]
+        more_before = after is not None
+
+    items = []
+    for row in rows:
+        completed = {key: bool(getattr(row, key)) for key in COMPLETION_KEYS}
+        items.append({
+            'id': row.id,
+            'staff_id': row.staff_id,
+            'name': f'{row.first_name} {row.last_name}',
+            'completed': completed,
+            'missing': [key for key in COMPLETION_KEYS if not completed[key]]
+        })
+    return WorklistPage(
+        items,
+        next_cursor=items[-1]['staff_id'] if items and more_after else None,
+        prev_cursor=items[0]['staff_id'] if items and more_before else None
+    )
+
+
+def missing_counts(company, year):
+    """Patients in a company/year and how many of them lack each record, from one aggregate query."""
+    row = db.session.execute(
+        select(func.count(Patient.id),
+               *[func.coalesce(func.sum(case((_has(model), 0), else_=1)), 0).label(key)
+                 for key, _, model, _ in COMPLETION_RECORDS])
+        .where(Patient.company == company, Patient.screening_year == year)
+    ).one()
+    return {'patients': row[0], 'missing': {key: getattr(row, key) for key in COMPLETION_KEYS}}
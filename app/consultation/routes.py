@@ -3,15 +3,17 @@ from flask_login import login_required
 from app import db
 from app.consultation import consultation
 from app.models import Patient, Consultation
+from app.report_cache import invalidate_patient_reports
+from app.search import search_patients
 from .forms import ConsultationForm
 
 @consultation.route('/', methods=['GET', 'POST'])
 @login_required
 def index():
-    if request.method == 'POST':
-        search_term = request.form.get('search_term', '')
+    search_term = request.values.get('search_term')
+    if search_term is not None:
         # For now, we search by Staff ID. This can be expanded later.
-        patients = Patient.query.filter(Patient.staff_id.ilike(f'%{search_term}%')).all()
+        patients = search_patients(search_term, after=request.args.get('after', type=int))
         return render_template('consultation/index.html', title='Search Patient', patients=patients, search_term=search_term)
 
     return render_template('consultation/index.html', title='Search Patient')
@@ -38,6 +40,7 @@ def consultation_form(patient_id):
             flash('Consultation record saved successfully!', 'success')
 
         db.session.commit()
+        invalidate_patient_reports(patient.id)
         return redirect(url_for('consultation.index'))
 
     return render_template('consultation/form.html', title='Consultation', form=form, patient=patient)
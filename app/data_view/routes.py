@@ -2,18 +2,30 @@ from flask import render_template, request, redirect, url_for, flash, session
 from flask_login import login_required
 from app.data_view import data_view
 from app.models import Patient
-from app import db
-from app.patient.forms import PatientRegistrationForm
+from app import db, staff_index, registration_stats
+from app.patient.forms import PatientRegistrationForm, DEPARTMENTS
+from app.patient_listing import patient_page
 from datetime import date
 from app.utils import log_audit
+from app.report_cache import invalidate_patient_reports
+
+GENDERS = ['Male', 'Female', 'Other']
+
+def listing_filters():
+    """The department and gender filters of a patient listing, from the query string."""
+    filters = {
+        'department': request.args.get('department', '').strip() or None,
+        'gender': request.args.get('gender', '').strip() or None
+    }
+    return {k: v for k, v in filters.items() if v is not None}
 
 @data_view.route('/all')
 @login_required
 def view_all_patients():
-    page = request.args.get('page', 1, type=int)
-    patients = Patient.query.order_by(Patient.date_registered.desc()).paginate(
-        page=page, per_page=20)
-    return render_template('data_view/view_all.html', title='All Patients', patients=patients)
+    filters = listing_filters()
+    patients = patient_page(after=request.args.get('after'), before=request.args.get('before'), **filters)
+    return render_template('data_view/view_all.html', title='All Patients', patients=patients, filters=filters,
+                           departments=DEPARTMENTS, genders=GENDERS)
 
 @data_view.route('/delete/<int:patient_id>', methods=['POST'])
 @login_required
@@ -24,8 +36,11 @@ def delete_patient(patient_id):
     # if not. For now, we assume this is the desired behavior.
     # A soft delete (marking as inactive) might be a better approach in a real-world scenario.
     log_audit('DELETE_PATIENT', f'Patient deleted: {patient.staff_id} (ID: {patient.id})')
+    registration_stats.patient_removed(patient)
     db.session.delete(patient)
     db.session.commit()
+    staff_index.patient_deleted(patient)
+    invalidate_patient_reports(patient_id)
     flash(f'Patient {patient.first_name} {patient.last_name} has been deleted.', 'success')
     return redirect(url_for('data_view.view_all_patients'))
 
@@ -41,6 +56,8 @@ def edit_patient(patient_id):
 
     # We need to prevent validation on fields that should be unique, but are already set for this user
     if form.validate_on_submit():
+        # Gender and age may change, so move the patient to their new dashboard bucket
+        registration_stats.patient_removed(patient)
         patient.staff_id = form.staff_id.data
         patient.patient_id = form.patient_id.data
         patient.first_name = form.first_name.data
@@ -54,7 +71,10 @@ def edit_patient(patient_id):
         patient.email_address = form.email_address.data
         patient.race = form.race.data
         patient.nationality = form.nationality.data
+        registration_stats.patient_added(patient)
         db.session.commit()
+        invalidate_patient_reports(patient.id)
+        staff_index.patient_saved(patient)
         log_audit('EDIT_PATIENT', f'Patient edited: {patient.staff_id} (ID: {patient.id})')
         flash('Patient information has been updated.', 'success')
         return redirect(url_for('data_view.view_all_patients'))
@@ -64,12 +84,10 @@ def edit_patient(patient_id):
 @data_view.route('/yearly')
 @login_required
 def view_yearly_records():
-    page = request.args.get('page', 1, type=int)
     company = session.get('company', 'DCP')
     year = session.get('year', date.today().year)
-
-    patients = Patient.query.filter_by(company=company, screening_year=year)\
-        .order_by(Patient.date_registered.desc())\
-        .paginate(page=page, per_page=20)
-
-    return render_template('data_view/view_yearly.html', title=f'{year} Records ({company})', patients=patients)
+    filters = listing_filters()
+    patients = patient_page(company, year, after=request.args.get('after'), before=request.args.get('before'),
+                            **filters)
+    return render_template('data_view/view_yearly.html', title=f'{year} Records ({company})', patients=patients,
+                           filters=filters, departments=DEPARTMENTS, genders=GENDERS)
@@ -5,6 +5,9 @@ from app.director import director
 from app.models import Patient, DirectorReview, Spirometry, Audiometry, ECG
 from .forms import DirectorReviewForm
 from app.decorators import permission_required
+from app.report_cache import invalidate_patient_reports
+from app.search import search_patients, autocomplete_staff_ids, patient_summary
+from app.patient_records import get_full_patient_or_404
 from datetime import datetime
 
 @director.route('/', methods=['GET', 'POST'])
@@ -17,14 +20,14 @@ def index():
     if request.method == 'POST':
         search_term = request.form.get('search_term', '').strip()
         company = request.form.get('company', 'DCP')
-        year = request.form.get('year', '2025')
+        year = request.form.get('year', 2025, type=int)
 
         if not search_term:
-            flash('Please enter a Staff ID to search.', 'warning')
+            flash('Please enter a Staff ID or name to search.', 'warning')
             return redirect(url_for('director.index'))
 
-        patients = Patient.query.filter_by(company=company, screening_year=year)\
-                                .filter(Patient.staff_id.ilike(f'%{search_term}%')).all()
+        mode = request.form.get('mode', 'staff_id')
+        patients = search_patients(search_term, company, year, mode=mode).items
 
         return render_template('director/index.html', title='Search Results', patients=patients, search_term=search_term)
 
@@ -41,19 +44,13 @@ def api_search():
     company = request.args.get('company', 'DCP')
     year = request.args.get('year', datetime.now().year, type=int)
 
-    if not search_term:
-        return jsonify([])
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 10, type=int)
 
-    patients = Patient.query.filter_by(company=company, screening_year=year)\
-                            .filter(Patient.staff_id.ilike(f'%{search_term}%')).limit(10).all()
-
-    return jsonify([{
-        'id': p.id,
-        'staff_id': p.staff_id,
-        'first_name': p.first_name,
-        'last_name': p.last_name,
-        'department': p.department
-    } for p in patients])
+    if request.args.get('mode') == 'name':
+        results = search_patients(search_term, company, year, page=page, per_page=per_page, mode='name')
+        return jsonify([patient_summary(p) for p in results])
+    return jsonify(autocomplete_staff_ids(search_term, company, year, page=page, per_page=per_page).items)
 
 @director.route('/review/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
@@ -62,17 +59,7 @@ def review(patient_id):
     """
     Main page for the director to review a patient's full details and submit a review.
     """
-    patient = Patient.query.options(
-        db.joinedload(Patient.consultation),
-        db.joinedload(Patient.full_blood_count),
-        db.joinedload(Patient.kidney_function_test),
-        db.joinedload(Patient.lipid_profile),
-        db.joinedload(Patient.liver_function_test),
-        db.joinedload(Patient.ecg),
-        db.joinedload(Patient.spirometry),
-        db.joinedload(Patient.audiometry),
-        db.joinedload(Patient.director_review)
-    ).get_or_404(patient_id)
+    patient = get_full_patient_or_404(patient_id)
 
     review_record = patient.director_review
     form = DirectorReviewForm(obj=review_record)
@@ -110,6 +97,7 @@ def review(patient_id):
                 db.session.add(new_ecg)
 
         db.session.commit()
+        invalidate_patient_reports(patient.id)
         flash('Patient review and results have been updated successfully!', 'success')
         return redirect(url_for('director.review', patient_id=patient.id))
 
@@ -0,0 +1,313 @@
+import csv
+import io
+import os
+import secrets
+import shutil
+from datetime import date
+from flask import current_app
+import pandas as pd
+from openpyxl import load_workbook
+from sqlalchemy import insert
+from app import db, socketio, staff_index, registration_stats
+from app.models import Patient
+from app.jobs.runner import job_queue, PermanentJobError
+from app.utils import log_audit
+
+# Header row expected in an uploaded roster.
+REQUIRED_COLUMNS = ['staff_id', 'patient_id', 'first_name', 'last_name', 'department', 'gender',
+                    'date_of_birth', 'contact_phone', 'email_address', 'race', 'nationality']
+
+# Columns backed by NOT NULL fields on Patient. A blank cell in any of these rejects the row.
+MANDATORY_FIELDS = ['staff_id', 'patient_id', 'first_name', 'last_name', 'department', 'gender',
+                    'date_of_birth', 'contact_phone', 'race', 'nationality']
+
+TEXT_FIELDS = ['staff_id', 'patient_id', 'first_name', 'middle_name', 'last_name', 'department',
+               'gender', 'contact_phone', 'email_address', 'race', 'nationality']
+
+# Number of rows sent to the database per INSERT statement.
+IMPORT_CHUNK_SIZE = 500
+
+# Spreadsheet row number of the first data row (row 1 is the header).
+FIRST_DATA_ROW = 2
+
+# Bytes copied at a time when spooling an upload to disk for its import job.
+UPLOAD_COPY_CHUNK_SIZE = 64 * 1024
+
+
+class RosterFormatError(ValueError):
+    """Raised when an uploaded roster cannot be imported at all (e.g. missing columns)."""
+
+
+class ImportResult:
+    """
+    Outcome of a roster import: how many patients were inserted and which
+    spreadsheet rows were rejected, with the reason for each.
+    """
+    def __init__(self):
+        self.inserted = 0
+        self.rejected = []  # list of (row_number, reason)
+
+    def rejected_by_reason(self):
+        """Groups rejected row numbers by reason, preserving first-seen order."""
+        grouped = {}
+        for row_number, reason in self.rejected:
+            grouped.setdefault(reason, []).append(row_number)
+        return grouped
+
+
+def check_columns(columns):
+    missing = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing:
+        raise RosterFormatError(f'The file is missing required columns: {", ".join(missing)}.')
+
+
+def load_existing_keys(company, year):
+    """
+    Loads, in one query each, the staff IDs already registered for this
+    company/year and the patient IDs already used in this screening year.
+    """
+    staff_ids = {s for (s,) in db.session.query(Patient.staff_id).filter_by(company=company, screening_year=year)}
+    patient_ids = {p for (p,) in db.session.query(Patient.patient_id).filter_by(screening_year=year)}
+    return staff_ids, patient_ids
+
+
+def _as_text(series):
+    """
+    Converts a roster column to trimmed strings with blanks as <NA>.
+    Numeric IDs read from Excel as floats (1234.0) are rendered as '1234'.
+    """
+    if pd.api.types.is_float_dtype(series):
+        present = series.dropna()
+        if (present % 1 == 0).all():
+            series = series.astype('Int64')
+    text = series.astype('string').str.strip()
+    return text.mask(text == '')
+
+
+def calculate_ages(dob, today=None):
+    """Vectorized equivalent of calculate_age for a datetime Series."""
+    today = today or date.today()
+    before_birthday = (dob.dt.month > today.month) | ((dob.dt.month == today.month) & (dob.dt.day > today.day))
+    return today.year - dob.dt.year - before_birthday.astype(int)
+
+
+def prepare_rows(df, company, year, existing_staff_ids, existing_patient_ids):
+    """
+    Validates a block of roster rows as a whole and returns (records, rejected).
+
+    The frame's index must hold the spreadsheet row numbers. `records` is a
+    list of dicts ready for a bulk INSERT into Patient and `rejected` is a
+    list of (row_number, reason). Each row gets the first reason that applies.
+    Keys of accepted rows are added to the two existing-key sets so later
+    blocks of the same file see them as taken.
+    """
+    frame = pd.DataFrame(index=df.index)
+    for col in TEXT_FIELDS:
+        if col in df.columns:
+            frame[col] = _as_text(df[col])
+        else:
+            frame[col] = pd.Series(pd.NA, index=df.index, dtype='string')
+
+    dob = pd.to_datetime(df['date_of_birth'], errors='coerce', format='mixed')
+    ages = calculate_ages(dob)
+
+    reasons = pd.Series(None, index=df.index, dtype='object')
+
+    def flag(mask, reason):
+        reasons[mask & reasons.isna()] = reason
+
+    for col in MANDATORY_FIELDS:
+        if col == 'date_of_birth':
+            flag(df[col].isna(), 'missing date_of_birth')
+        else:
+            flag(frame[col].isna(), f'missing {col}')
+    flag(dob.isna(), 'invalid date_of_birth')
+    flag(ages < 0, 'date_of_birth is in the future')
+    flag(frame['staff_id'].isin(existing_staff_ids), 'staff_id already registered for this company/year')
+    flag(frame['patient_id'].isin(existing_patient_ids), 'patient_id already used this year')
+    for col in ('staff_id', 'patient_id'):
+        valid = reasons.isna()
+        flag(frame[col].where(valid).duplicated() & valid, f'duplicate {col} in file')
+
+    accepted = reasons.isna()
+    rejected = [(int(n), r) for n, r in reasons[~accepted].items()]
+
+    out = frame[accepted].astype(object)
+    out = out.where(out.notna(), None)
+    out['date_of_birth'] = dob[accepted].dt.date
+    out['age'] = ages[accepted].astype(int)
+    out['company'] = company
+    out['screening_year'] = year
+    records = out.to_dict('records')
+
+    existing_staff_ids.update(out['staff_id'])
+    existing_patient_ids.update(out['patient_id'])
+    return records, rejected
+
+
+def bulk_insert_patients(records, chunk_size=IMPORT_CHUNK_SIZE):
+    """Inserts prepared patient records with one multi-row INSERT per chunk and counts them."""
+    for start in range(0, len(records), chunk_size):
+        db.session.execute(insert(Patient), records[start:start + chunk_size])
+    registration_stats.patients_imported(records)
+
+
+def import_patients(df, company, year, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Imports a roster DataFrame into the given company/year.
+
+    Existing keys are fetched once, the whole frame is validated in bulk and
+    valid rows are inserted in chunks inside a single transaction.
+    Returns an ImportResult. Raises RosterFormatError if columns are missing.
+    """
+    check_columns(df.columns)
+    df = df.set_axis(range(FIRST_DATA_ROW, FIRST_DATA_ROW + len(df)))
+    result = ImportResult()
+    staff_ids, patient_ids = load_existing_keys(company, year)
+    records, rejected = prepare_rows(df, company, year, staff_ids, patient_ids)
+    result.rejected.extend(rejected)
+    bulk_insert_patients(records, chunk_size)
+    db.session.commit()
+    result.inserted = len(records)
+    staff_index.invalidate(company, year)
+    return result
+
+
+def _is_blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _iter_xlsx_rows(stream):
+    """Yields rows of the first worksheet as tuples, using openpyxl's read-only mode."""
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _iter_csv_rows(stream):
+    """Yields CSV rows one line at a time, with empty cells as None."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        for row in csv.reader(text):
+            yield tuple(value if value != '' else None for value in row)
+    finally:
+        text.detach()
+
+
+def iter_roster_chunks(stream, filename, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Reads an uploaded .xlsx or .csv roster straight from its stream and
+    yields DataFrames of at most `chunk_size` rows, indexed by spreadsheet
+    row number. Only one chunk is held in memory at a time. Fully blank
+    rows are skipped. Raises RosterFormatError for an unsupported file type
+    or a header row without the required columns.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.xlsx':
+        rows = _iter_xlsx_rows(stream)
+    elif extension == '.csv':
+        rows = _iter_csv_rows(stream)
+    else:
+        raise RosterFormatError('Only .xlsx and .csv files can be imported.')
+
+    try:
+        header = next(rows, None)
+        if header is None:
+            raise RosterFormatError('The file is empty.')
+        header = [str(col).strip() if col is not None else '' for col in header]
+        check_columns(header)
+
+        buffer, numbers = [], []
+        for number, row in enumerate(rows, start=FIRST_DATA_ROW):
+            if all(_is_blank(value) for value in row):
+                continue
+            row = list(row[:len(header)]) + [None] * (len(header) - len(row))
+            buffer.append(row)
+            numbers.append(number)
+            if len(buffer) == chunk_size:
+                yield pd.DataFrame(buffer, columns=header, index=numbers)
+                buffer, numbers = [], []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=header, index=numbers)
+    finally:
+        rows.close()
+
+
+def stream_import_patients(stream, filename, company, year, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """
+    Imports a roster without loading the whole file. Each chunk is validated,
+    inserted and committed on its own, and the worker yields to other
+    greenlets between chunks so a large upload does not stall the server.
+    `progress`, if given, is called as progress(rows_processed, result) after
+    each chunk. Returns an ImportResult. Raises RosterFormatError if the file
+    is unusable.
+    """
+    result = ImportResult()
+    rows_processed = 0
+    staff_ids, patient_ids = load_existing_keys(company, year)
+    for chunk in iter_roster_chunks(stream, filename, chunk_size):
+        records, rejected = prepare_rows(chunk, company, year, staff_ids, patient_ids)
+        bulk_insert_patients(records, chunk_size)
+        db.session.commit()
+        result.inserted += len(records)
+        result.rejected.extend(rejected)
+        rows_processed += len(chunk)
+        # Set-based inserts bypass the per-patient index updates, so rebuild on next use
+        staff_index.invalidate(company, year)
+        if progress:
+            progress(rows_processed, result)
+        socketio.sleep(0)
+    return result
+
+
+def enqueue_roster_import(stream, filename, company, year, user_id=None):
+    """
+    Queues a background import of an uploaded roster. The stream is copied in
+    bounded chunks to a file under instance/uploads, which the job reads and
+    removes when it ends. Chunks are committed as they go, so a failed import
+    is not retried: a rerun would report the rows already imported as duplicates.
+    """
+    upload_dir = os.path.join(current_app.instance_path, 'uploads')
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, f'{secrets.token_hex(8)}_{filename}')
+    with open(path, 'wb') as out:
+        shutil.copyfileobj(stream, out, UPLOAD_COPY_CHUNK_SIZE)
+
+    try:
+        return job_queue.enqueue('import_roster', {
+            'path': path,
+            'filename': filename,
+            'company': company,
+            'year': year
+        }, user_id=user_id, max_attempts=1)
+    except Exception:
+        _remove_upload(path)
+        raise
+
+
+def _remove_upload(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@job_queue.handler('import_roster')
+def import_roster_job(ctx, payload):
+    def report(rows_processed, result):
+        ctx.progress(rows_processed, message=f'{result.inserted} imported, {len(result.rejected)} skipped')
+
+    try:
+        with open(payload['path'], 'rb') as stream:
+            result = stream_import_patients(stream, payload['filename'], payload['company'], payload['year'],
+                                            progress=report)
+    except RosterFormatError as e:
+        raise PermanentJobError(str(e))
+    finally:
+        _remove_upload(payload['path'])
+
+    log_audit('UPLOAD_PATIENTS', f'Successfully uploaded {result.inserted} patients from file: {payload["filename"]}',
+              user_id=ctx.job.user_id)
+    return {'inserted': result.inserted, 'rejected': result.rejected_by_reason()}
@@ -0,0 +1,16 @@
+from flask import jsonify, abort
+from flask_login import login_required, current_user
+from app.jobs import jobs
+from app.models import Job
+
+@jobs.route('/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """
+    Returns the current status and progress of a background job as JSON.
+    Users can see their own jobs; administrators can see any job.
+    """
+    job = Job.query.get_or_404(job_id)
+    if job.user_id != current_user.id and not current_user.has_permission('manage_roles'):
+        abort(403)
+    return jsonify(job.to_dict())
@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, UTC
+from flask import current_app
+from sqlalchemy import or_, update
+from app import db, socketio
+from app.models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def worker_name():
+    """Names this process on the rows its workers claim, as host:pid."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying cannot help (e.g. a malformed upload). The job fails at once."""
+
+
+class JobContext:
+    """
+    Handed to a job handler while it runs. Lets the handler report progress,
+    which is saved on the job row and pushed to the owner over Socket.IO.
+    Each report also renews the job's lease, so a handler should report at
+    least every JOB_LEASE_TIMEOUT seconds.
+    """
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.job = job
+
+    @property
+    def is_last_attempt(self):
+        return self.job.attempts >= self.job.max_attempts
+
+    def progress(self, done, total=None, message=None):
+        self.job.progress_done = done
+        if total is not None:
+            self.job.progress_total = total
+        if message is not None:
+            self.job.message = message[:255]
+        self.job.heartbeat_at = datetime.now(UTC)
+        db.session.commit()
+        self.queue.publish(self.job)
+        socketio.sleep(0)
+
+
+class JobQueue:
+    """
+    In-process background job runner backed by the Job table.
+
+    Jobs are rows in the database, so they survive restarts. A fixed number
+    of worker tasks (JOB_WORKERS) claim queued jobs one at a time, run the
+    registered handler and retry failures with exponential backoff until
+    max_attempts is reached. Status changes are emitted as 'job_status'
+    events to the owning user's Socket.IO room.
+
+    Several processes can share the table: a claimed job holds a lease
+    (claimed_by, heartbeat_at) and is only taken back from a worker whose
+    lease has lapsed for JOB_LEASE_TIMEOUT seconds.
+
+    Workers are green threads on the server's event loop, not OS threads.
+    A handler blocks every request of its process until it yields, so
+    CPU-heavy work must either yield often (the roster import calls
+    socketio.sleep(0) after each chunk) or run in a process pool, as report
+    rendering does.
+    """
+    def __init__(self, app=None):
+        self.handlers = {}
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['job_queue'] = self
+
+        # Workers are started on the first request rather than here so that
+        # CLI commands such as `flask db upgrade` do not spawn them.
+        @app.before_request
+        def start_job_workers():
+            if not self._started:
+                self.start(app)
+
+    def handler(self, kind):
+        """Registers a function as the handler for jobs of the given kind."""
+        def decorator(f):
+            self.handlers[kind] = f
+            return f
+        return decorator
+
+    def enqueue(self, kind, payload=None, user_id=None, max_attempts=None):
+        """
+        Adds a job to the queue and returns it. With JOBS_RUN_INLINE set (used
+        in tests) the job runs immediately in the calling thread.
+        """
+        app = current_app._get_current_object()
+        job = Job(
+            kind=kind,
+            payload=json.dumps(payload or {}),
+            user_id=user_id,
+            max_attempts=max_attempts or app.config['JOB_MAX_ATTEMPTS']
+        )
+        db.session.add(job)
+        db.session.commit()
+        self.publish(job)
+
+        if app.config['JOBS_RUN_INLINE']:
+            if self.claim(job.id):
+                self.run(app, job.id)
+            db.session.refresh(job)
+        else:
+            self._wakeup.set()
+        return job
+
+    def publish(self, job):
+        if job.user_id is not None:
+            socketio.emit('job_status', job.to_dict(), room=job.user_id)
+
+    def start(self, app):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if app.config['JOBS_RUN_INLINE'] or not app.config['JOB_WORKERS']:
+            return
+        with app.app_context():
+            self.recover()
+        for _ in range(app.config['JOB_WORKERS']):
+            socketio.start_background_task(self._worker, app)
+
+    def recover(self):
+        """
+        Takes back jobs left 'running' by a worker that stopped mid-job, i.e.
+        whose lease has not been renewed for JOB_LEASE_TIMEOUT seconds: they are
+        requeued, or failed if they have used all their attempts. Jobs another
+        process is still running are left alone.
+        """
+        now = datetime.now(UTC)
+        cutoff = now - timedelta(seconds=current_app.config['JOB_LEASE_TIMEOUT'])
+        lapsed = (Job.status == 'running', or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < cutoff))
+        db.session.execute(
+            update(Job).where(*lapsed, Job.attempts >= Job.max_attempts)
+            .values(status='failed', claimed_by=None, finished_at=now,
+                    error='Interrupted: its worker stopped and no attempts are left')
+        )
+        db.session.execute(
+            update(Job).where(*lapsed)
+            .values(status='queued', claimed_by=None, message='Requeued after its worker stopped')
+        )
+        db.session.commit()
+
+    def claim(self, job_id):
+        """
+        Atomically moves a queued job with attempts left to 'running', taking its
+        lease. Returns True if this caller won it.
+        """
+        now = datetime.now(UTC)
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'queued', Job.attempts < Job.max_attempts)
+            .values(status='running', started_at=now, attempts=Job.attempts + 1,
+                    claimed_by=worker_name(), heartbeat_at=now)
+        ).rowcount
+        db.session.commit()
+        return claimed == 1
+
+    def claim_next(self):
+        """Claims the oldest job that is due. Returns its id, or None if there is nothing to do."""
+        while True:
+            candidate = db.session.query(Job.id).filter(
+                Job.status == 'queued',
+                Job.attempts < Job.max_attempts,
+                Job.run_after <= datetime.now(UTC)
+            ).order_by(Job.id).first()
+            if candidate is None:
+                return None
+            if self.claim(candidate.id):
+                return candidate.id
+
+    def run(self, app, job_id):
+        """Runs a claimed job in its own app and request context and records the outcome."""
+        with app.app_context():
+            job = db.session.get(Job, job_id)
+            payload = json.loads(job.payload or '{}')
+            self.publish(job)
+            try:
+                handler = self.handlers.get(job.kind)
+                if handler is None:
+                    raise LookupError(f'No handler registered for job kind {job.kind!r}')
+                # Handlers render templates and build URLs, which need a request context.
+                with app.test_request_context(base_url=payload.get('base_url')):
+                    result = handler(JobContext(self, job), payload)
+            except Exception as e:
+                db.session.rollback()
+                logger.exception('Job %s (%s) failed on attempt %s', job.id, job.kind, job.attempts)
+                now = datetime.now(UTC)
+                job.error = str(e)
+                if job.attempts < job.max_attempts and not isinstance(e, PermanentJobError):
+                    delay = app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+                    job.status = 'queued'
+                    job.run_after = now + timedelta(seconds=delay)
+                    job.message = f'Retrying after error (attempt {job.attempts} of {job.max_attempts})'
+                else:
+                    job.status = 'failed'
+                    job.finished_at = now
+            else:
+                job.status = 'succeeded'
+                job.result = json.dumps(result) if result is not None else None
+                job.error = None
+                job.finished_at = datetime.now(UTC)
+            db.session.commit()
+            self.publish(job)
+
+    def _worker(self, app):
+        interval = app.config['JOB_POLL_INTERVAL']
+        recovered_at = time.monotonic()
+        while True:
+            job_id = None
+            try:
+                with app.app_context():
+                    # Take back jobs from workers in other processes that have stopped
+                    if time.monotonic() - recovered_at >= app.config['JOB_LEASE_TIMEOUT']:
+                        self.recover()
+                        recovered_at = time.monotonic()
+                    job_id = self.claim_next()
+                if job_id is not None:
+                    self.run(app, job_id)
+            except Exception:
+                logger.exception('Job worker error')
+            if job_id is None:
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+
+
+job_queue = JobQueue()
@@ -0,0 +1,45 @@
+from sqlalchemy import func, select
+from app import db
+from app.models import Patient, FullBloodCount, LiverFunctionTest, format_lab_value
+
+RANGE_MAX_RESULTS = 1000
+
+# Every numeric analyte and the test result it belongs to
+LAB_ANALYTES = {name: model for model in (FullBloodCount, LiverFunctionTest) for name in model.ANALYTES}
+
+
+def analyte_range(analyte, company, year, low=None, high=None, limit=RANGE_MAX_RESULTS):
+    """
+    Patients in a company/year with `low <= analyte < high` (either bound may
+    be left out), lowest value first and each value as entered, e.g.
+    analyte_range('hgb', 'DCP', 2025, high=10). Entries that are not numbers
+    are never matched. Filtering and sorting run in SQL: the planner either
+    scans the cohort and probes each result by patient_id, or, for the indexed
+    analytes (hgb, wbc, plt, ast, alt, alp), range-scans their (value,
+    patient_id) index when the range is the narrower of the two.
+    """
+    model = LAB_ANALYTES[analyte]
+    value = getattr(model, f'{analyte}_value')
+    query = select(Patient.id, Patient.staff_id, Patient.first_name, Patient.last_name, value.label('value'),
+                   getattr(model, f'{analyte}_text').label('text'))\
+        .join(model, model.patient_id == Patient.id)\
+        .where(Patient.company == company, Patient.screening_year == year, value.isnot(None))
+    if low is not None:
+        query = query.where(value >= low)
+    if high is not None:
+        query = query.where(value < high)
+    rows = db.session.execute(query.order_by(value, Patient.id).limit(min(limit, RANGE_MAX_RESULTS)))
+    return [{'id': row.id, 'staff_id': row.staff_id, 'name': f'{row.first_name} {row.last_name}',
+             'value': row.text or format_lab_value(row.value)} for row in rows]
+
+
+def analyte_summary(analyte, company, year):
+    """Count, minimum, maximum and mean of an analyte's numeric entries in a company/year, from one query."""
+    model = LAB_ANALYTES[analyte]
+    value = getattr(model, f'{analyte}_value')
+    row = db.session.execute(
+        select(func.count(value), func.min(value), func.max(value), func.avg(value))
+        .join(Patient, model.patient_id == Patient.id)
+        .where(Patient.company == company, Patient.screening_year == year)
+    ).one()
+    return {'count': row[0], 'min': row[1], 'max': row[2], 'mean': round(row[3], 2) if row[3] is not None else None}
@@ -0,0 +1,305 @@
+import logging
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta, UTC
+from email.utils import parseaddr
+from flask import current_app
+from sqlalchemy import event, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from app import db, socketio
+from app.jobs.runner import worker_name
+from app.models import OutgoingEmail, Setting
+from app.settings import all_settings, MAIL_SLOT_KEY
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPConnection:
+    """
+    One SMTP session that is opened on first use and reused for the messages
+    that follow, up to MAIL_MAX_PER_CONNECTION, instead of a TLS handshake per email.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.smtp = None
+        self.sent = 0
+
+    def open(self):
+        all_settings() # Picks up mail credentials changed in the admin panel
+        config = self.app.config
+        smtp_class = smtplib.SMTP_SSL if config.get('MAIL_USE_SSL') else smtplib.SMTP
+        smtp = smtp_class(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=config['MAIL_TIMEOUT'])
+        try:
+            if config.get('MAIL_USE_TLS'):
+                smtp.starttls()
+            if config.get('MAIL_USERNAME') and config.get('MAIL_PASSWORD'):
+                smtp.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+        except Exception:
+            smtp.close()
+            raise
+        self.smtp = smtp
+        self.sent = 0
+
+    def close(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+        finally:
+            self.smtp = None
+            self.sent = 0
+
+    def send(self, sender, recipients, message):
+        if self.smtp is not None and self.sent >= self.app.config['MAIL_MAX_PER_CONNECTION']:
+            self.close()
+        if self.smtp is None:
+            self.open()
+        self.smtp.sendmail(sender, recipients, message)
+        self.sent += 1
+
+
+class RateLimiter:
+    """
+    Spaces sends evenly so that all workers, in every process, together stay
+    under `per_minute` messages. The next free send time is kept in the
+    MAIL_SLOT_KEY setting and taken with a compare-and-set, so no two workers
+    are given the same slot.
+    """
+    def reserve(self, per_minute):
+        """Takes the next send slot and returns it as a Unix time."""
+        while True:
+            try:
+                with db.engine.begin() as connection:
+                    current = connection.execute(
+                        select(Setting.value).where(Setting.key == MAIL_SLOT_KEY)
+                    ).scalar()
+                    slot = max(time.time(), float(current)) if current else time.time()
+                    taken = repr(slot + 60.0 / per_minute)
+                    if current is None:
+                        connection.execute(insert(Setting).values(key=MAIL_SLOT_KEY, value=taken))
+                        return slot
+                    if connection.execute(
+                        update(Setting).where(Setting.key == MAIL_SLOT_KEY, Setting.value == current)
+                        .values(value=taken)
+                    ).rowcount == 1:
+                        return slot
+            except IntegrityError:
+                pass # Another worker created the row first
+            # Another worker took this slot; try the next one
+
+    def wait(self, per_minute):
+        if not per_minute:
+            return
+        delay = self.reserve(per_minute) - time.time()
+        if delay > 0:
+            socketio.sleep(delay)
+
+
+def _is_permanent(error):
+    """5xx replies and refused recipients will not succeed on a retry."""
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class MailDispatcher:
+    """
+    Outbound mail sent from a durable outbox (the OutgoingEmail table).
+
+    Messages are queued as complete MIME documents. A bounded number of worker
+    tasks (MAIL_WORKERS) each claim a batch of due messages, send them over
+    a persistent SMTP connection, and retry failures with exponential backoff
+    until max_attempts is reached. MAIL_RATE_LIMIT caps messages per minute
+    across all workers.
+
+    Several processes can share the outbox: claimed messages hold a lease
+    (claimed_by, heartbeat_at), renewed with each delivery in their batch, and
+    are only taken back from a worker whose lease has lapsed for
+    MAIL_LEASE_TIMEOUT seconds.
+    """
+    def __init__(self, app=None):
+        self.rate_limiter = RateLimiter()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['mail_dispatcher'] = self
+
+        # As with the job queue, workers start on the first request so that
+        # CLI commands do not spawn them.
+        @app.before_request
+        def start_mail_workers():
+            if not self._started:
+                self.start(app)
+
+    def queue(self, msg, max_attempts=None, send_after=None, patient_id=None, job_id=None):
+        """
+        Adds a Flask-Mail Message to the outbox and returns its OutgoingEmail.
+        The caller commits; the message is sent once that commit happens.
+        `send_after` holds the message back until that time. With
+        MAIL_DISPATCH_INLINE set (used in tests) due messages are sent during
+        the commit.
+        """
+        app = current_app._get_current_object()
+        sender = msg.sender[1] if isinstance(msg.sender, tuple) else msg.sender
+        email = OutgoingEmail(
+            sender=parseaddr(sender or '')[1],
+            recipients=','.join(sorted(msg.send_to)),
+            subject=(msg.subject or '')[:255],
+            message=msg.as_bytes(),
+            max_attempts=max_attempts or app.config['MAIL_MAX_ATTEMPTS'],
+            run_after=send_after or datetime.now(UTC),
+            patient_id=patient_id,
+            job_id=job_id
+        )
+        if not email.sender:
+            email.status = 'failed'
+            email.error = 'No sender address is configured.'
+        db.session.add(email)
+        db.session.flush()
+        self._dispatch_after_commit(app)
+        return email
+
+    def _dispatch_after_commit(self, app):
+        """Wakes the workers, or sends inline, when the caller's session next commits."""
+        session = db.session()
+        if session.info.get('mail_dispatch_pending'):
+            return
+        session.info['mail_dispatch_pending'] = True
+
+        @event.listens_for(session, 'after_commit', once=True)
+        def dispatch(session):
+            session.info.pop('mail_dispatch_pending', None)
+            if app.config['MAIL_DISPATCH_INLINE']:
+                # The committing session cannot run SQL here; a new app context has a session of its own
+                with app.app_context():
+                    self.deliver_pending(app)
+            else:
+                self._wakeup.set()
+
+    def start(self, app):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if app.config['MAIL_DISPATCH_INLINE'] or not app.config['MAIL_WORKERS']:
+            return
+        with app.app_context():
+            self.recover()
+        for _ in range(app.config['MAIL_WORKERS']):
+            socketio.start_background_task(self._worker, app)
+
+    def recover(self):
+        """
+        Requeues messages left 'sending' by a worker that stopped mid-batch, i.e.
+        whose lease has not been renewed for MAIL_LEASE_TIMEOUT seconds.
+        Messages another process is still sending are left alone.
+        """
+        cutoff = datetime.now(UTC) - timedelta(seconds=current_app.config['MAIL_LEASE_TIMEOUT'])
+        db.session.execute(
+            update(OutgoingEmail)
+            .where(OutgoingEmail.status == 'sending',
+                   or_(OutgoingEmail.heartbeat_at.is_(None), OutgoingEmail.heartbeat_at < cutoff))
+            .values(status='queued', claimed_by=None)
+        )
+        db.session.commit()
+
+    def claim_batch(self, size):
+        """
+        Atomically moves up to `size` due messages to 'sending', taking their
+        lease. Returns the ids this caller won.
+        """
+        now = datetime.now(UTC)
+        candidates = [row.id for row in db.session.query(OutgoingEmail.id).filter(
+            OutgoingEmail.status == 'queued',
+            OutgoingEmail.run_after <= now
+        ).order_by(OutgoingEmail.id).limit(size)]
+        claimed = []
+        for email_id in candidates:
+            won = db.session.execute(
+                update(OutgoingEmail)
+                .where(OutgoingEmail.id == email_id, OutgoingEmail.status == 'queued')
+                .values(status='sending', attempts=OutgoingEmail.attempts + 1,
+                        claimed_by=worker_name(), heartbeat_at=now)
+            ).rowcount
+            if won == 1:
+                claimed.append(email_id)
+        db.session.commit()
+        return claimed
+
+    def deliver(self, app, email_ids, connection):
+        """Sends claimed messages over `connection`, recording each outcome as it happens."""
+        for email_id in email_ids:
+            email = db.session.get(OutgoingEmail, email_id)
+            try:
+                if not app.config.get('MAIL_SUPPRESS_SEND'):
+                    self.rate_limiter.wait(app.config['MAIL_RATE_LIMIT'])
+                    connection.send(email.sender, email.recipients.split(','), email.message)
+            except Exception as e:
+                logger.warning('Email %s to %s failed on attempt %s: %s', email.id, email.recipients, email.attempts, e)
+                email.error = str(e)
+                if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                    # The session may be unusable; the next message reconnects.
+                    connection.close()
+                if email.attempts < email.max_attempts and not _is_permanent(e):
+                    delay = app.config['MAIL_RETRY_DELAY'] * 2 ** (email.attempts - 1)
+                    email.status = 'queued'
+                    email.run_after = datetime.now(UTC) + timedelta(seconds=delay)
+                else:
+                    email.status = 'failed'
+            else:
+                email.status = 'sent'
+                email.error = None
+                email.sent_at = datetime.now(UTC)
+            # Progress on the batch renews the lease on the messages still waiting in it
+            db.session.execute(
+                update(OutgoingEmail)
+                .where(OutgoingEmail.id.in_(email_ids), OutgoingEmail.status == 'sending',
+                       OutgoingEmail.claimed_by == worker_name())
+                .values(heartbeat_at=datetime.now(UTC))
+            )
+            db.session.commit()
+
+    def deliver_pending(self, app):
+        """Sends every message that is due, in the calling thread, over one connection."""
+        connection = SMTPConnection(app)
+        try:
+            while True:
+                email_ids = self.claim_batch(app.config['MAIL_BATCH_SIZE'])
+                if not email_ids:
+                    return
+                self.deliver(app, email_ids, connection)
+        finally:
+            connection.close()
+
+    def _worker(self, app):
+        interval = app.config['MAIL_POLL_INTERVAL']
+        connection = SMTPConnection(app)
+        recovered_at = time.monotonic()
+        while True:
+            email_ids = []
+            try:
+                with app.app_context():
+                    # Take back messages from workers in other processes that have stopped
+                    if time.monotonic() - recovered_at >= app.config['MAIL_LEASE_TIMEOUT']:
+                        self.recover()
+                        recovered_at = time.monotonic()
+                    email_ids = self.claim_batch(app.config['MAIL_BATCH_SIZE'])
+                    if email_ids:
+                        self.deliver(app, email_ids, connection)
+            except Exception:
+                logger.exception('Mail worker error')
+            if not email_ids:
+                # Nothing left to send: do not hold the SMTP session open while idle.
+                connection.close()
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+
+
+mail_dispatcher = MailDispatcher()
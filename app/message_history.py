@@ -0,0 +1,60 @@
+from datetime import datetime, UTC
+from sqlalchemy import and_, func, tuple_, update
+from app import db
+from app.models import Message
+from app.pagination import encode_cursor, decode_cursor
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+
+def _newest_first(query, cursor, limit):
+    if cursor:
+        query = query.filter(tuple_(Message.timestamp, Message.id) < cursor)
+    return query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit).all()
+
+
+def conversation_history(user_id, other_id=None, room_id=None, before=None, per_page=HISTORY_PAGE_SIZE):
+    """
+    One page of a direct (`other_id`) or room (`room_id`) conversation, going
+    back in time from the `before` cursor. Each direction of a direct
+    conversation is a range scan of ix_message_conversation and a room is one
+    of ix_message_room_timestamp, so every page costs the same however far
+    back it is.
+
+    Returns (messages, next_cursor): the messages in the order they were
+    sent, and the cursor for the page before them (None at the start).
+    """
+    cursor = decode_cursor(before)
+    per_page = min(per_page or HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE)
+    if room_id is not None:
+        rows = _newest_first(Message.query.filter(Message.room_id == room_id), cursor, per_page + 1)
+    else:
+        sent = Message.query.filter(Message.sender_id == user_id, Message.recipient_id == other_id)
+        received = Message.query.filter(Message.sender_id == other_id, Message.recipient_id == user_id)
+        rows = _newest_first(sent, cursor, per_page + 1) + _newest_first(received, cursor, per_page + 1)
+        rows.sort(key=lambda m: (m.timestamp, m.id), reverse=True)
+
+    page = rows[:per_page]
+    next_cursor = encode_cursor(page[-1]) if len(rows) > per_page else None
+    return page[::-1], next_cursor
+
+
+def mark_read(user_id, sender_id):
+    """Marks every unread direct message from `sender_id` to `user_id` as read. The caller commits."""
+    return db.session.execute(
+        update(Message)
+        .where(Message.recipient_id == user_id, Message.sender_id == sender_id, Message.read_at.is_(None))
+        .values(read_at=datetime.now(UTC))
+    ).rowcount
+
+
+def unread_counts(user_id):
+    """
+    Unread direct messages for a user, per sender, from a single grouped query
+    answered by ix_message_unread. Returns {sender_id: count}.
+    """
+    rows = db.session.query(Message.sender_id, func.count(Message.id))\
+                     .filter(and_(Message.recipient_id == user_id, Message.read_at.is_(None)))\
+                     .group_by(Message.sender_id)
+    return {sender_id: count for sender_id, count in rows}
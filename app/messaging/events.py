@@ -2,11 +2,13 @@ from flask_socketio import emit, join_room
 from flask_login import current_user
 from .. import socketio, db
 from ..models import Message
+from ..notifications import join_admin_room
 
 @socketio.on('connect')
 def connect():
     if current_user.is_authenticated:
         join_room(current_user.id)
+        join_admin_room(current_user)
         print(f"Client connected: {current_user.first_name}, joined room: {current_user.id}")
         emit('status', {'msg': f'Connected and joined room {current_user.id}'})
     else:
@@ -35,12 +37,7 @@ def send_message(data):
     db.session.commit()
 
     # Prepare message data to be sent to clients
-    message_data = {
-        'body': msg.body,
-        'sender_id': msg.sender_id,
-        'recipient_id': msg.recipient_id,
-        'timestamp': msg.timestamp.isoformat() + 'Z'
-    }
+    message_data = msg.to_dict()
 
     # Emit to recipient's room and sender's room (so they see their own message)
     emit('new_message', message_data, room=recipient_id)
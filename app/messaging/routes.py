@@ -1,11 +1,54 @@
-from flask import render_template
+from flask import render_template, request, jsonify, abort
 from flask_login import login_required, current_user
+from app import db
 from app.messaging import messaging
-from app.models import User
+from app.models import User, room_participants
+from app.message_history import conversation_history, mark_read, unread_counts
 
 @messaging.route('/')
 @login_required
 def index():
     # Exclude current user from the list of users to chat with
     users = User.query.filter(User.id != current_user.id).all()
-    return render_template('messaging/chat.html', users=users)
+    return render_template('messaging/chat.html', users=users, unread=unread_counts(current_user.id))
+
+@messaging.route('/api/history')
+@login_required
+def history():
+    """
+    A page of conversation history, oldest message first. Pass `with` (a user ID)
+    for a direct conversation or `room` for a chat room, and `before` (the
+    `next_cursor` of the previous response) to page further back.
+    """
+    other_id = request.args.get('with', type=int)
+    room_id = request.args.get('room', type=int)
+    if room_id is not None:
+        is_participant = db.session.query(room_participants).filter_by(
+            room_id=room_id, user_id=current_user.id).first() is not None
+        if not is_participant:
+            abort(403)
+    elif other_id is None:
+        abort(400, 'Either with or room is required.')
+
+    messages, next_cursor = conversation_history(
+        current_user.id, other_id=other_id, room_id=room_id,
+        before=request.args.get('before'), per_page=request.args.get('limit', type=int)
+    )
+    return jsonify({'messages': [m.to_dict() for m in messages], 'next_cursor': next_cursor})
+
+@messaging.route('/api/read', methods=['POST'])
+@login_required
+def read():
+    """Marks the direct messages from one user as read."""
+    sender_id = (request.json or {}).get('with')
+    if not isinstance(sender_id, int):
+        abort(400, 'with must be a user ID.')
+    marked = mark_read(current_user.id, sender_id)
+    db.session.commit()
+    return jsonify({'marked': marked})
+
+@messaging.route('/api/unread')
+@login_required
+def unread():
+    counts = unread_counts(current_user.id)
+    return jsonify({'total': sum(counts.values()), 'by_sender': counts})
@@ -1,3 +1,8 @@
+import json
+import re
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.ext.hybrid import hybrid_property
 from app import db, login_manager
 from flask_login import UserMixin
 from app import bcrypt
@@ -17,16 +22,37 @@ class User(db.Model, UserMixin):
     password_hash = db.Column(db.String(128))
     otp_secret = db.Column(db.String(16))
     otp_enabled = db.Column(db.Boolean, default=False)
+    # Bumped whenever the user's roles or those roles' permissions change; see permission_set
+    permissions_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     roles = db.relationship('Role', secondary=user_roles, backref=db.backref('users', lazy='dynamic'))
     recovery_codes = db.relationship('UserRecoveryCode', backref='user', lazy='dynamic')
 
+    @property
+    def permission_set(self):
+        """
+        The names of all permissions granted through the user's roles, as a
+        frozenset. It is compiled with one query and cached per user until
+        permissions_version changes, so checks normally cost no queries.
+        """
+        cache = current_app.extensions.setdefault('permission_sets', {})
+        version = self.permissions_version or 0
+        cached = cache.get(self.id)
+        if cached is None or cached[0] != version:
+            names = db.session.query(Permission.name)\
+                              .join(role_permissions, role_permissions.c.permission_id == Permission.id)\
+                              .join(user_roles, user_roles.c.role_id == role_permissions.c.role_id)\
+                              .filter(user_roles.c.user_id == self.id)
+            cached = (version, frozenset(name for (name,) in names))
+            cache[self.id] = cached
+        return cached[1]
+
     def has_permission(self, perm_name):
-        for role in self.roles:
-            for perm in role.permissions:
-                if perm.name == perm_name:
-                    return True
-        return False
+        return perm_name in self.permission_set
+
+    def permissions_changed(self):
+        """Marks the user's compiled permissions as stale. Call before committing a change to their roles."""
+        self.permissions_version = (self.permissions_version or 0) + 1
 
     @property
     def password(self):
@@ -53,6 +79,15 @@ class Role(db.Model):
     name = db.Column(db.String(50), unique=True, nullable=False)
     permissions = db.relationship('Permission', secondary=role_permissions, backref=db.backref('roles', lazy='dynamic'))
 
+    def permissions_changed(self):
+        """Marks the compiled permissions of every holder of this role as stale. Call before committing."""
+        db.session.execute(
+            update(User)
+            .where(User.id.in_(select(user_roles.c.user_id).where(user_roles.c.role_id == self.id)))
+            .values(permissions_version=User.permissions_version + 1)
+            .execution_options(synchronize_session=False)
+        )
+
     def __repr__(self):
         return f"Role('{self.name}')"
 
@@ -89,9 +124,91 @@ class AuditLog(db.Model):
 
     user = db.relationship('User')
 
+    # Keyset pagination of the audit trail, unfiltered and by action or user (see app/audit.py)
+    __table_args__ = (db.Index('ix_audit_log_timestamp_id', 'timestamp', 'id'),
+                      db.Index('ix_audit_log_action_timestamp_id', 'action', 'timestamp', 'id'),
+                      db.Index('ix_audit_log_user_timestamp_id', 'user_id', 'timestamp', 'id'))
+
     def __repr__(self):
         return f"<AuditLog {self.action} by User ID {self.user_id}>"
 
+class Job(db.Model):
+    """
+    A unit of background work (roster import, report batch, bulk email).
+    The table doubles as the durable queue read by app.jobs.runner.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued, running, succeeded, failed
+    payload = db.Column(db.Text, nullable=True) # JSON
+    result = db.Column(db.Text, nullable=True) # JSON
+    error = db.Column(db.Text, nullable=True)
+    progress_done = db.Column(db.Integer, nullable=False, default=0)
+    progress_total = db.Column(db.Integer, nullable=True)
+    message = db.Column(db.String(255), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))
+    run_after = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # Lease of the worker running the job: its process and when it last reported progress
+    claimed_by = db.Column(db.String(100), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('ix_job_status_run_after', 'status', 'run_after'),)
+
+    user = db.relationship('User')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': {'done': self.progress_done, 'total': self.progress_total},
+            'message': self.message,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat() + 'Z',
+            'finished_at': self.finished_at.isoformat() + 'Z' if self.finished_at else None
+        }
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} ({self.status})>"
+
+class OutgoingEmail(db.Model):
+    """
+    A message waiting in (or delivered from) the outbox.
+    The table is the durable queue read by app.mailer.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(255), nullable=False)
+    recipients = db.Column(db.Text, nullable=False) # comma-separated envelope recipients
+    subject = db.Column(db.String(255), nullable=True)
+    message = db.Column(db.LargeBinary, nullable=False) # the complete MIME message
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))
+    run_after = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))
+    sent_at = db.Column(db.DateTime, nullable=True)
+    # Lease of the worker sending the message: its process and when its batch last made progress
+    claimed_by = db.Column(db.String(100), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    # Set for report emails, so a bulk send can show each recipient's delivery status
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id'), nullable=True, index=True)
+
+    __table_args__ = (db.Index('ix_outgoing_email_status_run_after', 'status', 'run_after'),)
+
+    patient = db.relationship('Patient')
+
+    def __repr__(self):
+        return f"<OutgoingEmail {self.id} to {self.recipients} ({self.status})>"
+
 class PatientAccount(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     staff_id = db.Column(db.String(50), unique=True, nullable=False)
@@ -125,6 +242,42 @@ room_participants = db.Table('room_participants',
     db.Column('room_id', db.Integer, db.ForeignKey('chat_room.id'), primary_key=True)
 )
 
+class RegistrationCount(db.Model):
+    """
+    Number of patients registered per company/year, day, gender and age band.
+    Kept in step with Patient by app.registration_stats so the registration
+    dashboard is one aggregate over a few rows instead of six COUNTs.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    company = db.Column(db.String(10), nullable=False)
+    screening_year = db.Column(db.Integer, nullable=False)
+    day = db.Column(db.Date, nullable=False) # UTC date of Patient.date_registered
+    gender = db.Column(db.String(10), nullable=False)
+    over_40 = db.Column(db.Boolean, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.UniqueConstraint('company', 'screening_year', 'day', 'gender', 'over_40',
+                                          name='_registration_count_bucket_uc'),)
+
+    def __repr__(self):
+        return f"<RegistrationCount {self.company} {self.screening_year} {self.day} {self.gender} {self.count}>"
+
+class SocketIOMessage(db.Model):
+    """
+    An event relayed between worker processes by the database message queue
+    (see app/socketio_queue.py). Rows live for SOCKETIO_MESSAGE_TTL seconds.
+    """
+    __tablename__ = 'socketio_message'
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False) # JSON, as python-socketio's pub/sub managers exchange it
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    # AUTOINCREMENT, so ids of pruned rows are never handed out again: listeners
+    # read past the last id they have seen
+    __table_args__ = (db.Index('ix_socketio_message_channel_id', 'channel', 'id'),
+                      {'sqlite_autoincrement': True})
+
 class ChatRoom(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -142,11 +295,28 @@ class Message(db.Model):
     timestamp = db.Column(db.DateTime, index=True, default=lambda: datetime.now(UTC))
     read_at = db.Column(db.DateTime, nullable=True)
 
+    # Conversation history in (timestamp, id) order and unread counts (see app/message_history.py)
+    __table_args__ = (db.Index('ix_message_conversation', 'sender_id', 'recipient_id', 'timestamp', 'id'),
+                      db.Index('ix_message_room_timestamp', 'room_id', 'timestamp', 'id'),
+                      db.Index('ix_message_unread', 'recipient_id', 'read_at', 'sender_id'))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'body': self.body,
+            'sender_id': self.sender_id,
+            'recipient_id': self.recipient_id,
+            'room_id': self.room_id,
+            'timestamp': self.timestamp.isoformat() + 'Z',
+            'read': self.read_at is not None
+        }
+
 from datetime import datetime, UTC
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Permissions are not loaded here; User.permission_set serves them from a per-user cache
+    return db.session.get(User, int(user_id))
 
 class Patient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -170,7 +340,20 @@ class Patient(db.Model):
     screening_year = db.Column(db.Integer, nullable=False)
 
     __table_args__ = (db.UniqueConstraint('staff_id', 'company', 'screening_year', name='_staff_company_year_uc'),
-                      db.UniqueConstraint('patient_id', 'screening_year', name='_patient_year_uc'))
+                      db.UniqueConstraint('patient_id', 'screening_year', name='_patient_year_uc'),
+                      # Staff ID prefix search within a company/year (see app/search.py)
+                      db.Index('ix_patient_company_year_staff_id', 'company', 'screening_year', 'staff_id'),
+                      # The same search ignoring case, on the upper-cased staff ID
+                      db.Index('ix_patient_company_year_staff_id_upper', 'company', 'screening_year',
+                               db.text('upper(staff_id)')),
+                      # Company/year listings newest first and registration counts
+                      db.Index('ix_patient_company_year_registered', 'company', 'screening_year', 'date_registered'),
+                      # Portal lookups by staff ID across screening years, latest first
+                      db.Index('ix_patient_staff_id_year', 'staff_id', 'screening_year'),
+                      # Patient IDs taken in a screening year (import dedup)
+                      db.Index('ix_patient_year_patient_id', 'screening_year', 'patient_id'),
+                      # All patients newest first
+                      db.Index('ix_patient_date_registered', 'date_registered'))
 
     def __repr__(self):
         return f"Patient('{self.first_name}', '{self.last_name}', '{self.staff_id}')"
@@ -219,31 +402,142 @@ class Consultation(db.Model):
 
 # --- Test Result Models ---
 
-class FullBloodCount(db.Model):
+# A lab entry that is a plain decimal number; anything else (e.g. '<5', '12.5 H') is kept as text
+_NUMERIC_ENTRY = re.compile(r'^(\d+\.?\d*|\.\d+)$')
+
+
+def parse_lab_value(entry):
+    """
+    Splits a lab entry into (number, text). The number is set for a numeric
+    entry; the text keeps the entry as typed whenever the number would not
+    read back the same (e.g. '12.50' or '05') and for anything else. Both
+    are None for a blank entry.
+    """
+    if isinstance(entry, (int, float)):
+        return float(entry), None
+    entry = (entry or '').strip()
+    if not entry:
+        return None, None
+    if _NUMERIC_ENTRY.match(entry):
+        value = float(entry)
+        return value, None if format_lab_value(value) == entry else entry
+    return None, entry
+
+
+def format_lab_value(value):
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def lab_value(name):
+    """
+    An analyte as entered: on assignment a number is stored in `<name>_value`
+    and, unless the number reads back as typed, the entry in `<name>_text`
+    (see parse_lab_value); reads return the text if there is one, else the
+    number. In queries it is the numeric column, so `FullBloodCount.hgb < 10`
+    filters in SQL.
+    """
+    value_attr, text_attr = f'{name}_value', f'{name}_text'
+
+    def get(self):
+        text = getattr(self, text_attr)
+        if text is not None:
+            return text
+        value = getattr(self, value_attr)
+        return format_lab_value(value) if value is not None else None
+
+    def set(self, entry):
+        value, text = parse_lab_value(entry)
+        setattr(self, value_attr, value)
+        setattr(self, text_attr, text)
+
+    return hybrid_property(get, set, expr=lambda cls: getattr(cls, value_attr))
+
+
+class ScreeningResult:
+    """A test result shown field by field on the report and the director's review."""
+    HIDDEN_FIELDS = {'id', 'patient_id', 'date_created', 'patient'}
+
+    def result_items(self):
+        """(field, value) pairs to show, from the loaded columns."""
+        return [(key, value) for key, value in self.__dict__.items()
+                if not key.startswith('_') and key not in self.HIDDEN_FIELDS]
+
+
+class LabValues(ScreeningResult):
+    """A test result whose ANALYTES are stored as numbers, see lab_value."""
+    ANALYTES = []
+
+    def result_items(self):
+        """Each analyte as entered, then the other fields."""
+        stored = {f'{name}_{part}' for name in self.ANALYTES for part in ('value', 'text')}
+        return [(name, getattr(self, name)) for name in self.ANALYTES] + \
+               [(key, value) for key, value in super().result_items() if key not in stored]
+
+class FullBloodCount(LabValues, db.Model):
+    ANALYTES = ['hct', 'wbc', 'plt', 'lymp_percent', 'lymp', 'gra_percent', 'gra', 'mid_percent', 'mid',
+                'rbc', 'mcv', 'mch', 'mchc', 'rdw', 'pdw', 'hgb']
+
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, unique=True)
-    hct = db.Column(db.String(50))
-    wbc = db.Column(db.String(50))
-    plt = db.Column(db.String(50))
-    lymp_percent = db.Column(db.String(50))
-    lymp = db.Column(db.String(50))
-    gra_percent = db.Column(db.String(50))
-    gra = db.Column(db.String(50))
-    mid_percent = db.Column(db.String(50))
-    mid = db.Column(db.String(50))
-    rbc = db.Column(db.String(50))
-    mcv = db.Column(db.String(50))
-    mch = db.Column(db.String(50))
-    mchc = db.Column(db.String(50))
-    rdw = db.Column(db.String(50))
-    pdw = db.Column(db.String(50))
-    hgb = db.Column(db.String(50))
+    hct_value = db.Column('hct', db.Float)
+    hct_text = db.Column(db.String(50))
+    hct = lab_value('hct')
+    wbc_value = db.Column('wbc', db.Float)
+    wbc_text = db.Column(db.String(50))
+    wbc = lab_value('wbc')
+    plt_value = db.Column('plt', db.Float)
+    plt_text = db.Column(db.String(50))
+    plt = lab_value('plt')
+    lymp_percent_value = db.Column('lymp_percent', db.Float)
+    lymp_percent_text = db.Column(db.String(50))
+    lymp_percent = lab_value('lymp_percent')
+    lymp_value = db.Column('lymp', db.Float)
+    lymp_text = db.Column(db.String(50))
+    lymp = lab_value('lymp')
+    gra_percent_value = db.Column('gra_percent', db.Float)
+    gra_percent_text = db.Column(db.String(50))
+    gra_percent = lab_value('gra_percent')
+    gra_value = db.Column('gra', db.Float)
+    gra_text = db.Column(db.String(50))
+    gra = lab_value('gra')
+    mid_percent_value = db.Column('mid_percent', db.Float)
+    mid_percent_text = db.Column(db.String(50))
+    mid_percent = lab_value('mid_percent')
+    mid_value = db.Column('mid', db.Float)
+    mid_text = db.Column(db.String(50))
+    mid = lab_value('mid')
+    rbc_value = db.Column('rbc', db.Float)
+    rbc_text = db.Column(db.String(50))
+    rbc = lab_value('rbc')
+    mcv_value = db.Column('mcv', db.Float)
+    mcv_text = db.Column(db.String(50))
+    mcv = lab_value('mcv')
+    mch_value = db.Column('mch', db.Float)
+    mch_text = db.Column(db.String(50))
+    mch = lab_value('mch')
+    mchc_value = db.Column('mchc', db.Float)
+    mchc_text = db.Column(db.String(50))
+    mchc = lab_value('mchc')
+    rdw_value = db.Column('rdw', db.Float)
+    rdw_text = db.Column(db.String(50))
+    rdw = lab_value('rdw')
+    pdw_value = db.Column('pdw', db.Float)
+    pdw_text = db.Column(db.String(50))
+    pdw = lab_value('pdw')
+    hgb_value = db.Column('hgb', db.Float)
+    hgb_text = db.Column(db.String(50))
+    hgb = lab_value('hgb')
     fbc_remark = db.Column(db.Text)
     other_remarks = db.Column(db.Text)
     date_created = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
     patient = db.relationship('Patient', backref=db.backref('full_blood_count', lazy=True, uselist=False))
 
-class KidneyFunctionTest(db.Model):
+    # Range filters on the commonly screened analytes, e.g. hgb < 10 (see app/lab_values.py)
+    __table_args__ = (db.Index('ix_full_blood_count_hgb', 'hgb', 'patient_id'),
+                      db.Index('ix_full_blood_count_wbc', 'wbc', 'patient_id'),
+                      db.Index('ix_full_blood_count_plt', 'plt', 'patient_id'))
+
+class KidneyFunctionTest(ScreeningResult, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, unique=True)
     k = db.Column(db.Float)
@@ -258,7 +552,7 @@ class KidneyFunctionTest(db.Model):
     date_created = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
     patient = db.relationship('Patient', backref=db.backref('kidney_function_test', lazy=True, uselist=False))
 
-class LipidProfile(db.Model):
+class LipidProfile(ScreeningResult, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, unique=True)
     tcho = db.Column(db.Float)
@@ -270,20 +564,36 @@ class LipidProfile(db.Model):
     date_created = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
     patient = db.relationship('Patient', backref=db.backref('lipid_profile', lazy=True, uselist=False))
 
-class LiverFunctionTest(db.Model):
+class LiverFunctionTest(LabValues, db.Model):
+    ANALYTES = ['ast', 'alt', 'alp', 'tb', 'cb']
+
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, unique=True)
-    ast = db.Column(db.String(50))
-    alt = db.Column(db.String(50))
-    alp = db.Column(db.String(50))
-    tb = db.Column(db.String(50))
-    cb = db.Column(db.String(50))
+    ast_value = db.Column('ast', db.Float)
+    ast_text = db.Column(db.String(50))
+    ast = lab_value('ast')
+    alt_value = db.Column('alt', db.Float)
+    alt_text = db.Column(db.String(50))
+    alt = lab_value('alt')
+    alp_value = db.Column('alp', db.Float)
+    alp_text = db.Column(db.String(50))
+    alp = lab_value('alp')
+    tb_value = db.Column('tb', db.Float)
+    tb_text = db.Column(db.String(50))
+    tb = lab_value('tb')
+    cb_value = db.Column('cb', db.Float)
+    cb_text = db.Column(db.String(50))
+    cb = lab_value('cb')
     lft_remark = db.Column(db.Text)
     other_remarks = db.Column(db.Text)
     date_created = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
     patient = db.relationship('Patient', backref=db.backref('liver_function_test', lazy=True, uselist=False))
 
-class ECG(db.Model):
+    __table_args__ = (db.Index('ix_liver_function_test_ast', 'ast', 'patient_id'),
+                      db.Index('ix_liver_function_test_alt', 'alt', 'patient_id'),
+                      db.Index('ix_liver_function_test_alp', 'alp', 'patient_id'))
+
+class ECG(ScreeningResult, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, unique=True)
     ecg_result = db.Column(db.Text)
@@ -291,7 +601,7 @@ class ECG(db.Model):
     date_created = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
     patient = db.relationship('Patient', backref=db.backref('ecg', lazy=True, uselist=False))
 
-class Spirometry(db.Model):
+class Spirometry(ScreeningResult, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, unique=True)
     spirometry_result = db.Column(db.Text)
@@ -299,7 +609,7 @@ class Spirometry(db.Model):
     date_created = db.Column(db.DateTime, default=lambda: datetime.now(UTC))
     patient = db.relationship('Patient', backref=db.backref('spirometry', lazy=True, uselist=False))
 
-class Audiometry(db.Model):
+class Audiometry(ScreeningResult, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, unique=True)
     audiometry_result = db.Column(db.Text)
@@ -0,0 +1,56 @@
+from flask_socketio import emit, join_room
+from app import socketio
+from app.models import AuditLog
+
+# Audit actions that raise an admin notification
+NOTIFIABLE_ACTIONS = ['GENERATE_TEMP_CODE', 'REVOKE_TEMP_CODE', 'USER_REGISTER']
+
+# Socket.IO room joined by every connected user who may see notifications
+ADMIN_ROOM = 'admins'
+NOTIFICATION_PERMISSION = 'manage_roles'
+
+
+def to_dict(log):
+    return {
+        'id': log.id,
+        'action': log.action,
+        'details': log.details,
+        'timestamp': log.timestamp.isoformat() + 'Z'
+    }
+
+
+def unread_notifications(limit=5):
+    """The newest unread notifications, found through the (action, timestamp, id) index."""
+    notifications = AuditLog.query.filter(
+        AuditLog.action.in_(NOTIFIABLE_ACTIONS),
+        AuditLog.notified == False
+    ).order_by(AuditLog.timestamp.desc()).limit(limit).all()
+    return [to_dict(n) for n in notifications]
+
+
+def join_admin_room(user):
+    """
+    Called when a Socket.IO client connects. Admins join the notification room
+    and are sent what they missed while disconnected; everything after that is pushed.
+    """
+    if not user.has_permission(NOTIFICATION_PERMISSION):
+        return
+    join_room(ADMIN_ROOM)
+    emit('notifications', unread_notifications())
+
+
+def publish(events):
+    """Pushes newly written audit events that are notifiable to every connected admin."""
+    for event in events:
+        if event['action'] in NOTIFIABLE_ACTIONS:
+            socketio.emit('notification', {
+                'id': event['id'],
+                'action': event['action'],
+                'details': event['details'],
+                'timestamp': event['timestamp'].replace(tzinfo=None).isoformat() + 'Z'
+            }, room=ADMIN_ROOM)
+
+
+def publish_read(ids):
+    """Tells every admin tab that these notifications have been read."""
+    socketio.emit('notifications_read', {'ids': ids}, room=ADMIN_ROOM)
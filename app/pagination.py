@@ -0,0 +1,17 @@
+from datetime import datetime
+
+# Keyset pagination cursors: the (timestamp, id) position of the last row shown,
+# written as '<iso timestamp>_<id>'. `column` names the row's timestamp attribute.
+
+
+def encode_cursor(row, column='timestamp'):
+    return f'{getattr(row, column).isoformat()}_{row.id}'
+
+
+def decode_cursor(cursor):
+    """The (timestamp, id) position in a cursor, or None if it is malformed."""
+    try:
+        timestamp, row_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (AttributeError, ValueError):
+        return None
@@ -1,12 +1,11 @@
 from flask import render_template, redirect, url_for, flash, jsonify, session, request
 from flask_login import login_required
-from app import db
+from app import db, staff_index, registration_stats
 from app.patient import patient
 from app.models import Patient
 from app.patient.forms import PatientRegistrationForm
 from app.utils import log_audit
-from datetime import date, datetime, time
-from sqlalchemy import func
+from datetime import date
 
 def calculate_age(born):
     today = date.today()
@@ -36,7 +35,10 @@ def register():
             screening_year=session.get('year', date.today().year)
         )
         db.session.add(new_patient)
+        db.session.flush()
+        registration_stats.patient_added(new_patient)
         db.session.commit()
+        staff_index.patient_saved(new_patient)
         log_audit('CREATE_PATIENT', f'Patient created: {new_patient.staff_id} ({new_patient.first_name} {new_patient.last_name})')
         flash(f'Patient {form.first_name.data} {form.last_name.data} has been registered successfully!', 'success')
         return redirect(url_for('patient.register'))
@@ -44,33 +46,21 @@ def register():
     # --- Statistics Calculation ---
     year = session.get('year', date.today().year)
     company = session.get('company', 'DCP')
-
-    today_start = datetime.combine(date.today(), time.min)
-    today_end = datetime.combine(date.today(), time.max)
-
-    stats = {
-        'total': Patient.query.filter_by(screening_year=year, company=company).count(),
-        'today': Patient.query.filter(
-            Patient.screening_year == year,
-            Patient.company == company,
-            Patient.date_registered.between(today_start, today_end)
-        ).count(),
-        'male': Patient.query.filter_by(screening_year=year, company=company, gender='Male').count(),
-        'female': Patient.query.filter_by(screening_year=year, company=company, gender='Female').count(),
-        'over_40': Patient.query.filter(
-            Patient.screening_year == year,
-            Patient.company == company,
-            Patient.age >= 40
-        ).count(),
-        'under_40': Patient.query.filter(
-            Patient.screening_year == year,
-            Patient.company == company,
-            Patient.age < 40
-        ).count()
-    }
+    stats = registration_stats.registration_stats(company, year)
 
     return render_template('patient/register.html', title='Register Patient', form=form, stats=stats)
 
+@patient.route('/api/stats')
+@login_required
+def api_stats():
+    """
+    Registration dashboard figures for the session's company/year, for the
+    register page to refresh without reloading.
+    """
+    year = session.get('year', date.today().year)
+    company = session.get('company', 'DCP')
+    return jsonify(registration_stats.registration_stats(company, year))
+
 @patient.route('/api/search')
 @login_required
 def search_patient():
@@ -81,6 +71,7 @@ def search_patient():
     year = session.get('year', date.today().year)
     company = session.get('company', 'DCP')
 
+    # An exact lookup is one probe of _staff_company_year_uc, always current unlike the staff index
     patient = Patient.query.filter_by(staff_id=staff_id, screening_year=year, company=company).first()
 
     if patient:
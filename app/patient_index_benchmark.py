@@ -0,0 +1,147 @@
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import create_engine, func, select, text
+from app.models import Patient
+
+# Indexes added for the access paths below; the "before" run is without them
+ACCESS_PATH_INDEXES = ['ix_patient_company_year_registered', 'ix_patient_staff_id_year',
+                       'ix_patient_year_patient_id', 'ix_patient_date_registered']
+
+COMPANIES = ['DCP', 'DCT']
+YEARS = list(range(2019, 2027))
+INSERT_BATCH_SIZE = 5000
+
+
+def access_paths(company, year, staff_id):
+    """The Patient queries the application runs, as (name, where it runs, statement)."""
+    p = Patient.__table__.c
+    return [
+        ('yearly_records', 'data_view.view_yearly_records',
+         select(Patient.__table__).where(p.company == company, p.screening_year == year)
+         .order_by(p.date_registered.desc()).limit(20)),
+        ('all_patients', 'data_view.view_all_patients',
+         select(Patient.__table__).order_by(p.date_registered.desc()).limit(20)),
+        ('registration_rebuild', 'registration_stats.rebuild',
+         select(p.date_registered, p.gender, p.age).where(p.company == company, p.screening_year == year)),
+        ('staff_id_search', 'search.search_patients',
+         select(Patient.__table__).where(p.company == company, p.screening_year == year,
+                                         func.upper(p.staff_id) >= staff_id[:3],
+                                         func.upper(p.staff_id) < staff_id[:2] + chr(ord(staff_id[2]) + 1))
+         .order_by(func.upper(p.staff_id)).limit(21)),
+        ('existing_staff_ids', 'importer.load_existing_keys',
+         select(p.staff_id).where(p.company == company, p.screening_year == year)),
+        ('existing_patient_ids', 'importer.load_existing_keys',
+         select(p.patient_id).where(p.screening_year == year)),
+        ('cohort_ids', 'report_batch.cohort_patient_ids',
+         select(p.id).where(p.company == company, p.screening_year == year).order_by(p.staff_id)),
+        ('latest_by_staff_id', 'portal.patient_search',
+         select(Patient.__table__).where(p.staff_id == staff_id).order_by(p.screening_year.desc()).limit(1)),
+        ('records_by_staff_id', 'portal.dashboard',
+         select(Patient.__table__).where(p.staff_id == staff_id).order_by(p.screening_year.desc())),
+    ]
+
+
+def _synthetic_rows(count, seed):
+    """
+    `count` patients spread over every company/year, each cohort drawing staff
+    IDs from one shared pool so the same person appears across years.
+    """
+    rng = random.Random(seed)
+    cohorts = [(company, year) for company in COMPANIES for year in YEARS]
+    per_cohort = -(-count // len(cohorts))
+    row_id = 0
+    for company, year in cohorts:
+        registered = datetime(year, 1, 2, 8)
+        for n in rng.sample(range(per_cohort * 2), per_cohort):
+            if row_id == count:
+                return
+            row_id += 1
+            registered += timedelta(seconds=rng.randint(1, 120))
+            age = rng.randint(20, 65)
+            yield {
+                'id': row_id, 'staff_id': f'{company[-1]}{n:07d}', 'patient_id': f'{company}{year}-{row_id:07d}',
+                'first_name': 'First', 'middle_name': None, 'last_name': 'Last', 'department': 'Operations',
+                'gender': rng.choice(['Male', 'Female']), 'date_of_birth': date(year - age, 6, 1), 'age': age,
+                'contact_phone': '0800000000', 'email_address': None, 'race': 'African', 'nationality': 'Nigerian',
+                'date_registered': registered, 'company': company, 'screening_year': year
+            }
+
+
+def _measure(connection, sql, repeat):
+    plan = [row[-1] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql)]
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        connection.exec_driver_sql(sql).fetchall()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {'plan': plan, 'ms': round(best * 1000, 3)}
+
+
+def run_benchmark(rows=200_000, repeat=5, seed=1, progress=None):
+    """
+    Builds a scratch SQLite database holding `rows` synthetic patients, then
+    runs every access path with and without ACCESS_PATH_INDEXES, recording the
+    query plan and the best of `repeat` timings each way. The application
+    database is not touched.
+
+    Paths whose plan uses none of ACCESS_PATH_INDEXES are flagged
+    `already_indexed`: an older index serves them in both runs, so their
+    timings do not show an improvement.
+
+    Returns {'rows', 'index_build_ms', 'paths': [{'name', 'route', 'sql',
+    'before': {'plan', 'ms'}, 'after': {'plan', 'ms'}, 'already_indexed'}]}.
+    """
+    table = Patient.__table__
+    new_indexes = [index for index in table.indexes if index.name in ACCESS_PATH_INDEXES]
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine('sqlite:///' + os.path.join(directory, 'benchmark.db'))
+        try:
+            with engine.begin() as connection:
+                table.create(connection)
+                for index in new_indexes:
+                    index.drop(connection)
+
+            batch, inserted = [], 0
+            for row in _synthetic_rows(rows, seed):
+                batch.append(row)
+                if len(batch) == INSERT_BATCH_SIZE:
+                    with engine.begin() as connection:
+                        connection.execute(table.insert(), batch)
+                    inserted += len(batch)
+                    batch = []
+                    if progress:
+                        progress(inserted)
+            if batch:
+                with engine.begin() as connection:
+                    connection.execute(table.insert(), batch)
+
+            with engine.connect() as connection:
+                sample = connection.execute(select(table.c.company, table.c.screening_year, table.c.staff_id)
+                                            .order_by(table.c.id.desc()).limit(1)).one()
+                paths = [{'name': name, 'route': route,
+                          'sql': str(stmt.compile(engine, compile_kwargs={'literal_binds': True}))}
+                         for name, route, stmt in access_paths(*sample)]
+
+                connection.execute(text('ANALYZE'))
+                for path in paths:
+                    path['before'] = _measure(connection, path['sql'], repeat)
+
+                started = time.perf_counter()
+                for index in new_indexes:
+                    index.create(connection)
+                connection.execute(text('ANALYZE'))
+                index_build_ms = round((time.perf_counter() - started) * 1000, 1)
+                connection.commit()
+
+                for path in paths:
+                    path['after'] = _measure(connection, path['sql'], repeat)
+                    path['already_indexed'] = not any(index in step for step in path['after']['plan']
+                                                      for index in ACCESS_PATH_INDEXES)
+        finally:
+            engine.dispose()
+
+    return {'rows': rows, 'index_build_ms': index_build_ms, 'paths': paths}
@@ -0,0 +1,73 @@
+from sqlalchemy import tuple_
+from app.models import Patient
+from app.pagination import encode_cursor, decode_cursor
+from app.registration_stats import registered_total
+
+LISTING_PAGE_SIZE = 20
+
+
+class PatientPage:
+    """
+    One page of a patient listing, newest registration first. `next_cursor`
+    leads to older registrations and `prev_cursor` to newer ones; either is
+    None at that end. `total` is the number of patients matching the filters,
+    or None when it is not known without counting (a department filter).
+    """
+    def __init__(self, items, next_cursor, prev_cursor, total):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def patient_page(company=None, year=None, department=None, gender=None, after=None, before=None,
+                 per_page=LISTING_PAGE_SIZE):
+    """
+    A page of patients using keyset pagination on (date_registered, id). With
+    a company and year the page is a range scan of
+    ix_patient_company_year_registered, otherwise of ix_patient_date_registered
+    (SQLite keeps the id in both), so no page counts or skips rows.
+
+    `after` pages towards older registrations and `before` towards newer ones.
+    The total comes from the RegistrationCount summary rather than a COUNT over
+    Patient; it is left out when filtering by department, which the summary
+    does not record.
+    """
+    key = tuple_(Patient.date_registered, Patient.id)
+    query = Patient.query
+    if company:
+        query = query.filter(Patient.company == company)
+    if year is not None:
+        query = query.filter(Patient.screening_year == year)
+    if department:
+        query = query.filter(Patient.department == department)
+    if gender:
+        query = query.filter(Patient.gender == gender)
+
+    after, before = decode_cursor(after), decode_cursor(before)
+    if before:
+        # Walk forwards from the cursor, then show the page newest first
+        rows = query.filter(key > before).order_by(Patient.date_registered, Patient.id).limit(per_page + 1).all()
+        more_newer = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        more_older = True
+    else:
+        if after:
+            query = query.filter(key < after)
+        rows = query.order_by(Patient.date_registered.desc(), Patient.id.desc()).limit(per_page + 1).all()
+        more_older = len(rows) > per_page
+        rows = rows[:per_page]
+        more_newer = after is not None
+
+    return PatientPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1], 'date_registered') if rows and more_older else None,
+        prev_cursor=encode_cursor(rows[0], 'date_registered') if rows and more_newer else None,
+        total=None if department else registered_total(company, year, gender)
+    )
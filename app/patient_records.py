@@ -0,0 +1,44 @@
+from flask import abort
+from sqlalchemy.orm import selectinload
+from app import db
+from app.models import Patient
+
+# The one-to-one records that, with the Patient row, make up a full patient
+# record: everything the director review page and the PDF report show.
+PATIENT_RECORDS = ['consultation', 'full_blood_count', 'kidney_function_test', 'lipid_profile',
+                   'liver_function_test', 'ecg', 'spirometry', 'audiometry', 'director_review']
+
+
+def full_record_options():
+    """
+    Loader options that fetch every record with one `WHERE patient_id IN (...)`
+    query per record table, instead of one wide outer join or a lazy load each.
+    """
+    return [selectinload(getattr(Patient, name)) for name in PATIENT_RECORDS]
+
+
+def load_full_patients(patient_ids):
+    """
+    Patients with all their records loaded, in the order of `patient_ids`;
+    ids with no patient are skipped. Takes one query for the patients and one
+    per record table, however many ids are given.
+    """
+    patient_ids = list(patient_ids)
+    if not patient_ids:
+        return []
+    patients = {p.id: p for p in Patient.query.options(*full_record_options())
+                                              .filter(Patient.id.in_(patient_ids))}
+    return [patients[pid] for pid in patient_ids if pid in patients]
+
+
+def load_full_patient(patient_id):
+    """A patient with all their records loaded, or None."""
+    patients = load_full_patients([patient_id])
+    return patients[0] if patients else None
+
+
+def get_full_patient_or_404(patient_id):
+    patient = load_full_patient(patient_id)
+    if patient is None:
+        abort(404)
+    return patient
@@ -1,10 +1,12 @@
-from flask import render_template, redirect, url_for, jsonify, request, flash, session
+from flask import render_template, redirect, url_for, jsonify, request, flash, session, current_app
 from app.portal import portal
 from flask import abort
 from app.models import Patient, PatientAccount
+from app.settings import get_setting
 from .forms import PatientSignUpForm, PatientLoginForm, PatientChangePasswordForm
 from app import db
-from app.utils import log_audit, generate_patient_pdf
+from app.utils import log_audit, generate_patient_pdf, enqueue_report_email
+from app.patient_records import load_full_patient
 from app.decorators import patient_account_login_required
 
 @portal.route('/start')
@@ -139,9 +141,7 @@ def download_report():
         abort(403) # Forbidden
 
     # Eager load all data for the report
-    patient_with_data = Patient.query.options(
-        db.joinedload('*')
-    ).get(patient_id)
+    patient_with_data = load_full_patient(patient.id)
 
     log_audit('PATIENT_DOWNLOAD_REPORT', f'Patient {account.staff_id} downloaded report for year {patient.screening_year}')
     return generate_patient_pdf(patient_with_data)
@@ -165,27 +165,20 @@ def email_report():
         flash('You do not have a registered email address. Please add one in your settings.', 'danger')
         return redirect(url_for('portal.dashboard'))
 
-    # Generate PDF in memory
-    pdf_bytes = generate_patient_pdf_bytes(patient)
-    pdf_filename = f'Medical_Report_{patient.screening_year}.pdf'
-
     # Construct dynamic sender name and subject
-    sender_name_prefix = db.session.query(Setting).filter_by(key='MAIL_SENDER_NAME').first()
-    sender_name_prefix = sender_name_prefix.value if sender_name_prefix else 'Legit HealthCare'
+    sender_name_prefix = get_setting('MAIL_SENDER_NAME', 'Legit HealthCare')
 
     sender_name = f"{sender_name_prefix} [{patient.company}-OBAJANA]"
     subject = f"MEDICAL REPORT: {patient.screening_year} Annual Medical Screening for SUNU Health Enrolees at {patient.company} Obajana"
 
-    # Send email
-    send_email(
-        to=patient.email_address,
+    # Rendering and sending happen in a background job
+    enqueue_report_email(
+        patient,
         subject=subject,
-        template='email/report_notification',
-        patient=patient,
-        attachments=[(pdf_filename, 'application/pdf', pdf_bytes)],
+        filename=f'Medical_Report_{patient.screening_year}.pdf',
         sender=(sender_name, current_app.config['MAIL_DEFAULT_SENDER'])
     )
 
     log_audit('PATIENT_EMAIL_REPORT', f'Patient {account.staff_id} emailed report for year {patient.screening_year}')
-    flash(f'Your {patient.screening_year} medical report has been sent to your registered email address.', 'success')
+    flash(f'Your {patient.screening_year} medical report is being prepared and will be sent to your registered email address shortly.', 'success')
     return redirect(url_for('portal.dashboard'))
@@ -0,0 +1,89 @@
+from collections import Counter
+from datetime import datetime, UTC
+from sqlalchemy import case, func, delete
+from sqlalchemy.dialects.sqlite import insert
+from app import db
+from app.models import Patient, RegistrationCount
+
+# Patients at or above this age count as "Age >= 40" on the dashboard.
+AGE_BAND = 40
+
+
+def _bucket(company, year, registered, gender, age):
+    registered = registered or datetime.now(UTC)
+    return (company, int(year), registered.date(), gender, age >= AGE_BAND)
+
+
+def _adjust(buckets):
+    """
+    Applies a Counter of bucket -> change in count as one upsert, so two
+    processes adding the first patient of a bucket at once cannot both
+    insert it. The caller commits.
+    """
+    rows = [{'company': company, 'screening_year': year, 'day': day, 'gender': gender, 'over_40': over_40,
+             'count': delta}
+            for (company, year, day, gender, over_40), delta in buckets.items() if delta]
+    if not rows:
+        return
+    stmt = insert(RegistrationCount)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['company', 'screening_year', 'day', 'gender', 'over_40'],
+        set_={'count': RegistrationCount.count + stmt.excluded['count']}
+    ), rows)
+
+
+def patient_added(patient):
+    _adjust(Counter({_bucket(patient.company, patient.screening_year, patient.date_registered,
+                             patient.gender, patient.age): 1}))
+
+
+def patient_removed(patient):
+    """Takes a patient out of the counts. Call before deleting or editing it."""
+    _adjust(Counter({_bucket(patient.company, patient.screening_year, patient.date_registered,
+                             patient.gender, patient.age): -1}))
+
+
+def patients_imported(records):
+    """Counts a batch of bulk-inserted patient records (dicts as passed to INSERT)."""
+    _adjust(Counter(_bucket(r['company'], r['screening_year'], r.get('date_registered'), r['gender'], r['age'])
+                    for r in records))
+
+
+def rebuild(company, year):
+    """
+    Recomputes the counts of one company/year from the patient table, for
+    `flask rebuild-registration-stats`. The caller commits.
+    """
+    db.session.execute(delete(RegistrationCount).where(RegistrationCount.company == company,
+                                                       RegistrationCount.screening_year == year))
+    rows = db.session.query(Patient.date_registered, Patient.gender, Patient.age)\
+                     .filter_by(company=company, screening_year=year)
+    _adjust(Counter(_bucket(company, year, registered, gender, age) for registered, gender, age in rows))
+
+
+def registered_total(company=None, year=None, gender=None):
+    """Patients registered for a company/year (all of them when not given), optionally of one gender."""
+    c = RegistrationCount
+    query = db.session.query(func.coalesce(func.sum(c.count), 0))
+    if company:
+        query = query.filter(c.company == company)
+    if year is not None:
+        query = query.filter(c.screening_year == year)
+    if gender:
+        query = query.filter(c.gender == gender)
+    return query.scalar()
+
+
+def registration_stats(company, year):
+    """The registration dashboard figures for a company/year, from one aggregate query."""
+    today = datetime.now(UTC).date()
+    c = RegistrationCount
+    row = db.session.query(
+        func.coalesce(func.sum(c.count), 0),
+        func.coalesce(func.sum(case((c.day == today, c.count), else_=0)), 0),
+        func.coalesce(func.sum(case((c.gender == 'Male', c.count), else_=0)), 0),
+        func.coalesce(func.sum(case((c.gender == 'Female', c.count), else_=0)), 0),
+        func.coalesce(func.sum(case((c.over_40, c.count), else_=0)), 0),
+        func.coalesce(func.sum(case((c.over_40, 0), else_=c.count)), 0)
+    ).filter(c.company == company, c.screening_year == year).one()
+    return dict(zip(['total', 'today', 'male', 'female', 'over_40', 'under_40'], (int(v) for v in row)))
@@ -0,0 +1,77 @@
+import mimetypes
+import os
+from urllib.parse import urlsplit, unquote
+from flask import current_app
+from werkzeug.security import safe_join
+from weasyprint import CSS
+from weasyprint.text.fonts import FontConfiguration
+from weasyprint.urls import default_url_fetcher
+
+# Reports are rendered against this origin rather than the request's, so no
+# URL in a report ever points back at our own server.
+REPORT_BASE_URL = 'http://report.local/'
+
+# Stylesheets applied to every report, relative to the static folder.
+REPORT_STYLESHEETS = [os.path.join('css', 'report.css')]
+
+_font_config = None
+_stylesheets = {}
+
+
+def font_config():
+    """The FontConfiguration shared by every report rendered in this process."""
+    global _font_config
+    if _font_config is None:
+        _font_config = FontConfiguration()
+    return _font_config
+
+
+def static_path_for(url):
+    """
+    Maps a /static/... URL (relative or on any host) to a file in the static
+    folder. Returns None when the URL is not a static file.
+    """
+    path = unquote(urlsplit(url).path)
+    prefix = current_app.static_url_path.rstrip('/') + '/'
+    if not path.startswith(prefix):
+        return None
+    filepath = safe_join(current_app.static_folder, path[len(prefix):])
+    if filepath is None or not os.path.isfile(filepath):
+        return None
+    return filepath
+
+
+def local_url_fetcher(url):
+    """
+    WeasyPrint url_fetcher that reads static files and uploaded logos from
+    disk and refuses everything else, so rendering does no network I/O.
+    """
+    if url.startswith('data:'):
+        return default_url_fetcher(url)
+    filepath = static_path_for(url)
+    if filepath is None:
+        raise ValueError(f'Refusing to fetch {url!r} while rendering a report.')
+    with open(filepath, 'rb') as f:
+        content = f.read()
+    mime_type, encoding = mimetypes.guess_type(filepath)
+    return {
+        'string': content,
+        'mime_type': mime_type or 'application/octet-stream',
+        'encoding': encoding,
+        'filename': os.path.basename(filepath),
+        'redirected_url': url
+    }
+
+
+def report_stylesheets():
+    """The parsed report stylesheets, parsed once per process and static folder."""
+    static_folder = current_app.static_folder
+    if static_folder not in _stylesheets:
+        _stylesheets[static_folder] = [
+            CSS(filename=os.path.join(static_folder, name),
+                base_url=REPORT_BASE_URL + current_app.static_url_path.strip('/') + '/' + name.replace(os.sep, '/'),
+                url_fetcher=local_url_fetcher,
+                font_config=font_config())
+            for name in REPORT_STYLESHEETS
+        ]
+    return _stylesheets[static_folder]
@@ -0,0 +1,246 @@
+import os
+import time
+import zipfile
+from datetime import datetime, timedelta, UTC
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from multiprocessing import get_context
+from flask import current_app, request, url_for
+from sqlalchemy import func
+from werkzeug.utils import secure_filename
+from app import db
+from app.models import Patient, DirectorReview, OutgoingEmail
+from app.jobs.runner import job_queue
+from app.mailer import mail_dispatcher
+from app.patient_records import load_full_patients
+
+# Patients rendered per task. Their records are loaded together, in one query
+# per record table, so the number of queries does not grow with the chunk.
+RENDER_CHUNK_SIZE = 10
+
+# Patient fields the report notification email uses, returned with each rendered report.
+RECIPIENT_FIELDS = ('email_address', 'first_name', 'staff_id', 'screening_year', 'company')
+
+# Per-process state of a pool worker, set up by _init_worker.
+_worker_app = None
+_worker_base_url = None
+
+
+def cohort_patient_ids(company, year, reviewed_only=False, with_email=False):
+    """
+    Ids of a company/year cohort in staff id order, optionally limited to
+    patients with a DirectorReview and/or an email address.
+    """
+    query = db.session.query(Patient.id).filter_by(company=company, screening_year=year)
+    if reviewed_only:
+        query = query.join(DirectorReview, DirectorReview.patient_id == Patient.id)
+    if with_email:
+        query = query.filter(Patient.email_address.isnot(None), Patient.email_address != '')
+    return [pid for (pid,) in query.order_by(Patient.staff_id)]
+
+
+def batch_workers():
+    return current_app.config['REPORT_BATCH_WORKERS'] or os.cpu_count() or 1
+
+
+def _render_patients(app, base_url, patient_ids):
+    """
+    Renders the reports of a chunk of patients inside `app`, loading their
+    full records together in a fixed number of queries. Returns a list of
+    (patient_id, archive_name, pdf_bytes, pages, error, recipient), where
+    recipient holds the patient fields the report email needs, so callers
+    never reload the patient.
+    """
+    from app.utils import generate_patient_report
+    results = []
+    with app.app_context(), app.test_request_context(base_url=base_url):
+        patients = {p.id: p for p in load_full_patients(patient_ids)}
+        for patient_id in patient_ids:
+            patient = patients.get(patient_id)
+            if patient is None:
+                results.append((patient_id, None, None, 0, 'patient no longer exists', None))
+                continue
+            try:
+                pdf_bytes, pages = generate_patient_report(patient)
+                name = secure_filename(f'report_{patient.staff_id}_{patient.screening_year}.pdf')
+                recipient = {field: getattr(patient, field) for field in RECIPIENT_FIELDS}
+                results.append((patient_id, name, pdf_bytes, pages, None, recipient))
+            except Exception as e:
+                results.append((patient_id, None, None, 0, str(e), None))
+    return results
+
+
+def _init_worker(config_name, base_url):
+    global _worker_app, _worker_base_url
+    from app import create_app
+    _worker_app = create_app(config_name)
+    _worker_base_url = base_url
+
+
+def _render_in_worker(patient_ids):
+    return _render_patients(_worker_app, _worker_base_url, patient_ids)
+
+
+def _chunks(patient_ids):
+    ids = iter(patient_ids)
+    while chunk := list(islice(ids, RENDER_CHUNK_SIZE)):
+        yield chunk
+
+
+def _render_all(patient_ids, workers, base_url):
+    """
+    Yields render results as they complete. The reports are rendered in a
+    pool of separate processes, a chunk of RENDER_CHUNK_SIZE patients per
+    task, even with a single worker: WeasyPrint is CPU-bound and would
+    otherwise stall the job's event loop. At most two tasks per worker are in
+    flight, so finished PDFs never pile up in memory. REPORT_BATCH_INLINE
+    renders in this process instead.
+    """
+    if current_app.config['REPORT_BATCH_INLINE']:
+        app = current_app._get_current_object()
+        for chunk in _chunks(patient_ids):
+            yield from _render_patients(app, base_url, chunk)
+        return
+
+    chunks = _chunks(patient_ids)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(current_app.config['CONFIG_NAME'], base_url)) as pool:
+        pending = {pool.submit(_render_in_worker, chunk) for chunk in islice(chunks, workers * 2)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+                next_chunk = next(chunks, None)
+                if next_chunk is not None:
+                    pending.add(pool.submit(_render_in_worker, next_chunk))
+
+
+def render_cohort_zip(company, year, output_path, base_url='http://localhost/', workers=None, progress=None):
+    """
+    Renders every report for a company/year cohort into a ZIP at `output_path`.
+
+    Each PDF is written to the archive as soon as it arrives. `progress`, if
+    given, is called as progress(done, total, stats) after each report.
+    Returns a dict with counts, elapsed time and throughput in pages/second.
+    """
+    patient_ids = cohort_patient_ids(company, year)
+    workers = workers or batch_workers()
+    stats = {'company': company, 'year': year, 'total': len(patient_ids), 'rendered': 0, 'pages': 0,
+             'failed': [], 'workers': workers, 'elapsed_seconds': 0.0, 'pages_per_second': 0.0}
+    started = time.monotonic()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    # PDFs are already compressed, so they are stored rather than deflated
+    with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for done, (patient_id, name, pdf_bytes, pages, error, _) in enumerate(
+                _render_all(patient_ids, workers, base_url), start=1):
+            if error:
+                stats['failed'].append({'patient_id': patient_id, 'error': error})
+            else:
+                archive.writestr(name, pdf_bytes)
+                stats['rendered'] += 1
+                stats['pages'] += pages
+            elapsed = time.monotonic() - started
+            stats['elapsed_seconds'] = round(elapsed, 2)
+            stats['pages_per_second'] = round(stats['pages'] / elapsed, 2) if elapsed else 0.0
+            if progress:
+                progress(done, len(patient_ids), stats)
+    return stats
+
+
+def batch_output_path(company, year, job_id):
+    return os.path.join(current_app.instance_path, 'report_batches', f'reports_{company}_{year}_{job_id}.zip')
+
+
+def enqueue_report_batch(company, year, user_id=None):
+    """Queues a background job that renders a whole cohort into a ZIP."""
+    return job_queue.enqueue('report_batch', {
+        'company': company,
+        'year': year,
+        'base_url': request.host_url
+    }, user_id=user_id, max_attempts=1)
+
+
+@job_queue.handler('report_batch')
+def report_batch_job(ctx, payload):
+    last_update = [0.0]
+
+    def report(done, total, stats):
+        # Saving progress costs a commit, so do it at most once a second
+        now = time.monotonic()
+        if done == total or now - last_update[0] >= 1:
+            last_update[0] = now
+            ctx.progress(done, total, f"{stats['pages_per_second']} pages/s, {len(stats['failed'])} failed")
+
+    path = batch_output_path(payload['company'], payload['year'], ctx.job.id)
+    stats = render_cohort_zip(payload['company'], payload['year'], path,
+                              base_url=payload.get('base_url'), progress=report)
+    stats['download_url'] = url_for('reports.download_batch', job_id=ctx.job.id)
+    return stats
+
+
+def enqueue_report_email_batch(company, year, reviewed_only=False, user_id=None):
+    """Queues a background job that renders and emails every report in a cohort."""
+    return job_queue.enqueue('report_email_batch', {
+        'company': company,
+        'year': year,
+        'reviewed_only': reviewed_only,
+        'base_url': request.host_url
+    }, user_id=user_id, max_attempts=1)
+
+
+@job_queue.handler('report_email_batch')
+def report_email_batch_job(ctx, payload):
+    """
+    Renders the cohort's reports in parallel and adds one email per patient
+    to the outbox. Send times are spaced REPORT_EMAIL_RATE_LIMIT per minute
+    apart, so the mail workers deliver them at that pace.
+
+    Patients who already have an email from this job (queued by an earlier,
+    interrupted run) are skipped, so nobody is emailed twice.
+    """
+    from app.utils import build_email
+    company, year = payload['company'], payload['year']
+    patient_ids = cohort_patient_ids(company, year, reviewed_only=payload.get('reviewed_only'), with_email=True)
+    emailed = {pid for (pid,) in db.session.query(OutgoingEmail.patient_id).filter_by(job_id=ctx.job.id)}
+    pending = [pid for pid in patient_ids if pid not in emailed]
+    per_minute = current_app.config['REPORT_EMAIL_RATE_LIMIT']
+    first_send = datetime.now(UTC)
+    if emailed and per_minute:
+        # Carry on after the send times the earlier run handed out
+        latest = db.session.query(func.max(OutgoingEmail.run_after)).filter_by(job_id=ctx.job.id).scalar()
+        first_send = max(first_send, latest.replace(tzinfo=UTC) + timedelta(seconds=60.0 / per_minute))
+    queued, failed = len(emailed), []
+    last_update = 0.0
+
+    for done, (patient_id, name, pdf_bytes, pages, error, recipient) in enumerate(
+            _render_all(pending, batch_workers(), payload.get('base_url')), start=len(emailed) + 1):
+        if error:
+            failed.append({'patient_id': patient_id, 'error': error})
+        else:
+            msg = build_email(
+                to=recipient['email_address'],
+                subject=f'Your {recipient["screening_year"]} Medical Report from Legit HealthCare Services',
+                template='email/report_notification',
+                attachments=[(name, 'application/pdf', pdf_bytes)],
+                patient=recipient
+            )
+            send_after = first_send + timedelta(seconds=(queued - len(emailed)) * 60.0 / per_minute) \
+                if per_minute else None
+            mail_dispatcher.queue(msg, send_after=send_after, patient_id=patient_id, job_id=ctx.job.id)
+            queued += 1
+
+        now = time.monotonic()
+        if done == len(patient_ids) or now - last_update >= 1:
+            last_update = now
+            ctx.progress(done, len(patient_ids), f'{queued} emails queued, {len(failed)} failed to render')
+
+    return {
+        'company': company,
+        'year': year,
+        'total': len(patient_ids),
+        'queued': queued,
+        'failed': failed,
+        'status_url': url_for('reports.email_batch_status', job_id=ctx.job.id)
+    }
@@ -0,0 +1,140 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from flask import current_app
+from app.patient_records import PATIENT_RECORDS
+
+# Patient relationships whose contents appear on the report.
+REPORT_RECORDS = PATIENT_RECORDS
+
+# Files whose contents define the report layout; editing any of them changes every fingerprint.
+REPORT_TEMPLATE = 'reports/a4_report_layout.html'
+REPORT_STYLESHEET = os.path.join('css', 'report.css')
+
+_template_version = None
+
+
+def cache_dir():
+    return current_app.config['REPORT_CACHE_DIR'] or os.path.join(current_app.instance_path, 'report_cache')
+
+
+def cache_enabled():
+    return current_app.config['REPORT_CACHE_MAX_BYTES'] > 0
+
+
+def template_version():
+    """Hash of the report template and stylesheet, computed once per process."""
+    global _template_version
+    if _template_version is None:
+        source, _, _ = current_app.jinja_env.loader.get_source(current_app.jinja_env, REPORT_TEMPLATE)
+        with open(os.path.join(current_app.static_folder, REPORT_STYLESHEET), 'rb') as f:
+            stylesheet = f.read()
+        digest = hashlib.sha256(source.encode('utf-8'))
+        digest.update(stylesheet)
+        _template_version = digest.hexdigest()[:16]
+    return _template_version
+
+
+def _row_values(obj):
+    if obj is None:
+        return None
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+
+def report_fingerprint(patient):
+    """
+    Content hash of everything that goes into a patient's report: the Patient
+    row, each related result/consultation/review record and the template version.
+    """
+    data = {
+        'template': template_version(),
+        'patient': _row_values(patient),
+        'records': {name: _row_values(getattr(patient, name)) for name in REPORT_RECORDS}
+    }
+    encoded = json.dumps(data, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _entry_path(patient_id, fingerprint, pages):
+    # The page count is part of the name, as it cannot be read back from a compressed PDF cheaply
+    return os.path.join(cache_dir(), f'{patient_id}-{fingerprint}-{pages}.pdf')
+
+
+def _find_entry(patient_id, fingerprint):
+    """The path and page count of the cached entry for a fingerprint, or (None, None)."""
+    for path in glob.glob(os.path.join(cache_dir(), f'{patient_id}-{fingerprint}-*.pdf')):
+        return path, int(path[:-len('.pdf')].rsplit('-', 1)[1])
+    return None, None
+
+
+def get_or_render(patient, render):
+    """
+    Returns (pdf_bytes, pages) of the cached PDF for the patient's current
+    data, or calls `render()`, which returns the same pair, to build it and
+    stores the result. Hits refresh the entry's modification time, which is
+    what LRU eviction goes by.
+    """
+    if not cache_enabled():
+        return render()
+
+    fingerprint = report_fingerprint(patient)
+    path, pages = _find_entry(patient.id, fingerprint)
+    if path:
+        try:
+            with open(path, 'rb') as f:
+                pdf_bytes = f.read()
+            os.utime(path)
+            return pdf_bytes, pages
+        except FileNotFoundError:
+            pass # Evicted since the lookup
+
+    pdf_bytes, pages = render()
+    # Older fingerprints for this patient can never be hit again
+    invalidate_patient_reports(patient.id)
+    _store(_entry_path(patient.id, fingerprint, pages), pdf_bytes)
+    evict()
+    return pdf_bytes, pages
+
+
+def _store(path, pdf_bytes):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(pdf_bytes)
+    os.replace(tmp_path, path)
+
+
+def invalidate_patient_reports(patient_id):
+    """Removes every cached report for the given patient."""
+    if not cache_enabled():
+        return
+    for path in glob.glob(os.path.join(cache_dir(), f'{patient_id}-*.pdf')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def evict():
+    """Deletes least recently used entries until the cache is within REPORT_CACHE_MAX_BYTES."""
+    limit = current_app.config['REPORT_CACHE_MAX_BYTES']
+    stats = []
+    try:
+        for entry in os.scandir(cache_dir()):
+            if entry.name.endswith('.pdf'):
+                stats.append((entry.path, entry.stat()))
+    except FileNotFoundError:
+        # The directory or an entry vanished under us; nothing to evict this time
+        return
+    total = sum(stat.st_size for _, stat in stats)
+    for path, stat in sorted(stats, key=lambda item: item[1].st_mtime):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= stat.st_size
@@ -1,10 +1,19 @@
-from flask import render_template, request, redirect, url_for, flash
-from flask_login import login_required
+import json
+from datetime import datetime
+from flask import render_template, request, redirect, url_for, flash, session, send_file, abort, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy import func
+from sqlalchemy.orm import defer, joinedload
 from app import db
 from app.reports import reports
-from app.models import Patient
+from app.models import Patient, Job, OutgoingEmail
 from app.decorators import permission_required
-from app.utils import generate_patient_pdf, generate_patient_pdf_bytes, send_email
+from app.utils import generate_patient_pdf, enqueue_report_email, log_audit
+from app.report_batch import enqueue_report_batch, enqueue_report_email_batch, batch_output_path
+from app.search import search_patients, autocomplete_staff_ids, patient_summary
+from app.patient_records import get_full_patient_or_404
+
+EMAIL_STATUS_PAGE_SIZE = 100
 
 @reports.route('/', methods=['GET', 'POST'])
 @login_required
@@ -16,18 +25,20 @@ def index():
     if request.method == 'POST':
         search_term = request.form.get('search_term', '').strip()
         company = request.form.get('company', 'DCP')
-        year = request.form.get('year', '2025')
+        year = request.form.get('year', 2025, type=int)
 
         if not search_term:
-            flash('Please enter a Staff ID to search.', 'warning')
+            flash('Please enter a Staff ID or name to search.', 'warning')
             return redirect(url_for('reports.index'))
 
-        patients = Patient.query.filter_by(company=company, screening_year=year)\
-                                .filter(Patient.staff_id.ilike(f'%{search_term}%')).all()
+        mode = request.form.get('mode', 'staff_id')
+        patients = search_patients(search_term, company, year, mode=mode).items
 
         return render_template('reports/index.html', title='Search Results', patients=patients, search_term=search_term)
 
-    return render_template('reports/index.html', title='Generate Patient Report')
+    job_id = request.args.get('job', type=int)
+    job = Job.query.get(job_id) if job_id else None
+    return render_template('reports/index.html', title='Generate Patient Report', job=job)
 
 
 @reports.route('/download/<int:patient_id>')
@@ -37,23 +48,10 @@ def download_report(patient_id):
     """
     Generates and downloads a PDF report for a single patient.
     """
-    patient = Patient.query.options(
-        db.joinedload(Patient.consultation),
-        db.joinedload(Patient.full_blood_count),
-        db.joinedload(Patient.kidney_function_test),
-        db.joinedload(Patient.lipid_profile),
-        db.joinedload(Patient.liver_function_test),
-        db.joinedload(Patient.ecg),
-        db.joinedload(Patient.spirometry),
-        db.joinedload(Patient.audiometry),
-        db.joinedload(Patient.director_review)
-    ).get_or_404(patient_id)
+    patient = get_full_patient_or_404(patient_id)
 
     return generate_patient_pdf(patient)
 
-from flask import jsonify
-from datetime import datetime
-
 @reports.route('/api/search')
 @login_required
 @permission_required('generate_patient_report')
@@ -62,26 +60,20 @@ def api_search():
     company = request.args.get('company', 'DCP')
     year = request.args.get('year', datetime.now().year, type=int)
 
-    if not search_term:
-        return jsonify([])
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 10, type=int)
 
-    patients = Patient.query.filter_by(company=company, screening_year=year)\
-                            .filter(Patient.staff_id.ilike(f'%{search_term}%')).limit(10).all()
-
-    return jsonify([{
-        'id': p.id,
-        'staff_id': p.staff_id,
-        'first_name': p.first_name,
-        'last_name': p.last_name,
-        'department': p.department
-    } for p in patients])
+    if request.args.get('mode') == 'name':
+        results = search_patients(search_term, company, year, page=page, per_page=per_page, mode='name')
+        return jsonify([patient_summary(p) for p in results])
+    return jsonify(autocomplete_staff_ids(search_term, company, year, page=page, per_page=per_page).items)
 
 @reports.route('/email/<int:patient_id>')
 @login_required
 @permission_required('generate_patient_report') # Re-using the same permission
 def email_report(patient_id):
     """
-    Generates a PDF report and emails it to the patient.
+    Queues a background job that generates the PDF report and emails it to the patient.
     """
     patient = Patient.query.get_or_404(patient_id)
 
@@ -89,21 +81,93 @@ def email_report(patient_id):
         flash('This patient does not have an email address on file.', 'warning')
         return redirect(url_for('reports.index'))
 
-    # Generate PDF in memory
-    pdf_bytes = generate_patient_pdf_bytes(patient)
-
-    # Prepare attachment
-    filename = f'report_{patient.staff_id}_{patient.screening_year}.pdf'
-    attachments = [(filename, 'application/pdf', pdf_bytes)]
-
-    # Send email
-    send_email(
-        to=patient.email_address,
+    job = enqueue_report_email(
+        patient,
         subject=f'Your {patient.screening_year} Medical Report from Legit HealthCare Services',
-        template='email/report_notification',
-        attachments=attachments,
-        patient=patient
+        filename=f'report_{patient.staff_id}_{patient.screening_year}.pdf',
+        user_id=current_user.id
     )
 
-    flash(f'Report has been successfully emailed to {patient.email_address}.', 'success')
+    flash(f'The report is being generated and will be emailed to {patient.email_address} (job #{job.id}).', 'success')
     return redirect(url_for('reports.index'))
+
+@reports.route('/batch', methods=['POST'])
+@login_required
+@permission_required('generate_patient_report')
+def batch_reports():
+    """
+    Queues a background job that renders every report for a company/year cohort into one ZIP file.
+    """
+    company = request.form.get('company') or session.get('company', 'DCP')
+    year = request.form.get('year', type=int) or session.get('year', datetime.now().year)
+
+    job = enqueue_report_batch(company, year, user_id=current_user.id)
+    flash(f'Generating all {company} {year} reports. The ZIP file will be available below when it is ready.', 'info')
+    return redirect(url_for('reports.index', job=job.id))
+
+@reports.route('/batch/<int:job_id>/download')
+@login_required
+@permission_required('generate_patient_report')
+def download_batch(job_id):
+    """
+    Downloads the ZIP produced by a finished batch report job.
+    """
+    job = Job.query.get_or_404(job_id)
+    if job.kind != 'report_batch' or job.status != 'succeeded':
+        abort(404)
+    result = json.loads(job.result)
+    path = batch_output_path(result['company'], result['year'], job.id)
+    return send_file(path, mimetype='application/zip', as_attachment=True,
+                     download_name=f"reports_{result['company']}_{result['year']}.zip")
+
+@reports.route('/email-batch', methods=['POST'])
+@login_required
+@permission_required('generate_patient_report')
+def email_batch():
+    """
+    Queues a background job that emails every report for a company/year cohort.
+    """
+    company = request.form.get('company') or session.get('company', 'DCP')
+    year = request.form.get('year', type=int) or session.get('year', datetime.now().year)
+    reviewed_only = bool(request.form.get('reviewed_only'))
+
+    job = enqueue_report_email_batch(company, year, reviewed_only=reviewed_only, user_id=current_user.id)
+    log_audit('BULK_EMAIL_REPORTS', f'Queued emailing of {company} {year} reports (job #{job.id}).')
+    flash(f'Emailing all {company} {year} reports. Delivery status is shown below.', 'info')
+    return redirect(url_for('reports.email_batch_status', job_id=job.id))
+
+@reports.route('/email-batch/<int:job_id>')
+@login_required
+@permission_required('generate_patient_report')
+def email_batch_status(job_id):
+    """
+    Shows the delivery status of each email sent by a bulk report email job.
+    """
+    job = Job.query.get_or_404(job_id)
+    if job.kind != 'report_email_batch':
+        abort(404)
+    # Pages of EMAIL_STATUS_PAGE_SIZE by id; the MIME messages (with their PDFs) are never loaded
+    query = OutgoingEmail.query.filter_by(job_id=job.id)\
+                               .options(defer(OutgoingEmail.message), joinedload(OutgoingEmail.patient))
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    if before:
+        emails = query.filter(OutgoingEmail.id < before).order_by(OutgoingEmail.id.desc())\
+                      .limit(EMAIL_STATUS_PAGE_SIZE + 1).all()
+        has_prev = len(emails) > EMAIL_STATUS_PAGE_SIZE
+        emails = emails[:EMAIL_STATUS_PAGE_SIZE][::-1]
+        has_next = True
+    else:
+        if after:
+            query = query.filter(OutgoingEmail.id > after)
+        emails = query.order_by(OutgoingEmail.id).limit(EMAIL_STATUS_PAGE_SIZE + 1).all()
+        has_next = len(emails) > EMAIL_STATUS_PAGE_SIZE
+        emails = emails[:EMAIL_STATUS_PAGE_SIZE]
+        has_prev = after is not None
+    counts = dict(db.session.query(OutgoingEmail.status, func.count(OutgoingEmail.id))
+                            .filter(OutgoingEmail.job_id == job.id).group_by(OutgoingEmail.status))
+    payload = json.loads(job.payload)
+    return render_template('reports/email_batch.html', title='Bulk Report Emails', job=job, emails=emails,
+                           next_cursor=emails[-1].id if emails and has_next else None,
+                           prev_cursor=emails[0].id if emails and has_prev else None,
+                           counts=counts, company=payload['company'], year=payload['year'])
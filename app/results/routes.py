@@ -1,8 +1,13 @@
-from flask import render_template, request, redirect, url_for, flash, abort
+from datetime import date
+from flask import render_template, request, redirect, url_for, flash, abort, jsonify
 from flask_login import login_required
 from app import db
 from app.results import results
 from app.models import Patient, FullBloodCount, KidneyFunctionTest, LipidProfile, LiverFunctionTest, ECG, Spirometry, Audiometry
+from app.report_cache import invalidate_patient_reports
+from app.search import search_patients, search_scope
+from app.completion import COMPLETION_RECORDS, COMPLETION_KEYS, worklist_page, missing_counts
+from app.lab_values import LAB_ANALYTES, analyte_range, analyte_summary
 from .forms import FullBloodCountForm, KidneyFunctionTestForm, LipidProfileForm, LiverFunctionTestForm, ECGForm, SpirometryForm, AudiometryForm
 
 @results.route('/')
@@ -17,15 +22,53 @@ def index():
         {'name': 'ECG', 'endpoint': 'results.ecg'},
         {'name': 'Spirometry', 'endpoint': 'results.spirometry'},
         {'name': 'Audiometry', 'endpoint': 'results.audiometry'},
+        {'name': 'Worklist', 'endpoint': 'results.worklist'},
     ]
     return render_template('results/index.html', title='Select Test', tests=tests)
 
+def worklist_args():
+    """The company/year (defaulting to the session's), `missing` filter and cursors of a worklist request."""
+    company, year = search_scope(request.args.get('company'), request.args.get('year', type=int))
+    missing = request.args.get('missing') or None
+    if missing and missing not in COMPLETION_KEYS:
+        abort(400)
+    return {'company': company, 'year': year or date.today().year, 'missing': missing,
+            'after': request.args.get('after'), 'before': request.args.get('before')}
+
+@results.route('/worklist')
+@login_required
+def worklist():
+    args = worklist_args()
+    page = worklist_page(**args)
+    counts = missing_counts(args['company'], args['year'])
+    filters = {k: args[k] for k in ('company', 'year', 'missing') if args[k]}
+    return render_template('results/worklist.html', title='Worklist', page=page, counts=counts,
+                           records=COMPLETION_RECORDS, filters=filters)
+
+@results.route('/api/worklist')
+@login_required
+def api_worklist():
+    page = worklist_page(**worklist_args(), per_page=request.args.get('per_page', type=int))
+    return jsonify({'patients': page.items, 'next_cursor': page.next_cursor, 'prev_cursor': page.prev_cursor})
+
+@results.route('/api/lab_values')
+@login_required
+def api_lab_values():
+    analyte = request.args.get('analyte', '')
+    if analyte not in LAB_ANALYTES:
+        return jsonify({'error': f'analyte must be one of: {", ".join(LAB_ANALYTES)}'}), 400
+    company, year = search_scope(request.args.get('company'), request.args.get('year', type=int))
+    year = year or date.today().year
+    patients = analyte_range(analyte, company, year, low=request.args.get('low', type=float),
+                             high=request.args.get('high', type=float))
+    return jsonify({'analyte': analyte, 'patients': patients, 'summary': analyte_summary(analyte, company, year)})
+
 @results.route('/full_blood_count', methods=['GET', 'POST'])
 @login_required
 def full_blood_count():
-    if request.method == 'POST':
-        search_term = request.form.get('search_term', '')
-        patients = Patient.query.filter(Patient.staff_id.ilike(f'%{search_term}%')).all()
+    search_term = request.values.get('search_term')
+    if search_term is not None:
+        patients = search_patients(search_term, after=request.args.get('after', type=int))
         return render_template('results/full_blood_count_search.html', title='Search Patient', patients=patients, search_term=search_term)
 
     return render_template('results/full_blood_count_search.html', title='Search Patient')
@@ -49,6 +92,7 @@ def full_blood_count_form(patient_id):
             flash('Full Blood Count results saved successfully!', 'success')
 
         db.session.commit()
+        invalidate_patient_reports(patient.id)
         return redirect(url_for('results.full_blood_count'))
 
     return render_template('results/full_blood_count_form.html', title='Full Blood Count', form=form, patient=patient)
@@ -56,9 +100,9 @@ def full_blood_count_form(patient_id):
 @results.route('/kidney_function_test', methods=['GET', 'POST'])
 @login_required
 def kidney_function_test():
-    if request.method == 'POST':
-        search_term = request.form.get('search_term', '')
-        patients = Patient.query.filter(Patient.staff_id.ilike(f'%{search_term}%')).all()
+    search_term = request.values.get('search_term')
+    if search_term is not None:
+        patients = search_patients(search_term, after=request.args.get('after', type=int))
         return render_template('results/kidney_function_test_search.html', title='Search Patient', patients=patients, search_term=search_term)
 
     return render_template('results/kidney_function_test_search.html', title='Search Patient')
@@ -84,6 +128,7 @@ def kidney_function_test_form(patient_id):
             flash('Kidney Function Test results saved successfully!', 'success')
 
         db.session.commit()
+        invalidate_patient_reports(patient.id)
         return redirect(url_for('results.kidney_function_test'))
 
     return render_template('results/kidney_function_test_form.html', title='Kidney Function Test', form=form, patient=patient)
@@ -91,9 +136,9 @@ def kidney_function_test_form(patient_id):
 @results.route('/lipid_profile', methods=['GET', 'POST'])
 @login_required
 def lipid_profile():
-    if request.method == 'POST':
-        search_term = request.form.get('search_term', '')
-        patients = Patient.query.filter(Patient.staff_id.ilike(f'%{search_term}%')).all()
+    search_term = request.values.get('search_term')
+    if search_term is not None:
+        patients = search_patients(search_term, after=request.args.get('after', type=int))
         return render_template('results/lipid_profile_search.html', title='Search Patient', patients=patients, search_term=search_term)
 
     return render_template('results/lipid_profile_search.html', title='Search Patient')
@@ -124,6 +169,7 @@ def lipid_profile_form(patient_id):
             flash('Lipid Profile results saved successfully!', 'success')
 
         db.session.commit()
+        invalidate_patient_reports(patient.id)
         return redirect(url_for('results.lipid_profile'))
 
     return render_template('results/lipid_profile_form.html', title='Lipid Profile', form=form, patient=patient)
@@ -131,9 +177,9 @@ def lipid_profile_form(patient_id):
 @results.route('/liver_function_test', methods=['GET', 'POST'])
 @login_required
 def liver_function_test():
-    if request.method == 'POST':
-        search_term = request.form.get('search_term', '')
-        patients = Patient.query.filter(Patient.staff_id.ilike(f'%{search_term}%')).all()
+    search_term = request.values.get('search_term')
+    if search_term is not None:
+        patients = search_patients(search_term, after=request.args.get('after', type=int))
         return render_template('results/liver_function_test_search.html', title='Search Patient', patients=patients, search_term=search_term)
 
     return render_template('results/liver_function_test_search.html', title='Search Patient')
@@ -157,6 +203,7 @@ def liver_function_test_form(patient_id):
             flash('Liver Function Test results saved successfully!', 'success')
 
         db.session.commit()
+        invalidate_patient_reports(patient.id)
         return redirect(url_for('results.liver_function_test'))
 
     return render_template('results/liver_function_test_form.html', title='Liver Function Test', form=form, patient=patient)
@@ -165,9 +212,9 @@ def liver_function_test_form(patient_id):
 @results.route('/ecg', methods=['GET', 'POST'])
 @login_required
 def ecg():
-    if request.method == 'POST':
-        search_term = request.form.get('search_term', '')
-        patients = Patient.query.filter(Patient.staff_id.ilike(f'%{search_term}%')).all()
+    search_term = request.values.get('search_term')
+    if search_term is not None:
+        patients = search_patients(search_term, after=request.args.get('after', type=int))
         return render_template('results/ecg_search.html', title='Search Patient', patients=patients, search_term=search_term)
     return render_template('results/ecg_search.html', title='Search Patient')
 
@@ -187,6 +234,7 @@ def ecg_form(patient_id):
             db.session.add(ecg_record)
             flash('ECG results saved successfully!', 'success')
         db.session.commit()
+        invalidate_patient_reports(patient.id)
         return redirect(url_for('results.ecg'))
     return render_template('results/ecg_form.html', title='ECG', form=form, patient=patient)
 
@@ -194,9 +242,9 @@ def ecg_form(patient_id):
 @results.route('/spirometry', methods=['GET', 'POST'])
 @login_required
 def spirometry():
-    if request.method == 'POST':
-        search_term = request.form.get('search_term', '')
-        patients = Patient.query.filter(Patient.staff_id.ilike(f'%{search_term}%')).all()
+    search_term = request.values.get('search_term')
+    if search_term is not None:
+        patients = search_patients(search_term, after=request.args.get('after', type=int))
         return render_template('results/spirometry_search.html', title='Search Patient', patients=patients, search_term=search_term)
     return render_template('results/spirometry_search.html', title='Search Patient')
 
@@ -216,6 +264,7 @@ def spirometry_form(patient_id):
             db.session.add(sp_record)
             flash('Spirometry results saved successfully!', 'success')
         db.session.commit()
+        invalidate_patient_reports(patient.id)
         return redirect(url_for('results.spirometry'))
     return render_template('results/spirometry_form.html', title='Spirometry', form=form, patient=patient)
 
@@ -223,9 +272,9 @@ def spirometry_form(patient_id):
 @results.route('/audiometry', methods=['GET', 'POST'])
 @login_required
 def audiometry():
-    if request.method == 'POST':
-        search_term = request.form.get('search_term', '')
-        patients = Patient.query.filter(Patient.staff_id.ilike(f'%{search_term}%')).all()
+    search_term = request.values.get('search_term')
+    if search_term is not None:
+        patients = search_patients(search_term, after=request.args.get('after', type=int))
         return render_template('results/audiometry_search.html', title='Search Patient', patients=patients, search_term=search_term)
     return render_template('results/audiometry_search.html', title='Search Patient')
 
@@ -245,5 +294,6 @@ def audiometry_form(patient_id):
             db.session.add(au_record)
             flash('Audiometry results saved successfully!', 'success')
         db.session.commit()
+        invalidate_patient_reports(patient.id)
         return redirect(url_for('results.audiometry'))
     return render_template('results/audiometry_form.html', title='Audiometry', form=form, patient=patient)
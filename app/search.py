@@ -0,0 +1,186 @@
+import re
+from flask import current_app, session
+from sqlalchemy import DDL, event, and_, or_, func, text, tuple_
+from app import db
+from app.models import Patient
+from app.staff_index import get_index
+
+# Full-text index over the name and ID columns of Patient, kept in step with
+# the patient table by triggers, so ORM writes and bulk imports are covered alike.
+FTS_COLUMNS = ['staff_id', 'patient_id', 'first_name', 'middle_name', 'last_name', 'department']
+
+_FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS patient_fts USING fts5(
+        {', '.join(FTS_COLUMNS)}, content='patient', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_fts_insert AFTER INSERT ON patient BEGIN
+        INSERT INTO patient_fts(rowid, {', '.join(FTS_COLUMNS)})
+        VALUES (new.id, {', '.join('new.' + c for c in FTS_COLUMNS)});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_fts_delete AFTER DELETE ON patient BEGIN
+        INSERT INTO patient_fts(patient_fts, rowid, {', '.join(FTS_COLUMNS)})
+        VALUES ('delete', old.id, {', '.join('old.' + c for c in FTS_COLUMNS)});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_fts_update AFTER UPDATE ON patient BEGIN
+        INSERT INTO patient_fts(patient_fts, rowid, {', '.join(FTS_COLUMNS)})
+        VALUES ('delete', old.id, {', '.join('old.' + c for c in FTS_COLUMNS)});
+        INSERT INTO patient_fts(rowid, {', '.join(FTS_COLUMNS)})
+        VALUES (new.id, {', '.join('new.' + c for c in FTS_COLUMNS)});
+    END""",
+    # Index rows that existed before the table was created
+    "INSERT INTO patient_fts(patient_fts) VALUES ('rebuild')"
+]
+
+# db.create_all() (tests, fresh installs) builds the index too; migrations run the same DDL.
+for _statement in _FTS_DDL:
+    event.listen(Patient.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+event.listen(Patient.__table__, 'before_drop', DDL('DROP TABLE IF EXISTS patient_fts').execute_if(dialect='sqlite'))
+
+
+class SearchPage:
+    """
+    One page of ranked search results. `next_cursor` is the id of the last
+    patient shown, to pass back as `after`, or None on the last page.
+    """
+    def __init__(self, items, term, page, per_page, has_next, next_cursor=None):
+        self.items = items
+        self.term = term
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+        self.next_cursor = next_cursor
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def search_scope(company=None, year=None):
+    """The company/year to search, defaulting to the session's filters."""
+    company = company or session.get('company', 'DCP')
+    year = int(year) if year else session.get('year')
+    return company, year
+
+
+def _prefix_range(column, prefix):
+    """
+    `column LIKE 'prefix%'` written as a range, which SQLite and PostgreSQL
+    can answer from an index on the column.
+    """
+    last = ord(prefix[-1])
+    if last >= 0x10FFFF:
+        return column >= prefix
+    return and_(column >= prefix, column < prefix[:-1] + chr(last + 1))
+
+
+def _fts_query(term):
+    """Turns free text into an FTS5 query where every word must match the start of a token."""
+    words = re.findall(r'\w+', term)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _name_filter(term):
+    """
+    Patients matching every word of `term` at the start of a name or ID token.
+    On SQLite this is a lookup in patient_fts; other databases get LIKE prefixes.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        match = _fts_query(term)
+        if not match:
+            return None
+        return Patient.id.in_(text('SELECT rowid FROM patient_fts WHERE patient_fts MATCH :match')
+                              .bindparams(match=match))
+    columns = [getattr(Patient, c) for c in FTS_COLUMNS]
+    words = re.findall(r'\w+', term)
+    if not words:
+        return None
+    return and_(*[or_(*[c.ilike(f'{word}%') for c in columns]) for word in words])
+
+
+def search_patients(term, company=None, year=None, page=1, per_page=None, mode='staff_id', after=None):
+    """
+    Finds patients in one company/year.
+
+    In 'staff_id' mode, patients whose staff ID starts with `term` in any case,
+    in upper-cased staff ID order through ix_patient_company_year_staff_id_upper;
+    an exact match is the smallest such ID, so it ranks first. In 'name' mode,
+    patients matching every word of `term` in the full-text index, in name
+    order. Returns a SearchPage.
+
+    Pages are fetched either by number, stopping at SEARCH_MAX_RESULTS rows
+    across all pages, or with `after` set to a previous page's next_cursor,
+    which continues from that patient by keyset, one bounded page at a time.
+    """
+    term = (term or '').strip()
+    page = max(page or 1, 1)
+    max_results = current_app.config['SEARCH_MAX_RESULTS']
+    per_page = min(per_page or current_app.config['SEARCH_PAGE_SIZE'], max_results)
+    offset = 0 if after is not None else (page - 1) * per_page
+    if not term or offset >= max_results:
+        return SearchPage([], term, page, per_page, False)
+
+    company, year = search_scope(company, year)
+    query = Patient.query.filter_by(company=company, screening_year=year)
+    if mode == 'name':
+        condition = _name_filter(term)
+        if condition is None:
+            return SearchPage([], term, page, per_page, False)
+        order = [Patient.last_name, Patient.first_name, Patient.staff_id, Patient.id]
+        query = query.filter(condition)
+    else:
+        # Compared upper-cased, the expression ix_patient_company_year_staff_id_upper is built on
+        order = [func.upper(Patient.staff_id), Patient.staff_id, Patient.id]
+        query = query.filter(_prefix_range(order[0], term.upper()))
+
+    if after is not None:
+        position = db.session.query(*order).filter(Patient.id == after).first()
+        if position is None:
+            return SearchPage([], term, page, per_page, False)
+        query = query.filter(tuple_(*order) > tuple_(*position))
+        limit = per_page
+    else:
+        limit = min(per_page, max_results - offset)
+
+    # Fetch one extra row to learn whether there is a next page
+    rows = query.order_by(*order).offset(offset).limit(limit + 1).all()
+    more = len(rows) > limit
+    has_next = more and (after is not None or offset + limit < max_results)
+    rows = rows[:limit]
+    return SearchPage(rows, term, page, per_page, has_next, next_cursor=rows[-1].id if more else None)
+
+
+def autocomplete_staff_ids(term, company=None, year=None, page=1, per_page=10):
+    """
+    Staff ID prefix matches as patient summaries, answered from the in-memory
+    staff index without a database query once the index is loaded. Ranking and
+    the SEARCH_MAX_RESULTS cap are the same as search_patients.
+    """
+    term = (term or '').strip()
+    page = max(page or 1, 1)
+    max_results = current_app.config['SEARCH_MAX_RESULTS']
+    per_page = min(per_page or current_app.config['SEARCH_PAGE_SIZE'], max_results)
+    offset = (page - 1) * per_page
+    if not term or offset >= max_results:
+        return SearchPage([], term, page, per_page, False)
+
+    limit = min(per_page, max_results - offset)
+    rows = get_index(*search_scope(company, year)).search(term, offset, limit + 1)
+    has_next = len(rows) > limit and offset + limit < max_results
+    return SearchPage(rows[:limit], term, page, per_page, has_next)
+
+
+def patient_summary(patient):
+    """The fields returned by the api_search endpoints."""
+    return {
+        'id': patient.id,
+        'staff_id': patient.staff_id,
+        'first_name': patient.first_name,
+        'last_name': patient.last_name,
+        'department': patient.department
+    }
@@ -0,0 +1,92 @@
+import time
+from flask import current_app
+from sqlalchemy import update, cast, Integer, String
+from app import db
+from app.models import Setting
+
+# Setting row whose value is bumped on every write, so each process can tell
+# when its cached copy is out of date.
+VERSION_KEY = 'settings_version'
+# Setting row holding the next free send time under MAIL_RATE_LIMIT, shared by
+# every process's mail workers (see app/mailer.py).
+MAIL_SLOT_KEY = 'mail_next_send_at'
+
+# Settings that override the mail configuration when they are present.
+MAIL_SETTINGS = {
+    'MAIL_USERNAME': ['MAIL_USERNAME', 'MAIL_DEFAULT_SENDER'], # Sender email is the username
+    'MAIL_PASSWORD': ['MAIL_PASSWORD'],
+    'MAIL_SENDER_NAME': ['MAIL_SENDER_NAME']
+}
+
+
+def _state():
+    return current_app.extensions.setdefault('settings_cache', {'values': None, 'version': None, 'checked_at': 0.0})
+
+
+def _current_version():
+    return db.session.query(Setting.value).filter_by(key=VERSION_KEY).scalar()
+
+
+def _load(state):
+    rows = db.session.query(Setting.key, Setting.value).all()
+    values = {key: value for key, value in rows if key not in (VERSION_KEY, MAIL_SLOT_KEY)}
+    state['version'] = next((value for key, value in rows if key == VERSION_KEY), None)
+    state['values'] = values
+    _apply_mail_settings(current_app.config, values)
+
+
+def _apply_mail_settings(config, values):
+    for key, config_keys in MAIL_SETTINGS.items():
+        if values.get(key):
+            for config_key in config_keys:
+                config[config_key] = values[key]
+
+
+def all_settings():
+    """
+    Every setting as a dict, served from memory. The database is asked for the
+    version stamp at most every SETTINGS_CHECK_INTERVAL seconds, and the
+    settings are reloaded only when another process has changed them.
+    """
+    state = _state()
+    now = time.monotonic()
+    if state['values'] is None:
+        _load(state)
+        state['checked_at'] = now
+    elif now - state['checked_at'] >= current_app.config['SETTINGS_CHECK_INTERVAL']:
+        if _current_version() != state['version']:
+            _load(state)
+        state['checked_at'] = now
+    return state['values']
+
+
+def get_setting(key, default=None):
+    value = all_settings().get(key)
+    return default if value is None else value
+
+
+def save_settings(values):
+    """
+    Creates or updates settings and bumps the version stamp. The caller
+    commits; this process reloads on its next read, others within
+    SETTINGS_CHECK_INTERVAL seconds.
+    """
+    existing = {s.key: s for s in Setting.query.filter(Setting.key.in_(list(values)))}
+    for key, value in values.items():
+        setting = existing.get(key) or Setting(key=key)
+        setting.value = value
+        db.session.add(setting)
+
+    bumped = db.session.execute(
+        update(Setting).where(Setting.key == VERSION_KEY)
+        .values(value=cast(cast(Setting.value, Integer) + 1, String))
+    ).rowcount
+    if not bumped:
+        db.session.add(Setting(key=VERSION_KEY, value='1'))
+    _state()['values'] = None
+
+
+def load_settings(app):
+    """Loads the settings into `app`'s cache and mail configuration at startup."""
+    with app.app_context():
+        _load(_state())
@@ -0,0 +1,87 @@
+import time
+from datetime import datetime, timedelta, UTC
+import socketio as python_socketio
+from sqlalchemy import delete, func, insert, select
+from app import db
+from app.models import SocketIOMessage
+
+# SOCKETIO_MESSAGE_QUEUE value that selects DatabaseManager
+DATABASE_QUEUE = 'database'
+
+
+class DatabaseManager(python_socketio.PubSubManager):
+    """
+    A Socket.IO message queue kept in the application database, for running
+    several worker processes without an outside broker.
+
+    Every emit, room change and disconnect is written to the socketio_message
+    table. Each process polls the table every SOCKETIO_POLL_INTERVAL seconds
+    and replays what other processes wrote, so an emit to a user's room
+    reaches that user whichever process holds their connection. Rows older
+    than SOCKETIO_MESSAGE_TTL seconds are pruned.
+    """
+    name = 'database'
+
+    def __init__(self, app, channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.app = app
+        self.last_id = None
+
+    def initialize(self):
+        # Only messages written after this process joined are of interest
+        self.last_id = self.latest_id()
+        super().initialize()
+
+    def latest_id(self):
+        with self.app.app_context():
+            return db.session.query(func.coalesce(func.max(SocketIOMessage.id), 0)).scalar()
+
+    def _publish(self, data):
+        with self.app.app_context(), db.engine.begin() as connection:
+            connection.execute(insert(SocketIOMessage).values(
+                channel=self.channel, payload=self.json.dumps(data), created_at=datetime.now(UTC)
+            ))
+
+    def _prune(self):
+        cutoff = datetime.now(UTC) - timedelta(seconds=self.app.config['SOCKETIO_MESSAGE_TTL'])
+        with db.engine.begin() as connection:
+            connection.execute(delete(SocketIOMessage).where(SocketIOMessage.created_at < cutoff))
+
+    def _listen(self):
+        if self.last_id is None:
+            self.last_id = self.latest_id()
+        interval = self.app.config['SOCKETIO_POLL_INTERVAL']
+        pruned_at = time.monotonic()
+        while True:
+            with self.app.app_context():
+                with db.engine.connect() as connection:
+                    rows = connection.execute(
+                        select(SocketIOMessage.id, SocketIOMessage.payload)
+                        .where(SocketIOMessage.channel == self.channel, SocketIOMessage.id > self.last_id)
+                        .order_by(SocketIOMessage.id)
+                    ).all()
+                if time.monotonic() - pruned_at >= self.app.config['SOCKETIO_MESSAGE_TTL']:
+                    self._prune()
+                    pruned_at = time.monotonic()
+            for message_id, payload in rows:
+                self.last_id = message_id
+                yield payload
+            if not rows:
+                self.server.sleep(interval)
+
+
+def socketio_options(app):
+    """
+    Keyword arguments for socketio.init_app that select the message queue named
+    by SOCKETIO_MESSAGE_QUEUE: unset for a single process, 'database' for
+    DatabaseManager, or a redis://, amqp://, kafka:// or zmq URL handled by
+    python-socketio's own managers.
+    """
+    url = app.config['SOCKETIO_MESSAGE_QUEUE']
+    channel = app.config['SOCKETIO_CHANNEL']
+    if url == DATABASE_QUEUE:
+        return {'client_manager': DatabaseManager(app, channel=channel), 'message_queue': None}
+    if url:
+        return {'message_queue': url, 'channel': channel}
+    # SocketIO keeps its options between init_app calls, so clear any manager an earlier app set
+    return {'client_manager': None, 'message_queue': None}
@@ -0,0 +1,121 @@
+import threading
+import time
+from bisect import bisect_left
+from flask import current_app
+from app import db
+from app.models import Patient
+
+# Fields kept for each patient; these are what the api_search endpoints return.
+SUMMARY_FIELDS = ['id', 'staff_id', 'first_name', 'last_name', 'department']
+
+_lock = threading.Lock()
+
+
+class StaffIdIndex:
+    """
+    The staff IDs of one company/year in sorted order, each mapped to a
+    compact patient summary. Keys are upper-cased so lookups ignore case.
+    """
+    def __init__(self, summaries):
+        entries = sorted((s['staff_id'].upper(), s['id']) for s in summaries)
+        self.keys = [key for key, _ in entries]
+        self.ids = [pid for _, pid in entries]
+        self.summaries = {s['id']: s for s in summaries}
+        self.built_at = time.monotonic()
+
+    def search(self, prefix, offset=0, limit=10):
+        """Summaries whose staff ID starts with `prefix`, exact match first, then in staff ID order."""
+        prefix = prefix.upper()
+        start = bisect_left(self.keys, prefix) + offset
+        found = []
+        for i in range(start, len(self.keys)):
+            if len(found) >= limit or not self.keys[i].startswith(prefix):
+                break
+            found.append(self.summaries[self.ids[i]])
+        return found
+
+    def get(self, staff_id):
+        """The summary of the patient with exactly this staff ID, or None."""
+        key = staff_id.upper()
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            summary = self.summaries[self.ids[i]]
+            if summary['staff_id'] == staff_id:
+                return summary
+            i += 1
+        return None
+
+    def put(self, summary):
+        self.discard(summary['id'])
+        key = summary['staff_id'].upper()
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key and self.ids[i] < summary['id']:
+            i += 1
+        self.keys.insert(i, key)
+        self.ids.insert(i, summary['id'])
+        self.summaries[summary['id']] = summary
+
+    def discard(self, patient_id):
+        summary = self.summaries.pop(patient_id, None)
+        if summary is None:
+            return
+        i = bisect_left(self.keys, summary['staff_id'].upper())
+        while self.ids[i] != patient_id:
+            i += 1
+        del self.keys[i]
+        del self.ids[i]
+
+
+def _indexes():
+    """The loaded indexes of the current app, keyed by (company, year)."""
+    return current_app.extensions.setdefault('staff_index', {})
+
+
+def summarize(patient):
+    return {field: getattr(patient, field) for field in SUMMARY_FIELDS}
+
+
+def _build(company, year):
+    rows = db.session.query(*[getattr(Patient, f) for f in SUMMARY_FIELDS])\
+                     .filter_by(company=company, screening_year=year)
+    return StaffIdIndex([dict(zip(SUMMARY_FIELDS, row)) for row in rows])
+
+
+def get_index(company, year):
+    """
+    The index for a company/year, built from the database on first use and
+    again once it is older than STAFF_INDEX_MAX_AGE seconds (which bounds how
+    stale another process's changes can look).
+    """
+    key = (company, int(year))
+    index = _indexes().get(key)
+    if index is None or time.monotonic() - index.built_at > current_app.config['STAFF_INDEX_MAX_AGE']:
+        index = _build(*key)
+        with _lock:
+            _indexes()[key] = index
+    return index
+
+
+def patient_saved(patient):
+    """Adds or refreshes a registered or edited patient in the loaded index, if any."""
+    with _lock:
+        index = _indexes().get((patient.company, int(patient.screening_year)))
+        if index is not None:
+            index.put(summarize(patient))
+
+
+def patient_deleted(patient):
+    """Removes a deleted patient from the loaded index, if any."""
+    with _lock:
+        index = _indexes().get((patient.company, int(patient.screening_year)))
+        if index is not None:
+            index.discard(patient.id)
+
+
+def invalidate(company=None, year=None):
+    """Drops the index of one company/year (or all of them); it is rebuilt on next use."""
+    with _lock:
+        if company is None:
+            _indexes().clear()
+        else:
+            _indexes().pop((company, int(year)), None)
@@ -1,9 +1,12 @@
 document.addEventListener('DOMContentLoaded', function() {
-    const socket = io();
+    const socket = io({ transports: ['websocket'] }); // Any worker process can take a WebSocket; see README
 
     let currentRecipientId = null;
+    let nextCursor = null;
     const chatHeader = document.getElementById('chat-header');
     const chatMessages = document.getElementById('chat-messages');
+    const messageList = document.getElementById('message-list');
+    const loadEarlierButton = document.getElementById('load-earlier');
     const messageForm = document.getElementById('message-form');
     const messageInput = document.getElementById('message-input');
     const chatInputArea = document.getElementById('chat-input-area');
@@ -22,6 +25,52 @@ document.addEventListener('DOMContentLoaded', function() {
         console.log('Status: ' + data.msg);
     });
 
+    function messageElement(msg) {
+        const item = document.createElement('div');
+        item.classList.add('message');
+        item.classList.add(msg.sender_id === currentUserId ? 'sent' : 'received');
+        item.textContent = msg.body;
+        return item;
+    }
+
+    function setUnread(userId, count) {
+        const item = document.querySelector(`.user-item[data-user-id="${userId}"]`);
+        if (!item) return;
+        const badge = item.querySelector('.unread-badge');
+        badge.textContent = count;
+        badge.style.display = count > 0 ? '' : 'none';
+    }
+
+    // Loads one page of history; earlier pages are added above what is shown
+    function loadHistory(recipientId, before) {
+        const params = new URLSearchParams({ with: recipientId });
+        if (before) params.set('before', before);
+        return fetch(`/messaging/api/history?${params}`)
+            .then(response => response.json())
+            .then(data => {
+                if (recipientId !== currentRecipientId) return; // Another conversation was opened meanwhile
+                const previousHeight = chatMessages.scrollHeight;
+                const fragment = document.createDocumentFragment();
+                data.messages.forEach(msg => fragment.appendChild(messageElement(msg)));
+                messageList.prepend(fragment);
+                nextCursor = data.next_cursor;
+                loadEarlierButton.style.display = nextCursor ? 'block' : 'none';
+                // Keep the view where it was when older messages are added, or at the bottom on first load
+                chatMessages.scrollTop = before ? chatMessages.scrollHeight - previousHeight : chatMessages.scrollHeight;
+            })
+            .catch(error => console.error('Error loading messages:', error));
+    }
+
+    function markRead(senderId) {
+        fetch('/messaging/api/read', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ with: senderId }),
+        })
+        .then(() => setUnread(senderId, 0))
+        .catch(error => console.error('Error marking messages as read:', error));
+    }
+
     // Handle user selection
     userListItems.forEach(item => {
         item.addEventListener('click', function() {
@@ -33,14 +82,22 @@ document.addEventListener('DOMContentLoaded', function() {
             const userName = this.dataset.userName;
 
             chatHeader.textContent = `Chat with ${userName}`;
-            chatMessages.innerHTML = ''; // Clear previous messages
+            messageList.innerHTML = ''; // Clear previous messages
+            nextCursor = null;
             chatInputArea.style.display = 'block';
             messageInput.focus();
 
-            // Here you would typically fetch message history via an API call
+            loadHistory(currentRecipientId);
+            markRead(currentRecipientId);
         });
     });
 
+    loadEarlierButton.addEventListener('click', function() {
+        if (currentRecipientId && nextCursor) {
+            loadHistory(currentRecipientId, nextCursor);
+        }
+    });
+
     // Handle message sending
     messageForm.addEventListener('submit', function(e) {
         e.preventDefault();
@@ -60,17 +117,14 @@ document.addEventListener('DOMContentLoaded', function() {
         const isMyOwnMessage = msg.sender_id === currentUserId && msg.recipient_id === currentRecipientId;
 
         if (isChattingWithSender || isMyOwnMessage) {
-            const item = document.createElement('div');
-            item.classList.add('message');
-            item.textContent = msg.body;
-
-            if (msg.sender_id === currentUserId) {
-                item.classList.add('sent');
-            } else {
-                item.classList.add('received');
-            }
-            chatMessages.appendChild(item);
+            messageList.appendChild(messageElement(msg));
             chatMessages.scrollTop = chatMessages.scrollHeight; // Auto-scroll
+            if (isChattingWithSender) {
+                markRead(msg.sender_id);
+            }
+        } else if (msg.sender_id !== currentUserId) {
+            const badge = document.querySelector(`.user-item[data-user-id="${msg.sender_id}"] .unread-badge`);
+            if (badge) setUnread(msg.sender_id, parseInt(badge.textContent, 10) + 1);
         }
     });
 });
@@ -0,0 +1,73 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const panels = document.querySelectorAll('[data-job-id]');
+    if (panels.length === 0) return;
+
+    function render(panel, job) {
+        panel.querySelector('.job-status').textContent = job.status;
+
+        let message = job.message || '';
+        if (job.progress.total) {
+            message = `${job.progress.done} of ${job.progress.total} - ${message}`;
+        }
+        if (job.error && job.status !== 'succeeded') {
+            message += ` (${job.error})`;
+        }
+        panel.querySelector('.job-message').textContent = message;
+
+        const resultBox = panel.querySelector('.job-result');
+        if (job.status === 'succeeded' && job.result && resultBox) {
+            resultBox.innerHTML = '';
+            if (job.result.inserted !== undefined) {
+                const summary = document.createElement('p');
+                summary.textContent = `Imported ${job.result.inserted} patient records.`;
+                resultBox.appendChild(summary);
+            }
+            if (job.result.pages_per_second !== undefined) {
+                const summary = document.createElement('p');
+                summary.textContent = `Rendered ${job.result.rendered} of ${job.result.total} reports ` +
+                    `(${job.result.pages} pages) in ${job.result.elapsed_seconds}s - ${job.result.pages_per_second} pages/s.`;
+                resultBox.appendChild(summary);
+            }
+            if (job.result.queued !== undefined) {
+                const summary = document.createElement('p');
+                summary.textContent = `Queued ${job.result.queued} of ${job.result.total} report emails ` +
+                    `(${job.result.failed.length} could not be rendered). Reload the page to see delivery progress.`;
+                resultBox.appendChild(summary);
+            }
+            if (job.result.download_url) {
+                const link = document.createElement('a');
+                link.href = job.result.download_url;
+                link.className = 'btn btn-success';
+                link.textContent = 'Download ZIP';
+                resultBox.appendChild(link);
+            }
+            const rejected = job.result.rejected || {};
+            Object.keys(rejected).forEach(reason => {
+                const line = document.createElement('p');
+                line.textContent = `Skipped (${reason}): rows ${rejected[reason].join(', ')}`;
+                resultBox.appendChild(line);
+            });
+        }
+    }
+
+    function fetchJob(panel) {
+        fetch(`/jobs/${panel.dataset.jobId}`)
+            .then(response => response.json())
+            .then(job => render(panel, job))
+            .catch(error => console.error('Error fetching job status:', error));
+    }
+
+    // Load the current state once, then follow live updates pushed by the server
+    panels.forEach(fetchJob);
+
+    const socket = io({ transports: ['websocket'] }); // Any worker process can take a WebSocket; see README
+    socket.on('job_status', job => {
+        panels.forEach(panel => {
+            if (parseInt(panel.dataset.jobId, 10) === job.id) {
+                render(panel, job);
+            }
+        });
+    });
+    // Catch up on anything missed while the socket was reconnecting
+    socket.on('connect', () => panels.forEach(fetchJob));
+});
@@ -2,36 +2,46 @@ document.addEventListener('DOMContentLoaded', function() {
     const bell = document.getElementById('notification-bell');
     const dot = document.querySelector('.notification-dot');
     const panel = document.getElementById('notification-panel');
+    const maxShown = 5;
 
     if (!bell) return;
 
-    // Function to fetch notifications
-    function fetchNotifications() {
-        fetch('/admin/api/notifications')
-            .then(response => response.json())
-            .then(data => {
-                if (data.length > 0) {
-                    dot.style.display = 'block';
-                    updateNotificationPanel(data);
-                } else {
-                    dot.style.display = 'none';
-                }
-            })
-            .catch(error => console.error('Error fetching notifications:', error));
+    // Function to build one panel entry
+    function notificationItem(n) {
+        const item = document.createElement('div');
+        item.classList.add('notification-item');
+        item.dataset.id = n.id;
+        item.innerHTML = `<strong>${n.action}</strong><br>${n.details}<br><small>${new Date(n.timestamp).toLocaleString()}</small>`;
+        return item;
     }
 
     // Function to update the panel content
     function updateNotificationPanel(notifications) {
         panel.innerHTML = ''; // Clear existing
-        notifications.forEach(n => {
-            const item = document.createElement('div');
-            item.classList.add('notification-item');
-            item.dataset.id = n.id;
-            item.innerHTML = `<strong>${n.action}</strong><br>${n.details}<br><small>${new Date(n.timestamp).toLocaleString()}</small>`;
-            panel.appendChild(item);
-        });
+        notifications.forEach(n => panel.appendChild(notificationItem(n)));
+        dot.style.display = notifications.length > 0 ? 'block' : 'none';
     }
 
+    // Notifications are pushed over Socket.IO. On every (re)connect the server
+    // sends the unread ones, so nothing is missed while disconnected.
+    const socket = io({ transports: ['websocket'] }); // Any worker process can take a WebSocket; see README
+    socket.on('notifications', updateNotificationPanel);
+    socket.on('notification', n => {
+        panel.prepend(notificationItem(n));
+        while (panel.children.length > maxShown) {
+            panel.lastChild.remove();
+        }
+        dot.style.display = 'block';
+    });
+    // Read in another tab
+    socket.on('notifications_read', data => {
+        const ids = data.ids.map(String);
+        const unread = Array.from(panel.querySelectorAll('.notification-item')).filter(item => !ids.includes(item.dataset.id));
+        if (unread.length === 0) {
+            dot.style.display = 'none';
+        }
+    });
+
     // Function to mark notifications as read
     function markAsRead() {
         const unreadItems = panel.querySelectorAll('.notification-item');
@@ -68,8 +78,4 @@ document.addEventListener('DOMContentLoaded', function() {
             panel.classList.remove('show');
         }
     });
-
-    // Initial fetch and polling
-    fetchNotifications();
-    setInterval(fetchNotifications, 30000); // Poll every 30 seconds
 });
@@ -1,37 +1,36 @@
 import re
-from threading import Thread
 from flask import current_app, render_template, request, make_response
 from flask_mail import Message
-from app import db, mail
+from app import report_cache, report_assets
 from weasyprint import HTML
-from app.models import AuditLog
+from app.jobs.runner import job_queue
+from app.mailer import mail_dispatcher
+from app.audit import audit_writer
+from app.settings import all_settings
+from app.patient_records import load_full_patient
 from flask_login import current_user
 
-def log_audit(action, details=None):
+def log_audit(action, details=None, user_id=None):
     """
-    Helper function to create and save an audit log record.
+    Records an audit event. The event is buffered and written in the background
+    (see app/audit.py); the caller's session is neither flushed nor committed.
+    `user_id` attributes the event when there is no logged-in user, e.g. in a background job.
     """
     try:
-        user_id = current_user.id if current_user.is_authenticated else None
-        log = AuditLog(
-            user_id=user_id,
-            action=action,
-            details=details
-        )
-        db.session.add(log)
-        db.session.commit()
+        if user_id is None:
+            user_id = current_user.id if current_user.is_authenticated else None
+        audit_writer.log(action, details, user_id)
     except Exception as e:
         # In a real application, you'd want more robust error handling,
         # perhaps logging the error to a file instead of just printing.
         print(f"Error logging audit trail: {e}")
-        db.session.rollback()
-
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
 
-def send_email(to, subject, template, attachments=None, sender=None, **kwargs):
+def build_email(to, subject, template, attachments=None, sender=None, **kwargs):
+    """
+    Renders an email template pair (.txt and .html) into a Message.
+    """
     app = current_app._get_current_object()
+    all_settings() # Picks up mail settings changed in the admin panel
 
     # Use default sender from app config if not provided
     if sender is None:
@@ -47,10 +46,15 @@ def send_email(to, subject, template, attachments=None, sender=None, **kwargs):
     if attachments:
         for attachment in attachments:
             msg.attach(*attachment)
+    return msg
 
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+def send_email(to, subject, template, attachments=None, sender=None, **kwargs):
+    """
+    Renders an email and adds it to the outbox. Returns the OutgoingEmail.
+    The caller commits.
+    """
+    msg = build_email(to, subject, template, attachments=attachments, sender=sender, **kwargs)
+    return mail_dispatcher.queue(msg)
 
 def is_password_strong(password):
     """
@@ -73,14 +77,30 @@ def is_password_strong(password):
         return False, "Password must contain at least one special symbol."
     return True, ""
 
-def generate_patient_pdf_bytes(patient):
+def render_patient_pdf(patient):
     """
-    Generates the raw bytes of a PDF report for a given patient object.
+    Renders a patient's PDF report with WeasyPrint, bypassing the report cache.
+    Static files and logos are read from disk, never fetched over HTTP.
+    Returns (pdf_bytes, pages), the page count taken from the laid-out document.
     """
     # Note: Using the new A4 layout as a placeholder
     rendered_template = render_template('reports/a4_report_layout.html', patient=patient)
-    html = HTML(string=rendered_template, base_url=request.base_url)
-    return html.write_pdf()
+    html = HTML(string=rendered_template, base_url=report_assets.REPORT_BASE_URL,
+                url_fetcher=report_assets.local_url_fetcher)
+    document = html.render(stylesheets=report_assets.report_stylesheets(),
+                           font_config=report_assets.font_config())
+    return document.write_pdf(), len(document.pages)
+
+def generate_patient_report(patient):
+    """
+    The PDF report of a given patient object as (pdf_bytes, pages).
+    Unchanged reports are served from the on-disk report cache.
+    """
+    return report_cache.get_or_render(patient, lambda: render_patient_pdf(patient))
+
+def generate_patient_pdf_bytes(patient):
+    """Generates the raw bytes of a PDF report for a given patient object."""
+    return generate_patient_report(patient)[0]
 
 def generate_patient_pdf(patient):
     """
@@ -95,3 +115,38 @@ def generate_patient_pdf(patient):
     response.headers['Content-Disposition'] = f'attachment; filename=report_{patient.staff_id}_{patient.screening_year}.pdf'
 
     return response
+
+def enqueue_report_email(patient, subject, filename, sender=None, user_id=None):
+    """
+    Queues a background job that renders a patient's report and emails it to them.
+    Returns the Job.
+    """
+    return job_queue.enqueue('email_report', {
+        'patient_id': patient.id,
+        'subject': subject,
+        'filename': filename,
+        'sender': list(sender) if sender else None,
+        'base_url': request.host_url
+    }, user_id=user_id)
+
+@job_queue.handler('email_report')
+def email_report_job(ctx, payload):
+    patient = load_full_patient(payload['patient_id'])
+    if patient is None:
+        raise LookupError(f"Patient {payload['patient_id']} no longer exists.")
+
+    ctx.progress(0, 2, 'Rendering report')
+    pdf_bytes = generate_patient_pdf_bytes(patient)
+
+    ctx.progress(1, 2, f'Queueing email to {patient.email_address}')
+    msg = build_email(
+        to=patient.email_address,
+        subject=payload['subject'],
+        template='email/report_notification',
+        attachments=[(payload['filename'], 'application/pdf', pdf_bytes)],
+        sender=tuple(payload['sender']) if payload.get('sender') else None,
+        patient=patient
+    )
+    email = mail_dispatcher.queue(msg)
+    ctx.progress(2, 2, f'Queued for delivery to {patient.email_address}')
+    return {'patient_id': patient.id, 'to': patient.email_address, 'email_id': email.id}
@@ -8,6 +8,60 @@ class Config:
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'true').lower() in ['true', 'on', '1']
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_TIMEOUT = 30 # seconds
+
+    # Outbound mail dispatcher (see app/mailer.py)
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS', '2'))
+    MAIL_BATCH_SIZE = 50 # messages a worker claims at a time
+    MAIL_MAX_PER_CONNECTION = 100 # messages sent before the SMTP session is reopened
+    MAIL_RATE_LIMIT = int(os.environ.get('MAIL_RATE_LIMIT', '0')) # messages per minute across all workers; 0 is unlimited
+    MAIL_POLL_INTERVAL = 2 # seconds between outbox checks when idle
+    MAIL_MAX_ATTEMPTS = 5
+    MAIL_RETRY_DELAY = 60 # seconds before the first retry, doubled for each further attempt
+    MAIL_LEASE_TIMEOUT = 600 # seconds a claimed message may go without a delivery in its batch before it is requeued
+    MAIL_DISPATCH_INLINE = False
+
+    # Audit log writer (see app/audit.py)
+    AUDIT_FLUSH_INTERVAL = 1 # seconds between writes of buffered audit events
+    AUDIT_BATCH_SIZE = 200 # events per insert; a full batch is written without waiting for the interval
+    AUDIT_WRITE_INLINE = False
+    # Audit rows older than this are moved to compressed archive segments (see app/audit_archive.py)
+    AUDIT_RETENTION_DAYS = int(os.environ.get('AUDIT_RETENTION_DAYS', '365'))
+    AUDIT_ARCHIVE_DIR = os.environ.get('AUDIT_ARCHIVE_DIR') # defaults to <instance>/audit_archive
+
+    # Socket.IO message queue shared by the worker processes (see app/socketio_queue.py):
+    # unset for a single process, 'database' to relay through the app database,
+    # or a redis://, amqp://, kafka:// or zmq URL
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_CHANNEL = 'flask-socketio'
+    SOCKETIO_POLL_INTERVAL = 0.25 # seconds between checks of the database queue
+    SOCKETIO_MESSAGE_TTL = 60 # seconds relayed events are kept in the database queue
+
+    # Seconds between checks for settings changed by another process (see app/settings.py)
+    SETTINGS_CHECK_INTERVAL = 5
+
+    # Background jobs (see app/jobs/runner.py)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+    JOB_POLL_INTERVAL = 2 # seconds between queue checks when idle
+    JOB_MAX_ATTEMPTS = 3
+    JOB_RETRY_DELAY = 30 # seconds before the first retry, doubled for each further attempt
+    JOB_LEASE_TIMEOUT = 600 # seconds a running job may go without reporting progress before it is requeued
+    JOBS_RUN_INLINE = False
+
+    # Patient search (see app/search.py)
+    SEARCH_PAGE_SIZE = 20
+    SEARCH_MAX_RESULTS = 100 # hard cap across all pages
+    STAFF_INDEX_MAX_AGE = 300 # seconds before the in-memory staff ID index is rebuilt from the database
+
+    # Rendered PDF reports (see app/report_cache.py); defaults to <instance>/report_cache
+    REPORT_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR')
+    REPORT_CACHE_MAX_BYTES = int(os.environ.get('REPORT_CACHE_MAX_BYTES', str(500 * 1024 * 1024)))
+    # Processes used to render a cohort of reports; None means one per CPU core
+    REPORT_BATCH_WORKERS = int(os.environ['REPORT_BATCH_WORKERS']) if os.environ.get('REPORT_BATCH_WORKERS') else None
+    # Render in the calling process instead of a pool; rendering then blocks that process's event loop
+    REPORT_BATCH_INLINE = False
+    # Bulk report emails are spread out to stay under this many messages per minute; 0 is unlimited
+    REPORT_EMAIL_RATE_LIMIT = int(os.environ.get('REPORT_EMAIL_RATE_LIMIT', '30'))
 
     @staticmethod
     def init_app(app):
@@ -24,6 +78,12 @@ class TestingConfig(Config):
     WTF_CSRF_ENABLED = False # Disable CSRF forms protection in tests
     MAIL_SUPPRESS_SEND = True
     MAIL_DEFAULT_SENDER = 'noreply@example.com'
+    JOBS_RUN_INLINE = True # Run background jobs synchronously in tests
+    MAIL_DISPATCH_INLINE = True # Send queued emails synchronously in tests
+    AUDIT_WRITE_INLINE = True # Write audit events as they happen in tests
+    REPORT_CACHE_MAX_BYTES = 0 # Disable the report cache in tests
+    REPORT_BATCH_INLINE = True # Render batches in-process; the in-memory DB is not shared with child processes
+    REPORT_BATCH_WORKERS = 1
 
 config = {
     'development': DevelopmentConfig,
@@ -0,0 +1,49 @@
+"""Add FTS5 full-text index over patient names and IDs
+
+Revision ID: 9a2c4e71f0b8
+Revises: 5e0a7c13d9f4
+Create Date: 2026-10-17 18:31:09.550274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a2c4e71f0b8'
+down_revision = '5e0a7c13d9f4'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'staff_id, patient_id, first_name, middle_name, last_name, department'
+NEW = 'new.id, new.staff_id, new.patient_id, new.first_name, new.middle_name, new.last_name, new.department'
+OLD = "'delete', old.id, old.staff_id, old.patient_id, old.first_name, old.middle_name, old.last_name, old.department"
+
+
+def upgrade():
+    # The full-text index is SQLite-only; other databases fall back to LIKE (see app/search.py)
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS patient_fts USING fts5(
+        {COLUMNS}, content='patient', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+    op.execute(f"""CREATE TRIGGER IF NOT EXISTS patient_fts_insert AFTER INSERT ON patient BEGIN
+        INSERT INTO patient_fts(rowid, {COLUMNS}) VALUES ({NEW});
+    END""")
+    op.execute(f"""CREATE TRIGGER IF NOT EXISTS patient_fts_delete AFTER DELETE ON patient BEGIN
+        INSERT INTO patient_fts(patient_fts, rowid, {COLUMNS}) VALUES ({OLD});
+    END""")
+    op.execute(f"""CREATE TRIGGER IF NOT EXISTS patient_fts_update AFTER UPDATE ON patient BEGIN
+        INSERT INTO patient_fts(patient_fts, rowid, {COLUMNS}) VALUES ({OLD});
+        INSERT INTO patient_fts(rowid, {COLUMNS}) VALUES ({NEW});
+    END""")
+    op.execute("INSERT INTO patient_fts(patient_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('DROP TRIGGER IF EXISTS patient_fts_update')
+    op.execute('DROP TRIGGER IF EXISTS patient_fts_delete')
+    op.execute('DROP TRIGGER IF EXISTS patient_fts_insert')
+    op.execute('DROP TABLE IF EXISTS patient_fts')
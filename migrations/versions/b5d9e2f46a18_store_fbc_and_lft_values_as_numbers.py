@@ -0,0 +1,93 @@
+"""Store full blood count and liver function analytes as numbers
+
+Revision ID: b5d9e2f46a18
+Revises: f2c6a83d1e57
+Create Date: 2026-10-17 23:12:40.871293
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d9e2f46a18'
+down_revision = 'f2c6a83d1e57'
+branch_labels = None
+depends_on = None
+
+ANALYTES = {
+    'full_blood_count': ['hct', 'wbc', 'plt', 'lymp_percent', 'lymp', 'gra_percent', 'gra', 'mid_percent', 'mid',
+                         'rbc', 'mcv', 'mch', 'mchc', 'rdw', 'pdw', 'hgb'],
+    'liver_function_test': ['ast', 'alt', 'alp', 'tb', 'cb'],
+}
+INDEXED = {
+    'full_blood_count': ['hgb', 'wbc', 'plt'],
+    'liver_function_test': ['ast', 'alt', 'alp'],
+}
+
+
+def _is_number(column):
+    """SQL that is true when a text column holds a plain decimal number (see parse_lab_value in app/models.py)."""
+    value = f'trim({column})'
+    if op.get_bind().dialect.name == 'sqlite':
+        return f"({value} GLOB '*[0-9]*' AND {value} NOT GLOB '*[^0-9.]*' AND {value} NOT GLOB '*.*.*')"
+    return f"({value} ~ '^([0-9]+\\.?[0-9]*|\\.[0-9]+)$')"
+
+
+def _reads_back(column):
+    """
+    SQL that is true when a text column holds a number in the form
+    format_lab_value writes it back (e.g. '5', '12.5', not '05' or '12.50'),
+    so its text need not be kept.
+    """
+    value = f'trim({column})'
+    if op.get_bind().dialect.name == 'sqlite':
+        integer = f"({value} = '0' OR ({value} GLOB '[1-9]*' AND {value} NOT GLOB '*[^0-9]*'))"
+        decimal = (f"(({value} GLOB '[1-9]*.*[1-9]' OR ({value} GLOB '0.*[1-9]' AND {value} NOT GLOB '0.0000*')) "
+                   f"AND {_is_number(column)})")
+        return f'({integer} OR {decimal})'
+    return f"({value} ~ '^(0|[1-9][0-9]*)(\\.[0-9]*[1-9])?$' AND {value} !~ '^0\\.0000')"
+
+
+def upgrade():
+    for table, analytes in ANALYTES.items():
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for name in analytes:
+                batch_op.add_column(sa.Column(f'{name}_text', sa.String(length=50), nullable=True))
+
+        # One pass per table: keep entries as text unless the number reads back the same, and blank the
+        # number column for entries that are not numbers
+        op.execute(f"UPDATE {table} SET " + ', '.join(
+            f"{name}_text = CASE WHEN {name} IS NOT NULL AND trim({name}) != '' AND NOT {_reads_back(name)} "
+            f"THEN trim({name}) END" for name in analytes))
+        op.execute(f"UPDATE {table} SET " + ', '.join(
+            f"{name} = CASE WHEN {_is_number(name)} THEN trim({name}) END" for name in analytes))
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for name in analytes:
+                batch_op.alter_column(name, existing_type=sa.String(length=50), type_=sa.Float(),
+                                      existing_nullable=True, postgresql_using=f'{name}::double precision')
+            for name in INDEXED[table]:
+                batch_op.create_index(f'ix_{table}_{name}', [name, 'patient_id'], unique=False)
+
+
+def downgrade():
+    for table, analytes in ANALYTES.items():
+        # Every entry back to text, whole numbers without a trailing '.0'
+        op.execute(f"UPDATE {table} SET " + ', '.join(
+            f"{name}_text = COALESCE({name}_text, CASE WHEN {name} = CAST({name} AS INTEGER) "
+            f"THEN CAST(CAST({name} AS INTEGER) AS VARCHAR(50)) ELSE CAST({name} AS VARCHAR(50)) END)"
+            for name in analytes))
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for name in INDEXED[table]:
+                batch_op.drop_index(f'ix_{table}_{name}')
+            for name in analytes:
+                batch_op.alter_column(name, existing_type=sa.Float(), type_=sa.String(length=50),
+                                      existing_nullable=True, postgresql_using=f'{name}::varchar(50)')
+
+        op.execute(f"UPDATE {table} SET " + ', '.join(f"{name} = {name}_text" for name in analytes))
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            for name in analytes:
+                batch_op.drop_column(f'{name}_text')
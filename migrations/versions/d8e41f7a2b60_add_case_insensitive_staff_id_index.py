@@ -0,0 +1,25 @@
+"""Add an upper-cased staff ID index for case-insensitive search
+
+Revision ID: d8e41f7a2b60
+Revises: c2a7d4e9f135
+Create Date: 2026-10-18 10:02:51.640217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8e41f7a2b60'
+down_revision = 'c2a7d4e9f135'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_patient_company_year_staff_id_upper', 'patient',
+                    ['company', 'screening_year', sa.text('upper(staff_id)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_patient_company_year_staff_id_upper', table_name='patient')
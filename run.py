@@ -63,9 +63,87 @@ def init_permissions():
     if admin_role:
         all_perms = Permission.query.all()
         admin_role.permissions = all_perms
+        admin_role.permissions_changed()
 
     db.session.commit()
     print('Permissions have been initialized and assigned to Admin role.')
 
+@app.cli.command("render-reports")
+@click.option('--company', required=True, help='Company code, e.g. DCP or DCT.')
+@click.option('--year', required=True, type=int, help='Screening year.')
+@click.option('--output', default=None, help='ZIP file to write (default: reports_<company>_<year>.zip).')
+@click.option('--workers', default=None, type=int, help='Rendering processes (default: one per CPU core).')
+def render_reports(company, year, output, workers):
+    """Renders every report for a company/year cohort into a ZIP file."""
+    from app.report_batch import render_cohort_zip
+
+    def show_progress(done, total, stats):
+        print(f"\r{done}/{total} reports, {stats['pages_per_second']} pages/s", end='', flush=True)
+
+    output = output or f'reports_{company}_{year}.zip'
+    stats = render_cohort_zip(company, year, output, workers=workers, progress=show_progress)
+    print()
+    print(f"Rendered {stats['rendered']} of {stats['total']} reports ({stats['pages']} pages) "
+          f"in {stats['elapsed_seconds']}s using {stats['workers']} workers: {stats['pages_per_second']} pages/s.")
+    for failure in stats['failed']:
+        print(f"  Patient {failure['patient_id']} failed: {failure['error']}")
+    print(f'Written to {output}')
+
+@app.cli.command("archive-audit-log")
+@click.option('--older-than-days', default=None, type=int, help='Age of the events to archive (default: AUDIT_RETENTION_DAYS).')
+def archive_audit_log(older_than_days):
+    """Moves old audit events into compressed monthly archive files. Suitable for a daily cron job."""
+    from app.audit_archive import archive_audit_logs, archive_dir
+
+    run = archive_audit_logs(older_than_days, progress=lambda done: print(f'\r{done} events archived', end='', flush=True))
+    print()
+    print(f"Archived {run['archived']} events older than {run['cutoff']} to {archive_dir()}.")
+    print(f"Live audit table: {run['live_rows_before']} rows before, {run['live_rows_after']} rows after. "
+          f"Archive size: {run['archive_bytes']} bytes.")
+
+@app.cli.command("rebuild-registration-stats")
+@click.option('--company', default=None, help='Company code (default: every company).')
+@click.option('--year', default=None, type=int, help='Screening year (default: every year).')
+def rebuild_registration_stats(company, year):
+    """Recomputes the registration dashboard counts from the patient table."""
+    from app import registration_stats
+    from app.models import Patient, RegistrationCount
+
+    cohorts = set()
+    for model in (Patient, RegistrationCount):
+        query = db.session.query(model.company, model.screening_year).distinct()
+        if company:
+            query = query.filter(model.company == company)
+        if year is not None:
+            query = query.filter(model.screening_year == year)
+        cohorts.update(query)
+
+    for cohort_company, cohort_year in sorted(cohorts):
+        registration_stats.rebuild(cohort_company, cohort_year)
+        db.session.commit()
+        print(f'Rebuilt registration counts for {cohort_company} {cohort_year}.')
+
+@app.cli.command("benchmark-patient-indexes")
+@click.option('--rows', default=200000, type=int, help='Synthetic patients to generate (default: 200000).')
+@click.option('--repeat', default=5, type=int, help='Runs of each query; the fastest is reported.')
+def benchmark_patient_indexes(rows, repeat):
+    """Shows query plans and timings of the patient access paths with and without their indexes."""
+    from app.patient_index_benchmark import run_benchmark
+
+    result = run_benchmark(rows, repeat, progress=lambda done: print(f'\r{done} rows generated', end='', flush=True))
+    print()
+    print(f"{result['rows']} rows; building the access path indexes took {result['index_build_ms']} ms.")
+    for path in result['paths']:
+        print()
+        if path['already_indexed']:
+            print(f"{path['name']} ({path['route']}): already indexed, {path['after']['ms']} ms")
+            for step in path['after']['plan']:
+                print(f'  {step}')
+            continue
+        print(f"{path['name']} ({path['route']}): {path['before']['ms']} ms -> {path['after']['ms']} ms")
+        for label in ('before', 'after'):
+            for step in path[label]['plan']:
+                print(f'  {label:<6} {step}')
+
 if __name__ == '__main__':
     socketio.run(app, debug=True)
@@ -64,3 +64,145 @@ def test_phone_number_validator(app):
                 assert False, f"Validation succeeded for an invalid number: {number}"
             except Exception:
                 assert True
+
+def test_import_patients_bulk(app):
+    import pandas as pd
+    from app import db
+    from app.models import Patient
+    from app.importer import import_patients
+
+    db.session.add(Patient(
+        staff_id='IMP1', patient_id='HOS-IMP1', first_name='Existing', last_name='Patient',
+        department='Admin', gender='Male', date_of_birth=date(1980, 1, 1), age=44,
+        contact_phone='555', race='African', nationality='Nigerian', company='DCP', screening_year=2030
+    ))
+    db.session.commit()
+
+    base = dict(last_name='Doe', department='Admin', gender='Female', contact_phone='555',
+                email_address=None, race='African', nationality='Nigerian')
+    df = pd.DataFrame([
+        dict(base, staff_id='IMP1', patient_id='HOS-A', first_name='Dup', date_of_birth='1990-01-01'),
+        dict(base, staff_id='IMP2', patient_id='HOS-B', first_name='Ok', date_of_birth='1990-01-01'),
+        dict(base, staff_id='IMP3', patient_id='HOS-C', first_name=None, date_of_birth='1990-01-01'),
+        dict(base, staff_id='IMP2', patient_id='HOS-D', first_name='Again', date_of_birth='1990-01-01'),
+        dict(base, staff_id='IMP4', patient_id='HOS-E', first_name='Bad', date_of_birth='not a date'),
+    ])
+
+    result = import_patients(df, company='DCP', year=2030)
+
+    assert result.inserted == 1
+    assert result.rejected == [
+        (2, 'staff_id already registered for this company/year'),
+        (4, 'missing first_name'),
+        (5, 'duplicate staff_id in file'),
+        (6, 'invalid date_of_birth'),
+    ]
+    imported = Patient.query.filter_by(staff_id='IMP2', screening_year=2030).one()
+    assert imported.age == calculate_age(date(1990, 1, 1))
+    assert imported.company == 'DCP'
+
+def test_stream_import_patients_csv_and_xlsx(app):
+    import io
+    from openpyxl import Workbook
+    from app.models import Patient
+    from app.importer import stream_import_patients
+
+    header = ['staff_id', 'patient_id', 'first_name', 'middle_name', 'last_name', 'department', 'gender',
+              'date_of_birth', 'contact_phone', 'email_address', 'race', 'nationality']
+    rows = [
+        ['CSV1', 'HOS-CSV1', 'Ada', '', 'Obi', 'Admin', 'Female', '1985-03-04', '555', '', 'African', 'Nigerian'],
+        ['', '', '', '', '', '', '', '', '', '', '', ''],
+        ['CSV2', 'HOS-CSV2', '', '', 'Obi', 'Admin', 'Male', '1985-03-04', '555', '', 'African', 'Nigerian'],
+        ['CSV3', 'HOS-CSV3', 'Ben', '', 'Obi', 'Admin', 'Male', '1979-12-31', '555', '', 'African', 'Nigerian'],
+        ['CSV1', 'HOS-CSV4', 'Dup', '', 'Obi', 'Admin', 'Male', '1979-12-31', '555', '', 'African', 'Nigerian'],
+    ]
+    csv_data = '\n'.join(','.join(r) for r in [header] + rows).encode('utf-8')
+
+    result = stream_import_patients(io.BytesIO(csv_data), 'roster.csv', company='DCT', year=2031, chunk_size=2)
+    assert result.inserted == 2
+    assert result.rejected == [(4, 'missing first_name'), (6, 'staff_id already registered for this company/year')]
+    assert Patient.query.filter_by(company='DCT', screening_year=2031).count() == 2
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(header)
+    sheet.append([4001, 'HOS-X1', 'Xlsx', None, 'Row', 'Admin', 'Male', date(1990, 6, 1), 555, None, 'African', 'Nigerian'])
+    sheet.append(['CSV3', 'HOS-X2', 'Again', None, 'Row', 'Admin', 'Male', date(1990, 6, 1), 555, None, 'African', 'Nigerian'])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+
+    result = stream_import_patients(buffer, 'roster.xlsx', company='DCT', year=2031)
+    assert result.inserted == 1
+    assert result.rejected == [(3, 'staff_id already registered for this company/year')]
+    imported = Patient.query.filter_by(staff_id='4001', screening_year=2031).one()
+    assert imported.contact_phone == '555'
+    assert imported.date_of_birth == date(1990, 6, 1)
+
+def test_roster_import_job_reads_a_spooled_upload(app, tmp_path):
+    import io
+    import json
+    import os
+    from app.models import Patient, Job
+    from app.importer import enqueue_roster_import
+
+    csv_data = ('staff_id,patient_id,first_name,middle_name,last_name,department,gender,date_of_birth,'
+                'contact_phone,email_address,race,nationality\n'
+                'JOB1,HOS-JOB1,Ada,,Obi,Admin,Female,1985-03-04,555,,African,Nigerian\n').encode('utf-8')
+    app.instance_path = str(tmp_path)
+    with app.test_request_context():
+        job = enqueue_roster_import(io.BytesIO(csv_data), 'roster.csv', company='DCT', year=2032)
+    job = Job.query.get(job.id)
+    assert job.status == 'succeeded' and job.max_attempts == 1
+    assert json.loads(job.result)['inserted'] == 1
+    assert os.listdir(tmp_path / 'uploads') == []
+    assert Patient.query.filter_by(staff_id='JOB1', screening_year=2032).count() == 1
+
+def test_report_cache_hits_and_invalidation(app, tmp_path, monkeypatch):
+    from app import db
+    from app.models import Patient, ECG
+    from app import utils
+    from app.report_cache import invalidate_patient_reports
+
+    monkeypatch.setitem(app.config, 'REPORT_CACHE_DIR', str(tmp_path))
+    monkeypatch.setitem(app.config, 'REPORT_CACHE_MAX_BYTES', 10 * 1024)
+    renders = []
+    monkeypatch.setattr(utils, 'render_patient_pdf', lambda p: renders.append(p.id) or (b'%PDF' + bytes(4000), 2))
+
+    patient = Patient(
+        staff_id='RC1', patient_id='HOS-RC1', first_name='Cache', last_name='Test',
+        department='Admin', gender='Male', date_of_birth=date(1980, 1, 1), age=44,
+        contact_phone='555', race='African', nationality='Nigerian', company='DCP', screening_year=2032
+    )
+    db.session.add(patient)
+    db.session.commit()
+
+    with app.test_request_context():
+        first = utils.generate_patient_pdf_bytes(patient)
+        assert utils.generate_patient_report(patient) == (first, 2) # A hit keeps the page count
+        assert len(renders) == 1
+
+        # New results change the fingerprint, so the report is rendered again
+        patient.ecg = ECG(ecg_result='Normal')
+        db.session.commit()
+        utils.generate_patient_pdf_bytes(patient)
+        assert len(renders) == 2
+        assert len(list(tmp_path.glob(f'{patient.id}-*.pdf'))) == 1
+
+        invalidate_patient_reports(patient.id)
+        assert list(tmp_path.glob('*.pdf')) == []
+
+        # Entries beyond the size limit are evicted, oldest first
+        others = []
+        for i in range(3):
+            other = Patient(
+                staff_id=f'RC{i + 2}', patient_id=f'HOS-RC{i + 2}', first_name='Cache', last_name='Test',
+                department='Admin', gender='Male', date_of_birth=date(1980, 1, 1), age=44,
+                contact_phone='555', race='African', nationality='Nigerian', company='DCP', screening_year=2032
+            )
+            db.session.add(other)
+            db.session.commit()
+            others.append(other)
+            utils.generate_patient_pdf_bytes(other)
+        assert len(list(tmp_path.glob('*.pdf'))) == 2
+        assert not list(tmp_path.glob(f'{others[0].id}-*.pdf'))
@@ -266,7 +266,19 @@ def test_director_and_reports_flow(client, app):
     # 5. Verify report emailing
     response = client.get(f'/reports/email/{patient_id}', follow_redirects=True)
     assert response.status_code == 200
-    assert b'Report has been successfully emailed' in response.data
+    assert b'will be emailed to testpatient@example.com' in response.data
+
+    # The email is sent by a background job (run inline in tests)
+    with app.app_context():
+        from app.models import Job
+        job = Job.query.filter_by(kind='email_report').order_by(Job.id.desc()).first()
+        assert job.status == 'succeeded'
+        job_id = job.id
+
+    response = client.get(f'/jobs/{job_id}')
+    assert response.status_code == 200
+    assert response.json['status'] == 'succeeded'
+    assert response.json['result']['to'] == 'testpatient@example.com'
 
 def test_2fa_flow(client, app):
     # 1. Setup a user
@@ -330,3 +342,1030 @@ def test_2fa_flow(client, app):
 
     response = client.post('/account/verify_recovery', data={'recovery_code': 'invalidcode'}, follow_redirects=True)
     assert b'Invalid or already used recovery code' in response.data
+
+def test_job_queue_retries_then_fails(app):
+    from app.models import Job
+    from app.jobs.runner import job_queue
+
+    calls = []
+
+    @job_queue.handler('test_flaky')
+    def flaky(ctx, payload):
+        calls.append(ctx.job.attempts)
+        ctx.progress(1, 2, 'halfway')
+        raise RuntimeError('boom')
+
+    with app.test_request_context():
+        job = job_queue.enqueue('test_flaky', {'x': 1}, max_attempts=2)
+        assert job.status == 'queued'  # scheduled for a retry
+        assert job.attempts == 1
+        assert job.error == 'boom'
+
+        # Make the retry due and let a worker pick it up
+        job.run_after = datetime(2000, 1, 1)
+        db.session.commit()
+        claimed = job_queue.claim_next()
+        assert claimed == job.id
+        job_queue.run(app, claimed)
+
+        db.session.refresh(job)
+        assert job.status == 'failed'
+        assert job.attempts == 2
+        assert calls == [1, 2]
+        assert job_queue.claim_next() is None
+
+def test_batch_report_zip(client, app):
+    import io
+    import zipfile
+
+    # Reuses the reviewer and the DCP 2024 patient from test_director_and_reports_flow
+    client.post('/auth/login', data={'phone_number': 'reviewer123', 'password': 'password'})
+    response = client.post('/reports/batch', data={'company': 'DCP', 'year': '2024'}, follow_redirects=True)
+    assert response.status_code == 200
+    assert b'Generating all DCP 2024 reports' in response.data
+
+    with app.app_context():
+        from app.models import Job
+        job = Job.query.filter_by(kind='report_batch').order_by(Job.id.desc()).first()
+        assert job.status == 'succeeded'
+        job_id = job.id
+
+    status = client.get(f'/jobs/{job_id}').json
+    assert status['result']['rendered'] == 1
+    assert status['result']['pages'] > 0
+    assert status['result']['pages_per_second'] > 0
+
+    response = client.get(f'/reports/batch/{job_id}/download')
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.namelist() == ['report_S123_2024.pdf']
+    client.get('/auth/logout')
+
+def test_report_url_fetcher_reads_static_files_locally(app):
+    import pytest
+    from app.report_assets import local_url_fetcher, REPORT_BASE_URL
+
+    with app.app_context():
+        fetched = local_url_fetcher(REPORT_BASE_URL + 'static/css/report.css')
+        assert fetched['mime_type'] == 'text/css'
+        assert fetched['string']
+
+        with pytest.raises(ValueError):
+            local_url_fetcher('https://example.com/logo.png')
+        with pytest.raises(ValueError):
+            local_url_fetcher(REPORT_BASE_URL + 'static/../config.py')
+
+def test_mail_dispatcher_reuses_one_smtp_connection(app, monkeypatch):
+    import socket
+    from aiosmtpd.controller import Controller
+    from flask_mail import Message
+    from app.mailer import mail_dispatcher
+
+    class RecordingHandler:
+        def __init__(self):
+            self.sessions = []
+            self.recipients = []
+
+        async def handle_DATA(self, server, session, envelope):
+            if session not in self.sessions:
+                self.sessions.append(session)
+            self.recipients.extend(envelope.rcpt_tos)
+            return '250 OK'
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        monkeypatch.setitem(app.config, 'MAIL_SUPPRESS_SEND', False)
+        monkeypatch.setitem(app.config, 'MAIL_SERVER', '127.0.0.1')
+        monkeypatch.setitem(app.config, 'MAIL_PORT', port)
+        monkeypatch.setitem(app.config, 'MAIL_USE_TLS', False)
+        monkeypatch.setitem(app.config, 'MAIL_USERNAME', None)
+        # Queue without sending so that all three go out in one batch
+        monkeypatch.setitem(app.config, 'MAIL_DISPATCH_INLINE', False)
+
+        with app.test_request_context():
+            emails = [mail_dispatcher.queue(Message(f'Report {i}', recipients=[f'patient{i}@example.com'],
+                                                    body='Attached.', sender='noreply@example.com'))
+                      for i in range(3)]
+            db.session.commit()
+            mail_dispatcher.deliver_pending(app)
+            for email in emails:
+                db.session.refresh(email)
+                assert email.status == 'sent'
+    finally:
+        controller.stop()
+
+    assert sorted(handler.recipients) == ['patient0@example.com', 'patient1@example.com', 'patient2@example.com']
+    assert len(handler.sessions) == 1
+
+def test_mail_dispatcher_retries_with_backoff(app, monkeypatch):
+    import socket
+    from flask_mail import Message
+    from app.mailer import mail_dispatcher
+
+    # A port with nothing listening on it
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    monkeypatch.setitem(app.config, 'MAIL_SUPPRESS_SEND', False)
+    monkeypatch.setitem(app.config, 'MAIL_SERVER', '127.0.0.1')
+    monkeypatch.setitem(app.config, 'MAIL_PORT', port)
+    monkeypatch.setitem(app.config, 'MAIL_USE_TLS', False)
+
+    with app.test_request_context():
+        email = mail_dispatcher.queue(Message('Report', recipients=['patient@example.com'],
+                                              body='Attached.', sender='noreply@example.com'))
+        assert email.attempts == 0
+        db.session.commit() # Sends inline
+        db.session.refresh(email)
+        assert email.status == 'queued'
+        assert email.attempts == 1
+        assert email.error
+        assert email.run_after > email.created_at
+
+def test_mail_queue_leaves_the_commit_to_the_caller(app):
+    from flask_mail import Message
+    from app.mailer import mail_dispatcher
+    from app.models import OutgoingEmail, Setting
+
+    with app.test_request_context():
+        db.session.add(Setting(key='mail_queue_probe', value='1'))
+        mail_dispatcher.queue(Message('Rolled back', recipients=['nobody@example.com'],
+                                      body='-', sender='noreply@example.com'))
+        db.session.rollback()
+        assert Setting.query.filter_by(key='mail_queue_probe').count() == 0
+        assert OutgoingEmail.query.filter_by(subject='Rolled back').count() == 0
+
+        email = mail_dispatcher.queue(Message('Committed', recipients=['somebody@example.com'],
+                                              body='-', sender='noreply@example.com'))
+        db.session.commit()
+        db.session.refresh(email)
+        assert email.status == 'sent'
+
+def test_workers_only_take_back_lapsed_leases(app):
+    from datetime import UTC
+    from app.jobs.runner import job_queue
+    from app.mailer import mail_dispatcher, RateLimiter
+    from app.models import Job, OutgoingEmail
+
+    now = datetime.now(UTC)
+    stale = now - timedelta(seconds=max(app.config['JOB_LEASE_TIMEOUT'], app.config['MAIL_LEASE_TIMEOUT']) + 60)
+    with app.app_context():
+        # A sibling process is still working on the fresh rows; the stale ones belong to a stopped one
+        jobs = [Job(kind='lease_test', status='running', claimed_by='web-2:41', heartbeat_at=at) for at in (now, stale)]
+        emails = [OutgoingEmail(sender='noreply@example.com', recipients='lease@example.com', message=b'',
+                                status='sending', claimed_by='web-2:41', heartbeat_at=at) for at in (now, stale)]
+        db.session.add_all(jobs + emails)
+        db.session.commit()
+
+        job_queue.recover()
+        mail_dispatcher.recover()
+        assert [db.session.get(Job, job.id).status for job in jobs] == ['running', 'queued']
+        assert [db.session.get(OutgoingEmail, email.id).status for email in emails] == ['sending', 'queued']
+
+        # Send slots are shared through the database, so two processes' limiters never overlap
+        first, second = RateLimiter().reserve(60), RateLimiter().reserve(60)
+        assert second >= first + 1.0
+
+def test_lapsed_job_without_attempts_left_is_not_run_again(app):
+    from datetime import UTC
+    from app.jobs.runner import job_queue
+    from app.models import Job
+
+    calls = []
+
+    @job_queue.handler('test_run_once')
+    def run_once(ctx, payload):
+        calls.append(ctx.job.attempts)
+
+    stale = datetime.now(UTC) - timedelta(seconds=app.config['JOB_LEASE_TIMEOUT'] + 60)
+    with app.test_request_context():
+        # Its worker stopped part-way through its only attempt
+        job = Job(kind='test_run_once', status='running', attempts=1, max_attempts=1,
+                  claimed_by='web-2:41', heartbeat_at=stale)
+        db.session.add(job)
+        db.session.commit()
+
+        job_queue.recover()
+        db.session.refresh(job)
+        assert job.status == 'failed' and job.error.startswith('Interrupted')
+        assert job.attempts == 1
+
+        # Even put back in the queue by hand, it cannot be claimed again
+        job.status = 'queued'
+        db.session.commit()
+        assert not job_queue.claim(job.id)
+        assert job_queue.claim_next() != job.id
+        assert calls == []
+
+def test_bulk_email_reports(client, app):
+    # Reuses the reviewer and the reviewed DCP 2024 patient from test_director_and_reports_flow
+    client.post('/auth/login', data={'phone_number': 'reviewer123', 'password': 'password'})
+    response = client.post('/reports/email-batch', data={'company': 'DCP', 'year': '2024', 'reviewed_only': '1'},
+                           follow_redirects=True)
+    assert response.status_code == 200
+    assert b'Emailing all DCP 2024 reports' in response.data
+    assert b'testpatient@example.com' in response.data
+
+    with app.app_context():
+        from app.models import Job, OutgoingEmail
+        job = Job.query.filter_by(kind='report_email_batch').order_by(Job.id.desc()).first()
+        assert job.status == 'succeeded'
+        emails = OutgoingEmail.query.filter_by(job_id=job.id).all()
+        assert [e.recipients for e in emails] == ['testpatient@example.com']
+        assert emails[0].status == 'sent'
+
+        # Running the job again, as after an interrupted run, emails nobody twice
+        from app.jobs.runner import job_queue
+        job.status, job.attempts = 'queued', 0
+        db.session.commit()
+        assert job_queue.claim(job.id)
+        job_queue.run(app, job.id)
+        db.session.refresh(job)
+        assert job.status == 'succeeded'
+        assert OutgoingEmail.query.filter_by(job_id=job.id).count() == 1
+
+    response = client.post('/reports/email-batch', data={'company': 'DCT', 'year': '2024'}, follow_redirects=True)
+    assert b'No emails have been queued yet.' in response.data
+    client.get('/auth/logout')
+
+def test_email_batch_status_pages_without_loading_messages(client, app, monkeypatch):
+    import json
+    import app.reports.routes as report_routes
+    from app.models import Job, OutgoingEmail
+
+    with app.app_context():
+        job = Job(kind='report_email_batch', status='succeeded', payload=json.dumps({'company': 'DCT', 'year': 2021}))
+        db.session.add(job)
+        db.session.flush()
+        for n in range(3):
+            db.session.add(OutgoingEmail(sender='noreply@example.com', recipients=f'page{n}@example.com',
+                                         message=b'', status='sent' if n else 'failed', job_id=job.id))
+        db.session.commit()
+        job_id = job.id
+
+    monkeypatch.setattr(report_routes, 'EMAIL_STATUS_PAGE_SIZE', 2)
+    client.post('/auth/login', data={'phone_number': 'reviewer123', 'password': 'password'})
+    first = client.get(f'/reports/email-batch/{job_id}').get_data(as_text=True)
+    assert 'page0@example.com' in first and 'page1@example.com' in first
+    assert 'page2@example.com' not in first
+    assert 'Previous' not in first
+
+    with app.app_context():
+        second_id = OutgoingEmail.query.filter_by(job_id=job_id).order_by(OutgoingEmail.id).all()[1].id
+    second = client.get(f'/reports/email-batch/{job_id}?after={second_id}').get_data(as_text=True)
+    assert 'page2@example.com' in second and 'page0@example.com' not in second
+    assert 'Previous' in second and 'Next' not in second
+    back = client.get(f'/reports/email-batch/{job_id}?before={second_id + 1}').get_data(as_text=True)
+    assert 'page0@example.com' in back and 'page1@example.com' in back
+    client.get('/auth/logout')
+
+def test_patient_search_is_scoped_ranked_and_capped(app, monkeypatch):
+    from app.search import search_patients
+
+    with app.app_context():
+        def add(staff_id, year):
+            db.session.add(Patient(
+                staff_id=staff_id, patient_id=f'HOS-{staff_id}-{year}', first_name='Search',
+                last_name='Patient', department='HR', gender='Male',
+                date_of_birth=date(1985, 1, 1), age=40, contact_phone='555-0000',
+                race='African', nationality='Nigerian', company='DCT', screening_year=year
+            ))
+        for n in range(12):
+            add(f'Q7{n}', 2023)
+        add('Q7', 2023)
+        add('Q70', 2022)
+        add('XQ7', 2023)
+        db.session.commit()
+
+        # Prefix match only, exact match first, other years excluded
+        first = search_patients('q7', 'DCT', 2023, per_page=5)
+        assert [p.staff_id for p in first] == ['Q7', 'Q70', 'Q71', 'Q710', 'Q711']
+        assert first.has_next
+
+        monkeypatch.setitem(app.config, 'SEARCH_MAX_RESULTS', 8)
+        second = search_patients('Q7', 'DCT', 2023, page=2, per_page=5)
+        assert len(second) == 3
+        assert not second.has_next
+        assert len(search_patients('Q7', 'DCT', 2023, page=3, per_page=5)) == 0
+        assert len(search_patients('', 'DCT', 2023)) == 0
+
+def test_staff_id_search_ignores_case_through_one_index(app):
+    from sqlalchemy import event
+    from app.search import search_patients
+
+    with app.app_context():
+        for staff_id in ['Mx10', 'MX11', 'mX12', 'MY10']:
+            db.session.add(Patient(
+                staff_id=staff_id, patient_id=f'HOS-{staff_id}', first_name='Case', last_name='Patient',
+                department='HR', gender='Male', date_of_birth=date(1985, 1, 1), age=40,
+                contact_phone='555-0000', race='African', nationality='Nigerian', company='DCT', screening_year=2020
+            ))
+        db.session.commit()
+
+        statements = []
+        listener = lambda *args: statements.append((args[2], args[3]))
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            results = search_patients('mx1', 'DCT', 2020)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert [p.staff_id for p in results] == ['Mx10', 'MX11', 'mX12']
+        assert [p.staff_id for p in search_patients('mx11', 'DCT', 2020)] == ['MX11']
+
+        sql, params = statements[0]
+        plan = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, params).all()
+        assert any('ix_patient_company_year_staff_id_upper' in row[-1] for row in plan)
+
+def test_results_search_continues_past_the_first_page(client, app, monkeypatch):
+    import re
+    from app.search import search_patients
+
+    with app.app_context():
+        user = User(first_name='more', last_name='results', phone_number='more123', password='password')
+        db.session.add(user)
+        for n in range(12):
+            db.session.add(Patient(
+                staff_id=f'MR{n:02d}', patient_id=f'HOS-MR{n:02d}', first_name='More', last_name='Results',
+                department='HR', gender='Male', date_of_birth=date(1985, 1, 1), age=40,
+                contact_phone='555-0000', race='African', nationality='Nigerian', company='DCT', screening_year=2013
+            ))
+        db.session.commit()
+
+        # Following the cursor is not limited by SEARCH_MAX_RESULTS, which bounds page numbers only
+        monkeypatch.setitem(app.config, 'SEARCH_MAX_RESULTS', 5)
+        first = search_patients('mr', 'DCT', 2013, per_page=5)
+        second = search_patients('mr', 'DCT', 2013, per_page=5, after=first.next_cursor)
+        assert [p.staff_id for p in second] == ['MR05', 'MR06', 'MR07', 'MR08', 'MR09']
+        assert second.has_next
+        assert len(search_patients('mr', 'DCT', 2013, after=999999)) == 0
+
+    monkeypatch.setitem(app.config, 'SEARCH_PAGE_SIZE', 10)
+    client.post('/auth/login', data={'phone_number': 'more123', 'password': 'password'})
+    with client.session_transaction() as sess:
+        sess['company'], sess['year'] = 'DCT', 2013
+    page = client.post('/results/ecg', data={'search_term': 'mr'}).get_data(as_text=True)
+    assert 'MR04' in page and 'MR05' not in page
+    more = re.search(r'href="([^"]+)">More results', page).group(1).replace('&amp;', '&')
+    page = client.get(more).get_data(as_text=True)
+    assert 'MR05' in page and 'MR09' in page and 'MR04' not in page and 'More results' in page
+    client.get('/auth/logout')
+
+def test_patient_name_search(app):
+    from app.search import search_patients
+
+    with app.app_context():
+        for staff_id, first, last, year in [('N1', 'Amaka', 'Okafor', 2023), ('N2', 'Amara', 'Obi', 2023),
+                                            ('N3', 'Chidi', 'Okafor', 2023), ('N4', 'Amaka', 'Okafor', 2022)]:
+            db.session.add(Patient(
+                staff_id=staff_id, patient_id=f'HOS-{staff_id}', first_name=first,
+                last_name=last, department='Finance', gender='Female',
+                date_of_birth=date(1990, 1, 1), age=33, contact_phone='555-0000',
+                race='African', nationality='Nigerian', company='DCT', screening_year=year
+            ))
+        db.session.commit()
+
+        assert [p.staff_id for p in search_patients('okafor', 'DCT', 2023, mode='name')] == ['N1', 'N3']
+        assert [p.staff_id for p in search_patients('ama oka', 'DCT', 2023, mode='name')] == ['N1']
+
+        # The index follows updates made through the ORM
+        patient = Patient.query.filter_by(staff_id='N2').first()
+        patient.last_name = 'Okafor'
+        db.session.commit()
+        assert [p.staff_id for p in search_patients('okafor', 'DCT', 2023, mode='name')] == ['N1', 'N2', 'N3']
+        assert len(search_patients('"', 'DCT', 2023, mode='name')) == 0
+
+def test_staff_id_autocomplete_index(app):
+    from sqlalchemy import event
+    from app import staff_index
+    from app.search import autocomplete_staff_ids
+
+    with app.app_context():
+        def make(staff_id):
+            return Patient(
+                staff_id=staff_id, patient_id=f'HOS-{staff_id}', first_name='Auto',
+                last_name='Complete', department='IT', gender='Male',
+                date_of_birth=date(1980, 6, 1), age=45, contact_phone='555-0000',
+                race='African', nationality='Nigerian', company='DCP', screening_year=2021
+            )
+        db.session.add_all([make('AC10'), make('AC1'), make('AC2')])
+        db.session.commit()
+        staff_index.invalidate()
+
+        assert [s['staff_id'] for s in autocomplete_staff_ids('ac1', 'DCP', 2021)] == ['AC1', 'AC10']
+
+        # Once loaded, lookups do not touch the database
+        statements = []
+        listener = lambda *args: statements.append(args)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            assert [s['staff_id'] for s in autocomplete_staff_ids('AC', 'DCP', 2021)] == ['AC1', 'AC10', 'AC2']
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert statements == []
+
+        # Registrations, edits and deletions update the loaded index
+        added = make('AC11')
+        db.session.add(added)
+        db.session.commit()
+        staff_index.patient_saved(added)
+        renamed = Patient.query.filter_by(staff_id='AC2', screening_year=2021).first()
+        renamed.staff_id = 'AC05'
+        db.session.commit()
+        staff_index.patient_saved(renamed)
+        removed = Patient.query.filter_by(staff_id='AC10', screening_year=2021).first()
+        db.session.delete(removed)
+        db.session.commit()
+        staff_index.patient_deleted(removed)
+
+        assert [s['staff_id'] for s in autocomplete_staff_ids('AC', 'DCP', 2021)] == ['AC05', 'AC1', 'AC11']
+        assert staff_index.get_index('DCP', 2021).get('AC10') is None
+
+def test_staff_id_lookup_reads_the_database(client, app):
+    from app import staff_index
+
+    with app.app_context():
+        staff_index.get_index('DCP', 2021)
+        # Written without updating the loaded index, as another worker would
+        db.session.add(Patient(
+            staff_id='AC20', patient_id='HOS-AC20', first_name='Exact', last_name='Lookup', department='IT',
+            gender='Male', date_of_birth=date(1980, 6, 1), age=45, contact_phone='555-0000',
+            race='African', nationality='Nigerian', company='DCP', screening_year=2021
+        ))
+        db.session.commit()
+
+    client.get('/auth/logout')
+    client.post('/auth/login', data={'phone_number': 'admin123', 'password': 'password'})
+    with client.session_transaction() as sess:
+        sess['company'], sess['year'] = 'DCP', 2021
+    response = client.get('/patient/api/search?staff_id=AC20')
+    assert response.status_code == 200
+    assert response.get_json()['first_name'] == 'Exact'
+    assert client.get('/patient/api/search?staff_id=AC99').status_code == 404
+    client.get('/auth/logout')
+
+def test_permission_checks_are_compiled_and_cached(app):
+    from sqlalchemy import event
+
+    with app.app_context():
+        view_perm = Permission(name='perm_cache_view')
+        edit_perm = Permission(name='perm_cache_edit')
+        role = Role(name='Perm Cache Role', permissions=[view_perm])
+        user = User(first_name='Perm', last_name='Cache', phone_number='perm-cache-1', password='password')
+        user.roles.append(role)
+        db.session.add_all([view_perm, edit_perm, role, user])
+        db.session.commit()
+
+        assert user.has_permission('perm_cache_view')
+        statements = []
+        listener = lambda *args: statements.append(args)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            assert user.has_permission('perm_cache_view')
+            assert not user.has_permission('perm_cache_edit')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert statements == []
+
+        # Editing the role bumps its holders' version, so the next check recompiles
+        role.permissions.append(edit_perm)
+        role.permissions_changed()
+        db.session.commit()
+        assert user.has_permission('perm_cache_edit')
+
+def test_settings_are_cached_and_versioned(app, monkeypatch):
+    from sqlalchemy import event
+    from app.models import Setting
+    from app.settings import all_settings, get_setting, save_settings
+
+    with app.app_context():
+        save_settings({'hospital_name': 'Cached Hospital'})
+        db.session.commit()
+        assert get_setting('hospital_name') == 'Cached Hospital'
+
+        statements = []
+        listener = lambda *args: statements.append(args)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            for _ in range(3):
+                assert all_settings()['hospital_name'] == 'Cached Hospital'
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert statements == []
+
+        # A write from another process: the row changes and the version is bumped
+        Setting.query.filter_by(key='hospital_name').first().value = 'Renamed Hospital'
+        Setting.query.filter_by(key='settings_version').first().value = '99'
+        db.session.commit()
+        assert get_setting('hospital_name') == 'Cached Hospital'
+        monkeypatch.setitem(app.config, 'SETTINGS_CHECK_INTERVAL', 0)
+        assert get_setting('hospital_name') == 'Renamed Hospital'
+
+def test_registration_stats_follow_inserts_edits_and_deletes(app):
+    from app import registration_stats
+    from app.models import RegistrationCount
+
+    with app.app_context():
+        def register(staff_id, gender, age):
+            patient = Patient(
+                staff_id=staff_id, patient_id=f'HOS-{staff_id}', first_name='Stat',
+                last_name='Patient', department='HR', gender=gender,
+                date_of_birth=date(1980, 1, 1), age=age, contact_phone='555-0000',
+                race='African', nationality='Nigerian', company='DCT', screening_year=2019
+            )
+            db.session.add(patient)
+            db.session.flush()
+            registration_stats.patient_added(patient)
+            db.session.commit()
+            return patient
+
+        register('ST1', 'Male', 45)
+        female = register('ST2', 'Female', 30)
+        register('ST3', 'Female', 41)
+        assert registration_stats.registration_stats('DCT', 2019) == {
+            'total': 3, 'today': 3, 'male': 1, 'female': 2, 'over_40': 2, 'under_40': 1}
+
+        registration_stats.patient_removed(female)
+        female.age = 50
+        registration_stats.patient_added(female)
+        db.session.commit()
+        assert registration_stats.registration_stats('DCT', 2019)['over_40'] == 3
+
+        registration_stats.patient_removed(female)
+        db.session.delete(female)
+        db.session.commit()
+        expected = {'total': 2, 'today': 2, 'male': 1, 'female': 1, 'over_40': 2, 'under_40': 0}
+        assert registration_stats.registration_stats('DCT', 2019) == expected
+
+        registration_stats.rebuild('DCT', 2019)
+        db.session.commit()
+        assert registration_stats.registration_stats('DCT', 2019) == expected
+        assert RegistrationCount.query.filter_by(company='DCT', screening_year=2019).count() == 2
+
+        # A batch lands in existing and new buckets through one upsert
+        registered = datetime(2019, 3, 1, 9)
+        registration_stats.patients_imported([
+            {'company': 'DCT', 'screening_year': 2019, 'date_registered': registered, 'gender': gender, 'age': age}
+            for gender, age in [('Male', 45), ('Male', 46), ('Female', 20)]])
+        registration_stats.patients_imported([
+            {'company': 'DCT', 'screening_year': 2019, 'date_registered': registered, 'gender': 'Male', 'age': 50}])
+        db.session.commit()
+        counts = RegistrationCount.query.filter_by(company='DCT', screening_year=2019, day=registered.date())
+        assert sorted((c.gender, c.over_40, c.count) for c in counts) == [('Female', False, 1), ('Male', True, 3)]
+
+def test_audit_events_are_buffered_and_written_in_batches(app, monkeypatch):
+    from app.audit import audit_writer
+    from app.models import AuditLog
+
+    monkeypatch.setitem(app.config, 'AUDIT_WRITE_INLINE', False)
+    with app.app_context():
+        role = Role(name='Unsaved')
+        db.session.add(role)
+        for i in range(3):
+            audit_writer.log('TEST_EVENT', f'event {i}')
+        assert AuditLog.query.filter_by(action='TEST_EVENT').count() == 0
+
+        db.session.rollback()
+        audit_writer.flush(app)
+        events = AuditLog.query.filter_by(action='TEST_EVENT').order_by(AuditLog.id).all()
+        assert [e.details for e in events] == ['event 0', 'event 1', 'event 2']
+        # Logging neither committed nor flushed the caller's session
+        assert Role.query.filter_by(name='Unsaved').first() is None
+
+def test_audit_trail_keyset_pagination(client, app):
+    from app.audit import audit_page
+    from app.models import AuditLog
+
+    with app.app_context():
+        base = datetime(2020, 1, 1, 12, 0, 0)
+        db.session.add_all([
+            AuditLog(action='USER_LOGIN' if i % 2 else 'EDIT_PATIENT', details=f'event {i}',
+                     timestamp=base + timedelta(minutes=i // 2)) # Pairs share a timestamp
+            for i in range(25)
+        ])
+        db.session.commit()
+
+        day = {'start': date(2020, 1, 1), 'end': date(2020, 1, 1)}
+        seen, cursor = [], None
+        while True:
+            page = audit_page(after=cursor, per_page=10, **day)
+            seen.extend(log.details for log in page)
+            if not page.next_cursor:
+                break
+            cursor = page.next_cursor
+        assert seen == [f'event {i}' for i in range(24, -1, -1)]
+
+        # Back from the last page to the one before it
+        newer = audit_page(before=page.prev_cursor, per_page=10, **day)
+        assert [log.details for log in newer] == [f'event {i}' for i in range(14, 4, -1)]
+        assert newer.next_cursor and newer.prev_cursor
+
+        logins = audit_page(action='USER_LOGIN', per_page=50, **day)
+        assert len(logins) == 12 and logins.next_cursor is None
+        assert len(audit_page(start=date(2019, 12, 31), end=date(2019, 12, 31))) == 0
+
+        perm = Permission(name='view_audit_log')
+        role = Role(name='Auditor')
+        role.permissions.append(perm)
+        user = User(first_name='audit', last_name='user', phone_number='audit123', password='password')
+        user.roles.append(role)
+        db.session.add_all([perm, role, user])
+        db.session.commit()
+
+    client.post('/auth/login', data={'phone_number': 'audit123', 'password': 'password'})
+    response = client.get('/admin/audit_trails?action=edit_patient&start=2020-01-01&end=2020-01-01')
+    assert response.status_code == 200
+    assert b'event 24' in response.data and b'event 23' not in response.data
+    assert b'Older' not in response.data # All 13 fit on one page
+
+def test_admin_notifications_are_pushed_over_socketio(client, app):
+    from app import socketio
+    from app.audit import audit_writer
+
+    with app.app_context():
+        perm = Permission.query.filter_by(name='manage_roles').first() or Permission(name='manage_roles')
+        role = Role(name='Notified')
+        role.permissions.append(perm)
+        admin = User(first_name='notify', last_name='admin', phone_number='notify123', password='password')
+        admin.roles.append(role)
+        db.session.add_all([role, admin])
+        db.session.commit()
+        audit_writer.log('REVOKE_TEMP_CODE', 'Missed while offline')
+
+    client.get('/auth/logout')
+    client.post('/auth/login', data={'phone_number': 'notify123', 'password': 'password'})
+    socket = socketio.test_client(app, flask_test_client=client)
+    catch_up = [e for e in socket.get_received() if e['name'] == 'notifications']
+    assert len(catch_up) == 1
+    assert any(n['details'] == 'Missed while offline' for n in catch_up[0]['args'][0])
+
+    with app.app_context():
+        audit_writer.log('GENERATE_TEMP_CODE', 'Pushed live')
+        audit_writer.log('USER_LOGIN', 'Not notifiable')
+    pushed = [e['args'][0] for e in socket.get_received() if e['name'] == 'notification']
+    assert [n['details'] for n in pushed] == ['Pushed live']
+
+    response = client.post('/admin/api/notifications/mark_read', json={'ids': [pushed[0]['id']]})
+    assert response.status_code == 200
+    assert [e['name'] for e in socket.get_received()] == ['notifications_read']
+    socket.disconnect()
+
+def test_audit_log_archival_keeps_events_searchable(app, tmp_path, monkeypatch):
+    import fcntl
+    import gzip
+    import json
+    import pytest
+    from app.audit import audit_page
+    from app.audit_archive import archive_audit_logs, load_index
+    from app.models import AuditLog
+
+    monkeypatch.setitem(app.config, 'AUDIT_ARCHIVE_DIR', str(tmp_path))
+    with app.app_context():
+        db.session.add_all([
+            AuditLog(action='OLD_EVENT', details=f'old {i}', timestamp=datetime(2015, 1 + i % 2, 10, 8, i))
+            for i in range(6)
+        ])
+        db.session.commit()
+        live_before = AuditLog.query.count()
+
+        run = archive_audit_logs(older_than_days=9 * 365)
+        assert run['archived'] == 6
+        assert run['live_rows_before'] == live_before
+        assert run['live_rows_after'] == live_before - 6
+        assert AuditLog.query.filter_by(action='OLD_EVENT').count() == 0
+
+        index = load_index()
+        assert sorted(index['segments']) == ['audit-2015-01.ndjson.gz', 'audit-2015-02.ndjson.gz']
+        assert sum(s['rows'] for s in index['segments'].values()) == 6
+        with gzip.open(tmp_path / 'audit-2015-02.ndjson.gz', 'rt') as f:
+            assert len(f.readlines()) == 3
+
+        # A second run appends to the existing segment rather than rewriting it
+        db.session.add(AuditLog(action='OLD_EVENT', details='old 6', timestamp=datetime(2015, 2, 20)))
+        db.session.commit()
+        assert archive_audit_logs(older_than_days=9 * 365)['archived'] == 1
+        assert load_index()['segments']['audit-2015-02.ndjson.gz']['rows'] == 4
+        assert len(load_index()['runs']) == 2
+
+        page = audit_page(action='OLD_EVENT', per_page=5)
+        assert [log.details for log in page] == ['old 6', 'old 5', 'old 3', 'old 1', 'old 4']
+        older = audit_page(action='OLD_EVENT', after=page.next_cursor, per_page=5)
+        assert [log.details for log in older] == ['old 2', 'old 0'] and older.next_cursor is None
+        newer = audit_page(action='OLD_EVENT', before=older.prev_cursor, per_page=5)
+        assert [log.details for log in newer] == [log.details for log in page]
+        assert all(log.archived for log in page)
+
+        # Past the end of the live table the archive continues the unfiltered trail
+        everything = audit_page(per_page=1000)
+        assert [log.details for log in everything][-7:] == ['old 6', 'old 5', 'old 3', 'old 1', 'old 4', 'old 2', 'old 0']
+
+        # A batch written again after a crash is read back once
+        from app.audit_archive import _append, _archive_lock, search_archive
+        with gzip.open(tmp_path / 'audit-2015-01.ndjson.gz', 'rt') as f:
+            _append('audit-2015-01.ndjson.gz', [json.loads(line) for line in f])
+        assert [log.details for log in search_archive(action='OLD_EVENT')] == \
+            ['old 6', 'old 5', 'old 3', 'old 1', 'old 4', 'old 2', 'old 0']
+
+        # The run lock is an flock on the directory, so other processes are kept out too
+        with _archive_lock(), open(tmp_path / '.lock', 'w') as other:
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+def test_message_history_pages_and_unread_counts(client, app):
+    from app.models import Message, ChatRoom
+
+    with app.app_context():
+        alice = User(first_name='alice', last_name='chat', phone_number='chat-alice', password='password')
+        bob = User(first_name='bob', last_name='chat', phone_number='chat-bob', password='password')
+        carol = User(first_name='carol', last_name='chat', phone_number='chat-carol', password='password')
+        db.session.add_all([alice, bob, carol])
+        db.session.commit()
+        base = datetime(2026, 3, 1, 9, 0)
+        for i in range(7):
+            sender, recipient = (alice, bob) if i % 2 else (bob, alice)
+            db.session.add(Message(sender_id=sender.id, recipient_id=recipient.id, body=f'dm {i}',
+                                   timestamp=base + timedelta(minutes=i)))
+        db.session.add(Message(sender_id=carol.id, recipient_id=alice.id, body='hi from carol', timestamp=base))
+        room = ChatRoom(name='Clinic', creator_id=bob.id)
+        room.participants.extend([alice, bob])
+        db.session.add(room)
+        db.session.flush()
+        db.session.add_all([Message(sender_id=bob.id, room_id=room.id, body=f'room {i}',
+                                    timestamp=base + timedelta(minutes=i)) for i in range(3)])
+        db.session.commit()
+        bob_id, carol_id, room_id = bob.id, carol.id, room.id
+
+    client.get('/auth/logout')
+    client.post('/auth/login', data={'phone_number': 'chat-alice', 'password': 'password'})
+
+    response = client.get('/messaging/')
+    assert response.status_code == 200 and b'unread-badge' in response.data
+
+    unread = client.get('/messaging/api/unread').get_json()
+    assert unread == {'total': 5, 'by_sender': {str(bob_id): 4, str(carol_id): 1}}
+
+    first = client.get(f'/messaging/api/history?with={bob_id}&limit=3').get_json()
+    assert [m['body'] for m in first['messages']] == ['dm 4', 'dm 5', 'dm 6']
+    second = client.get(f'/messaging/api/history?with={bob_id}&limit=3&before={first["next_cursor"]}').get_json()
+    assert [m['body'] for m in second['messages']] == ['dm 1', 'dm 2', 'dm 3']
+    last = client.get(f'/messaging/api/history?with={bob_id}&limit=3&before={second["next_cursor"]}').get_json()
+    assert [m['body'] for m in last['messages']] == ['dm 0'] and last['next_cursor'] is None
+
+    room_page = client.get(f'/messaging/api/history?room={room_id}').get_json()
+    assert [m['body'] for m in room_page['messages']] == ['room 0', 'room 1', 'room 2']
+
+    assert client.post('/messaging/api/read', json={'with': bob_id}).get_json() == {'marked': 4}
+    assert client.get('/messaging/api/unread').get_json()['by_sender'] == {str(carol_id): 1}
+
+    client.get('/auth/logout')
+    client.post('/auth/login', data={'phone_number': 'chat-carol', 'password': 'password'})
+    assert client.get(f'/messaging/api/history?room={room_id}').status_code == 403
+
+def test_database_socketio_queue_relays_between_processes(app, monkeypatch):
+    import json
+    from app.models import SocketIOMessage
+    from app.socketio_queue import DatabaseManager, socketio_options
+
+    # Two managers stand in for two worker processes sharing the database
+    sender, receiver = DatabaseManager(app), DatabaseManager(app)
+    receiver.last_id = receiver.latest_id()
+    sender._publish({'method': 'emit', 'event': 'job_status', 'data': [{'id': 7}], 'namespace': '/',
+                     'room': 42, 'skip_sid': None, 'callback': None, 'binary': False, 'host_id': sender.host_id})
+
+    relayed = json.loads(next(receiver._listen()))
+    assert relayed['event'] == 'job_status' and relayed['room'] == 42
+    assert relayed['host_id'] == sender.host_id # The sending process skips its own messages
+    assert receiver.last_id == receiver.latest_id()
+
+    monkeypatch.setitem(app.config, 'SOCKETIO_MESSAGE_TTL', -1)
+    with app.app_context():
+        receiver._prune()
+        assert SocketIOMessage.query.count() == 0
+
+    # Ids are not reused once the table is emptied, so the receiver still sees the next event
+    sender._publish({'method': 'emit', 'event': 'after_prune', 'data': [], 'namespace': '/', 'room': 42,
+                     'skip_sid': None, 'callback': None, 'binary': False, 'host_id': sender.host_id})
+    assert json.loads(next(receiver._listen()))['event'] == 'after_prune'
+
+    monkeypatch.setitem(app.config, 'SOCKETIO_MESSAGE_QUEUE', 'database')
+    assert isinstance(socketio_options(app)['client_manager'], DatabaseManager)
+    monkeypatch.setitem(app.config, 'SOCKETIO_MESSAGE_QUEUE', 'redis://localhost:6379/0')
+    assert socketio_options(app) == {'message_queue': 'redis://localhost:6379/0', 'channel': 'flask-socketio'}
+
+def test_full_patient_loader_uses_a_fixed_number_of_queries(app):
+    from sqlalchemy import event
+    from app.models import Consultation, ECG
+    from app.patient_records import load_full_patients, load_full_patient, PATIENT_RECORDS
+
+    with app.app_context():
+        patients = [Patient(staff_id=f'LOAD{i}', patient_id=f'HOS-LOAD{i}', first_name='Load', last_name=f'Test{i}',
+                            department='HR', gender='Male', date_of_birth=date(1980, 1, 1), age=45,
+                            contact_phone='555-0000', race='African', nationality='Nigerian',
+                            company='DCT', screening_year=2018) for i in range(30)]
+        db.session.add_all(patients)
+        db.session.flush()
+        db.session.add_all([Consultation(patient_id=p.id) for p in patients[::2]])
+        db.session.add(ECG(patient_id=patients[1].id))
+        db.session.commit()
+        ids = [p.id for p in reversed(patients)]
+        db.session.expunge_all()
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            loaded = load_full_patients(ids + [999999])
+            # Reading every record afterwards must not trigger lazy loads
+            records = [[getattr(p, name) for name in PATIENT_RECORDS] for p in loaded]
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        assert len(statements) == 1 + len(PATIENT_RECORDS)
+        assert [p.id for p in loaded] == ids
+        assert sum(r[0] is not None for r in records) == 15
+        assert load_full_patient(patients[1].id).ecg is not None
+        assert load_full_patient(999999) is None
+
+def test_patient_access_paths_use_their_indexes(app):
+    from app.patient_index_benchmark import run_benchmark
+
+    with app.app_context():
+        result = run_benchmark(rows=3000, repeat=1)
+
+    paths = {path['name']: path for path in result['paths']}
+    assert 'USE TEMP B-TREE FOR ORDER BY' in paths['yearly_records']['before']['plan']
+    assert paths['yearly_records']['after']['plan'] == [
+        'SEARCH patient USING INDEX ix_patient_company_year_registered (company=? AND screening_year=?)']
+    assert paths['all_patients']['after']['plan'] == ['SCAN patient USING INDEX ix_patient_date_registered']
+    assert paths['latest_by_staff_id']['after']['plan'] == [
+        'SEARCH patient USING INDEX ix_patient_staff_id_year (staff_id=?)']
+    assert 'COVERING INDEX ix_patient_year_patient_id' in paths['existing_patient_ids']['after']['plan'][0]
+    assert {name for name, path in paths.items() if path['already_indexed']} == {
+        'staff_id_search', 'existing_staff_ids', 'cohort_ids'}
+    for path in result['paths']:
+        assert not any('TEMP B-TREE' in step or step == 'SCAN patient' for step in path['after']['plan'])
+
+def test_patient_listing_pages_by_cursor_with_cached_totals(client, app):
+    from datetime import datetime
+    from sqlalchemy import event
+    from app import registration_stats
+    from app.patient_listing import patient_page
+
+    with app.app_context():
+        for i in range(25):
+            patient = Patient(staff_id=f'LIST{i}', patient_id=f'HOS-LIST{i}', first_name='List', last_name=f'Test{i}',
+                              department='Kiln' if i % 5 == 0 else 'HR', gender='Female' if i % 2 else 'Male',
+                              date_of_birth=date(1980, 1, 1), age=45, contact_phone='555-0000', race='African',
+                              nationality='Nigerian', company='DCT', screening_year=2016,
+                              # Two patients per second, so pages have to break ties on id
+                              date_registered=datetime(2016, 3, 1, 9, 0, i // 2))
+            db.session.add(patient)
+            db.session.flush()
+            registration_stats.patient_added(patient)
+        db.session.commit()
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            first = patient_page('DCT', 2016, per_page=10)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert not any('count(' in s.lower() and 'FROM patient' in s for s in statements)
+        assert first.total == 25 and first.prev_cursor is None
+
+        second = patient_page('DCT', 2016, after=first.next_cursor, per_page=10)
+        third = patient_page('DCT', 2016, after=second.next_cursor, per_page=10)
+        assert third.next_cursor is None and len(third) == 5
+        names = [p.staff_id for page in (first, second, third) for p in page]
+        assert names == [f'LIST{i}' for i in reversed(range(25))]
+        back = patient_page('DCT', 2016, before=third.prev_cursor, per_page=10)
+        assert [p.staff_id for p in back] == [p.staff_id for p in second]
+
+        women = patient_page('DCT', 2016, gender='Female', per_page=50)
+        assert women.total == 12 and len(women) == 12
+        kiln = patient_page('DCT', 2016, department='Kiln', per_page=50)
+        assert kiln.total is None and [p.staff_id for p in kiln] == ['LIST20', 'LIST15', 'LIST10', 'LIST5', 'LIST0']
+
+    client.get('/auth/logout')
+    client.post('/auth/login', data={'phone_number': 'admin123', 'password': 'password'})
+    with client.session_transaction() as sess:
+        sess['company'], sess['year'] = 'DCT', 2016
+    response = client.get('/view/yearly?gender=Male')
+    assert response.status_code == 200
+    assert b'13 patients.' in response.data and b'LIST24' in response.data and b'LIST23' not in response.data
+    assert b'Older &raquo;' not in response.data
+    response = client.get('/view/all?department=Kiln')
+    assert response.status_code == 200 and b'LIST20' in response.data
+    client.get('/auth/logout')
+
+def test_completion_worklist_flags_records_in_one_query(client, app):
+    from sqlalchemy import event
+    from app.completion import worklist_page, missing_counts
+    from app.models import FullBloodCount, ECG, DirectorReview
+
+    with app.app_context():
+        patients = [Patient(staff_id=f'WORK{i:02d}', patient_id=f'HOS-WORK{i}', first_name='Work', last_name=f'List{i}',
+                            department='HR', gender='Male', date_of_birth=date(1980, 1, 1), age=45,
+                            contact_phone='555-0000', race='African', nationality='Nigerian',
+                            company='DCP', screening_year=2014) for i in range(12)]
+        db.session.add_all(patients)
+        db.session.flush()
+        db.session.add_all([FullBloodCount(patient_id=p.id) for p in patients[:9]])
+        db.session.add_all([ECG(patient_id=p.id) for p in patients[::3]])
+        db.session.add(DirectorReview(patient_id=patients[0].id))
+        db.session.commit()
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            page = worklist_page('DCP', 2014, per_page=5)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert len(statements) == 1
+        assert [p['staff_id'] for p in page] == [f'WORK{i:02d}' for i in range(5)]
+        assert page.items[0]['completed']['director_review'] and page.items[0]['completed']['ecg']
+        assert page.items[1]['missing'] == ['kidney_function_test', 'lipid_profile', 'liver_function_test', 'ecg',
+                                            'spirometry', 'audiometry', 'consultation', 'director_review']
+        assert page.prev_cursor is None and page.next_cursor == 'WORK04'
+
+        no_fbc = worklist_page('DCP', 2014, missing='full_blood_count', per_page=2)
+        assert [p['staff_id'] for p in no_fbc] == ['WORK09', 'WORK10']
+        rest = worklist_page('DCP', 2014, missing='full_blood_count', after=no_fbc.next_cursor, per_page=2)
+        assert [p['staff_id'] for p in rest] == ['WORK11'] and rest.next_cursor is None
+        back = worklist_page('DCP', 2014, missing='full_blood_count', before=rest.prev_cursor, per_page=2)
+        assert [p['staff_id'] for p in back] == ['WORK09', 'WORK10']
+
+        counts = missing_counts('DCP', 2014)
+        assert counts['patients'] == 12
+        assert counts['missing']['full_blood_count'] == 3 and counts['missing']['ecg'] == 8
+        assert counts['missing']['director_review'] == 11
+
+    client.get('/auth/logout')
+    client.post('/auth/login', data={'phone_number': 'admin123', 'password': 'password'})
+    response = client.get('/results/api/worklist?company=DCP&year=2014&missing=ecg&per_page=3')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [p['staff_id'] for p in data['patients']] == ['WORK01', 'WORK02', 'WORK04']
+    assert data['next_cursor'] == 'WORK04' and data['prev_cursor'] is None
+    assert client.get('/results/api/worklist?company=DCP&year=2014&missing=xray').status_code == 400
+    response = client.get('/results/worklist?company=DCP&year=2014&missing=full_blood_count')
+    assert response.status_code == 200
+    assert b'WORK11' in response.data and b'WORK00' not in response.data and b'Missing FBC (3)' in response.data
+
+    # A year that is not a number falls back to the session's year rather than failing
+    for url in ['/results/worklist?year=abc', '/results/api/worklist?year=abc',
+                '/results/api/lab_values?analyte=hgb&year=abc']:
+        assert client.get(url).status_code == 200
+    client.get('/auth/logout')
+
+def test_lab_values_are_stored_as_numbers_with_text_kept(client, app):
+    from app.models import FullBloodCount
+    from app.lab_values import analyte_range, analyte_summary
+
+    with app.app_context():
+        patients = [Patient(staff_id=f'LAB{i}', patient_id=f'HOS-LAB{i}', first_name='Lab', last_name=f'Value{i}',
+                            department='HR', gender='Female', date_of_birth=date(1980, 1, 1), age=45,
+                            contact_phone='555-0000', race='African', nationality='Nigerian',
+                            company='DCP', screening_year=2013) for i in range(5)]
+        db.session.add_all(patients)
+        db.session.flush()
+        for patient, hgb in zip(patients[1:], ['13.2', '08', '<5', ' 9.75 ']):
+            db.session.add(FullBloodCount(patient_id=patient.id, hgb=hgb))
+        db.session.commit()
+        ids = [p.id for p in patients]
+
+    client.get('/auth/logout')
+    client.post('/auth/login', data={'phone_number': 'admin123', 'password': 'password'})
+    client.post(f'/results/full_blood_count/{ids[0]}', data={'hgb': '11', 'wbc': '4.5 L', 'plt': '', 'rbc': '4.50'})
+    response = client.get(f'/results/full_blood_count/{ids[0]}')
+    assert b'value="4.5 L"' in response.data and b'value="11"' in response.data
+    assert b'value="4.50"' in response.data
+
+    with app.app_context():
+        record = FullBloodCount.query.filter_by(patient_id=ids[0]).one()
+        assert (record.hgb_value, record.hgb_text) == (11.0, None)
+        assert (record.wbc_value, record.wbc_text, record.wbc) == (None, '4.5 L', '4.5 L')
+        assert record.plt is None
+        # A number that would read back differently keeps the entry as typed
+        assert (record.rbc_value, record.rbc_text, record.rbc) == (4.5, '4.50', '4.50')
+        items = dict(record.result_items())
+        assert items['rbc'] == '4.50' and items['hgb'] == '11'
+        assert not {'rbc_value', 'rbc_text', 'id', 'patient_id'} & set(items)
+        assert FullBloodCount.query.filter(FullBloodCount.hgb < 10).filter(
+            FullBloodCount.patient_id.in_(ids)).count() == 2
+
+        low = analyte_range('hgb', 'DCP', 2013, high=10)
+        assert [(p['staff_id'], p['value']) for p in low] == [('LAB2', '08'), ('LAB4', '9.75')]
+        assert [p['staff_id'] for p in analyte_range('hgb', 'DCP', 2013, low=10)] == ['LAB0', 'LAB1']
+        assert analyte_summary('hgb', 'DCP', 2013) == {'count': 4, 'min': 8.0, 'max': 13.2, 'mean': 10.49}
+
+    response = client.get('/results/api/lab_values?analyte=hgb&high=10&company=DCP&year=2013')
+    assert [p['staff_id'] for p in response.get_json()['patients']] == ['LAB2', 'LAB4']
+    assert client.get('/results/api/lab_values?analyte=psa').status_code == 400
+    client.get('/auth/logout')